@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+__author__ = "Trevor Maco <tmaco@cisco.com>, Josh Ingeniero <jingenie@cisco.com>"
+__copyright__ = "Copyright (c) 2023 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+import collections
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class EnterpriseAgentDirectory:
+    """
+    In-process directory of Enterprise Agents, indexed by agent name. The index is refreshed in the background once
+    it is older than the TTL; lookups are served from the (possibly stale) index while the refresh runs. With a shared
+    cache, an index downloaded by another worker process is reused instead of downloading it again
+    """
+
+    # Shared cache key of the index
+    SHARED_KEY = 'index'
+
+    def __init__(self, fetch_agents, ttl, miss_refresh_interval=30, shared=None):
+        """
+        :param fetch_agents: callable returning the list of ThousandEyes agent dictionaries, or None on failure
+        :param ttl: seconds before the index is considered stale
+        :param miss_refresh_interval: minimum seconds between refreshes triggered by unknown agent names
+        :param shared: optional shared_store.SharedCache (multi-worker deployments)
+        """
+        self.fetch_agents = fetch_agents
+        self.ttl = ttl
+        self.miss_refresh_interval = miss_refresh_interval
+        self.shared = shared
+
+        self._index = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._loading = None
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_failures = 0
+        self.shared_loads = 0
+
+    def lookup(self, agent_name):
+        """
+        Find Enterprise Agent unique ID based on agent name
+        :param agent_name: Enterprise agent name
+        :return: Enterprise Agent ID or None if not found
+        """
+        # First lookup, nothing to serve yet: load synchronously
+        if self._loaded_at is None:
+            self._initial_load()
+
+        refresh_age = None
+        with self._lock:
+            agent_id = self._index.get(agent_name)
+            age = time.monotonic() - self._loaded_at if self._loaded_at is not None else None
+
+            if agent_id is not None:
+                self.hits += 1
+                if age > self.ttl:
+                    refresh_age = self.ttl
+            else:
+                self.misses += 1
+                # Agent may have been added since the last refresh, pick it up for the next request
+                if age is not None and age > self.miss_refresh_interval:
+                    refresh_age = self.miss_refresh_interval
+
+        if refresh_age is not None:
+            self.refresh_in_background(max_age=refresh_age)
+        return agent_id
+
+    def refresh(self, max_age=None):
+        """
+        Download the Enterprise Agent list and rebuild the name index (the previous index is kept on failure)
+        :param max_age: seconds an index from the shared cache can be old to be used instead (default: the TTL)
+        :return: True if the index was rebuilt
+        """
+        index, age = self._shared_index(self.ttl if max_age is None else max_age)
+        if index is None:
+            try:
+                agents = self.fetch_agents()
+            except Exception as e:
+                logger.error(f'Enterprise Agent directory refresh failed: {str(e)}')
+                agents = None
+
+            if agents is not None:
+                index, age = {agent['agentName']: agent['agentId'] for agent in agents}, 0
+                if self.shared is not None:
+                    self.shared.put(self.SHARED_KEY, index, self.ttl)
+
+        with self._lock:
+            self._refreshing = False
+            if index is None:
+                self.refresh_failures += 1
+                return False
+
+            # Swap in the new index in one assignment, readers never see a partial index
+            self._index = index
+            self._loaded_at = time.monotonic() - age
+            self.refreshes += 1
+            return True
+
+    def _initial_load(self):
+        """
+        Load the index on the first lookups: concurrent callers share one download instead of each starting their own
+        """
+        with self._lock:
+            if self._loaded_at is not None:
+                return
+            loading = self._loading
+            owner = loading is None
+            if owner:
+                loading = self._loading = threading.Event()
+
+        if not owner:
+            loading.wait()
+            return
+
+        try:
+            self.refresh()
+        finally:
+            with self._lock:
+                self._loading = None
+            loading.set()
+
+    def _shared_index(self, max_age):
+        """
+        Index downloaded by another worker process, if it is recent enough
+        :return: (index, age in seconds), (None, None) if there is none
+        """
+        if self.shared is None:
+            return None, None
+
+        entry = self.shared.get(self.SHARED_KEY)
+        if entry is None:
+            return None, None
+        age = max(0.0, time.time() - entry[1])
+        if age > max_age:
+            return None, None
+
+        with self._lock:
+            self.shared_loads += 1
+        return entry[0], age
+
+    def refresh_in_background(self, max_age=None):
+        """
+        Start a background refresh unless one is already running
+        :param max_age: see refresh
+        """
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        threading.Thread(target=self.refresh, args=(max_age,), name='agent-directory-refresh', daemon=True).start()
+
+    def stats(self):
+        """
+        Snapshot of directory state and counters
+        :return: dictionary of directory statistics
+        """
+        with self._lock:
+            age = time.monotonic() - self._loaded_at if self._loaded_at is not None else None
+            return {'agents': len(self._index), 'age': age, 'hits': self.hits, 'misses': self.misses,
+                    'refreshes': self.refreshes, 'refresh_failures': self.refresh_failures,
+                    'shared_loads': self.shared_loads}
+
+
+class EndpointAgentCache:
+    """
+    Bounded LRU cache of Endpoint Agent hostname -> agent id resolutions. Hostnames that were not found are cached
+    for a shorter time, so repeated typos and retries don't reach ThousandEyes again. With a shared cache, hostnames
+    resolved by another worker process are not resolved again
+    """
+
+    # Marker stored for hostnames ThousandEyes did not find
+    NOT_FOUND = object()
+
+    def __init__(self, resolve_agent, max_size, ttl, negative_ttl, resolve_agents=None, shared=None):
+        """
+        :param resolve_agent: callable(hostname) returning the agent id, None if not found (raise on lookup failure)
+        :param max_size: maximum number of cached hostnames
+        :param ttl: seconds a found hostname stays cached
+        :param negative_ttl: seconds a not found hostname stays cached
+        :param resolve_agents: optional callable(hostnames) returning a dictionary of hostname -> agent id in one call
+        (None for hostnames that weren't found, hostnames whose lookup failed are left out)
+        :param shared: optional shared_store.SharedCache (multi-worker deployments)
+        """
+        self.resolve_agent = resolve_agent
+        self.resolve_agents = resolve_agents
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.shared = shared
+
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+        # Counters
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.shared_hits = 0
+
+    def lookup(self, hostname):
+        """
+        Find Endpoint Agent unique ID based on computer hostname
+        :param hostname: Endpoint computer hostname
+        :return: Endpoint Agent ID or None if not found
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(hostname)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(hostname)
+                if entry[0] is self.NOT_FOUND:
+                    self.negative_hits += 1
+                    return None
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        shared = self._lookup_shared([hostname])
+        if hostname in shared:
+            return shared[hostname]
+
+        # Resolve outside the lock; lookup failures propagate and are not cached
+        agent_id = self.resolve_agent(hostname)
+        self._store({hostname: agent_id})
+        return agent_id
+
+    def lookup_many(self, hostnames):
+        """
+        Find Endpoint Agent unique IDs for several hostnames, resolving every hostname that isn't cached in one batched
+        lookup (if the cache has a batch resolver). A failed lookup only fails its own hostname, which isn't cached
+        :param hostnames: Endpoint computer hostnames
+        :return: dictionary of hostname -> Endpoint Agent ID or None if not found (hostnames whose lookup failed are
+        left out)
+        """
+        found = {}
+        missing = []
+        now = time.monotonic()
+        with self._lock:
+            for hostname in hostnames:
+                entry = self._entries.get(hostname)
+                if entry is not None and entry[1] > now:
+                    self._entries.move_to_end(hostname)
+                    if entry[0] is self.NOT_FOUND:
+                        self.negative_hits += 1
+                        found[hostname] = None
+                    else:
+                        self.hits += 1
+                        found[hostname] = entry[0]
+                else:
+                    self.misses += 1
+                    missing.append(hostname)
+
+        shared = self._lookup_shared(missing)
+        found.update(shared)
+        missing = [hostname for hostname in missing if hostname not in shared]
+
+        if len(missing) > 1 and self.resolve_agents is not None:
+            resolved = self.resolve_agents(missing)
+            resolved = {hostname: resolved[hostname] for hostname in missing if hostname in resolved}
+        else:
+            resolved = {}
+            for hostname in missing:
+                try:
+                    resolved[hostname] = self.resolve_agent(hostname)
+                except Exception as e:
+                    logger.error(f'Endpoint Agent lookup failed for {hostname}: {str(e)}')
+
+        self._store(resolved)
+        found.update(resolved)
+        return {hostname: found[hostname] for hostname in hostnames if hostname in found}
+
+    def _lookup_shared(self, hostnames):
+        """
+        Hostnames resolved by another worker process, cached here for the rest of their TTL
+        :return: dictionary of hostname -> agent id (None if not found), for the hostnames in the shared cache
+        """
+        if self.shared is None or not hostnames:
+            return {}
+
+        entries = self.shared.get_many(hostnames)
+        found = {}
+        with self._lock:
+            now, elapsed = time.monotonic(), time.time()
+            for hostname, (agent_id, stored_at) in entries.items():
+                ttl = self.ttl if agent_id is not None else self.negative_ttl
+                expires_at = now + ttl - (elapsed - stored_at)
+                if expires_at <= now:
+                    continue
+                self._entries[hostname] = (agent_id if agent_id is not None else self.NOT_FOUND, expires_at)
+                self._entries.move_to_end(hostname)
+                self.shared_hits += 1
+                found[hostname] = agent_id
+            self._evict()
+        return found
+
+    def _store(self, resolved):
+        """
+        Cache resolved hostnames (not found ones for the shorter negative TTL), evicting the least recently used
+        """
+        with self._lock:
+            now = time.monotonic()
+            for hostname, agent_id in resolved.items():
+                if agent_id is None:
+                    self._entries[hostname] = (self.NOT_FOUND, now + self.negative_ttl)
+                else:
+                    self._entries[hostname] = (agent_id, now + self.ttl)
+                self._entries.move_to_end(hostname)
+            self._evict()
+
+        if self.shared is not None:
+            self.shared.put_many({hostname: agent_id for hostname, agent_id in resolved.items()
+                                  if agent_id is not None}, self.ttl)
+            self.shared.put_many({hostname: None for hostname, agent_id in resolved.items() if agent_id is None},
+                                 self.negative_ttl)
+
+    def _evict(self):
+        """
+        Drop the least recently used hostnames beyond the maximum size (lock held)
+        """
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, hostname=None):
+        """
+        Drop a cached hostname (e.g. after the agent was re-registered), or every hostname if none is given
+        :param hostname: Endpoint computer hostname
+        """
+        with self._lock:
+            if hostname is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(hostname, None)
+
+        if self.shared is not None:
+            self.shared.delete(hostname)
+
+    def stats(self):
+        """
+        Snapshot of cache state and counters
+        :return: dictionary of cache statistics
+        """
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'negative_hits': self.negative_hits,
+                    'misses': self.misses, 'evictions': self.evictions, 'shared_hits': self.shared_hits}
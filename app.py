@@ -17,59 +17,124 @@ __author__ = "Trevor Maco <tmaco@cisco.com>, Josh Ingeniero <jingenie@cisco.com>
 __copyright__ = "Copyright (c) 2023 Cisco and/or its affiliates."
 __license__ = "Cisco Sample Code License, Version 1.1"
 
-import json
-import logging
 import os
 import re
+import threading
+import time
 
-import urllib3
-from apscheduler.schedulers.background import BackgroundScheduler
-from flask import Flask, jsonify, request
-from rich.console import Console
+from flask import Flask, Response, abort, g, jsonify, request
 from rich.panel import Panel
-from webexteamssdk import WebexTeamsAPI
-from dotenv import load_dotenv
 
+import bot
+import cards
 import config
-import generate_result
-import test_creation
-
-# Load env variables
-load_dotenv()
-BOT_TOKEN = os.getenv("BOT_TOKEN")
+import webhooks
+from async_engine import AsyncEngine
+from bot import api, console, job_queue, notify_dropped, outbox, process_card, sender_store, webhook_dedupe
+from metrics import registry
+from tracing import tracer
+from work_queue import WorkQueue
 
 # Global Variables
+STARTED_AT = time.perf_counter()
 app = Flask(__name__)
 
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+# Result deliveries: with the durable job queue, the worker processes (worker.py) poll and send them
+if job_queue is None:
+    bot.start_delivery_scheduler()
+
+# Background work queue (for running card submissions off the webhook thread), unused with the durable job queue
+work_queue = None
+if job_queue is None:
+    work_queue = WorkQueue(config.WORK_QUEUE_DEPTH, config.WORK_QUEUE_WORKERS, overflow=config.WORK_QUEUE_OVERFLOW,
+                           name='card-worker')
+    work_queue.start()
+
+# Optional asyncio execution engine (launches tests, polls results and posts cards on one event loop)
+async_engine = None
+if config.EXECUTION_ENGINE == 'asyncio' and job_queue is None:
+    async_engine = AsyncEngine(os.getenv("THOUSAND_EYES_TOKEN"), outbox)
+    async_engine.start()
+
+# Pipeline metrics (see /metrics), components without their own metrics are read at scrape time
+WEBHOOK_SECONDS = registry.histogram('chatbot_webhook_duration_seconds', 'Webhook handling time',
+                                     labels=('endpoint', 'status'))
+registry.gauge_from('chatbot_scheduled_jobs', 'Jobs waiting in the background scheduler',
+                    lambda: len(sender_store.get_jobs()))
+if work_queue is not None:
+    registry.gauge_from('chatbot_work_queue_queued', 'Card submissions waiting for a worker',
+                        lambda: work_queue.stats()['queued'])
+    registry.gauge_from('chatbot_work_queue_busy', 'Workers running a card submission',
+                        lambda: work_queue.stats()['busy'])
+    registry.gauge_from('chatbot_work_queue_workers', 'Card submission workers', lambda: work_queue.workers)
+    registry.counter_from('chatbot_work_queue_requests_total', 'Card submissions by outcome',
+                          lambda: {outcome: work_queue.stats()[outcome]
+                                   for outcome in ('submitted', 'rejected', 'dropped', 'completed', 'failed')},
+                          labels=('outcome',))
+registry.counter_from('chatbot_webhook_deliveries_total', 'Webhook deliveries by result (duplicates are ignored)',
+                      lambda: {result: webhook_dedupe.stats()[result] for result in ('claimed', 'duplicates')},
+                      labels=('result',))
+if bot.scheduler_leader is not None:
+    registry.gauge_from('chatbot_scheduler_leader', 'Whether this worker process polls result deliveries',
+                        lambda: int(bot.scheduler_leader.is_leader))
+if job_queue is not None:
+    registry.gauge_from('chatbot_job_queue_jobs', 'Card submissions in the durable job queue (every worker)',
+                        lambda: {state: count for state, count in job_queue.depth().items() if state != 'oldest'},
+                        labels=('state',))
+    registry.gauge_from('chatbot_job_queue_oldest_seconds', 'Age of the oldest card submission waiting for a worker',
+                        lambda: job_queue.depth()['oldest'] or 0)
+    registry.counter_from('chatbot_job_queue_requests_total', 'Card submissions queued by this process, by outcome',
+                          lambda: {outcome: job_queue.counters()[outcome] for outcome in ('enqueued', 'rejected')},
+                          labels=('outcome',))
+registry.gauge_from('webex_dispatch_backlog', 'Webex messages waiting to be sent', lambda: outbox.stats()['backlog'])
+if async_engine is not None:
+    registry.gauge_from('chatbot_async_active_cards', 'Card submissions in progress on the asyncio engine',
+                        lambda: async_engine.active_cards)
+
+
+@app.before_request
+def start_timer():
+    """
+    Remember when request handling started (see record_request)
+    """
+    g.request_started = time.perf_counter()
 
-# Declare logger (writes all errors and basic calls to app.log)
-logging.basicConfig(filename='app.log', filemode='a', format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
-# Webex API
-api = WebexTeamsAPI(access_token=BOT_TOKEN)
+@app.after_request
+def record_request(response):
+    """
+    Record webhook handling time (the /metrics scrape itself isn't recorded)
+    """
+    if request.endpoint != 'metrics' and 'request_started' in g:
+        WEBHOOK_SECONDS.observe(time.perf_counter() - g.request_started, endpoint=request.endpoint or 'unknown',
+                                status=response.status_code)
+    return response
 
-# Background scheduler (for running ThousandEyes tests as background processes)
-sender_store = BackgroundScheduler()
-sender_store.start()
 
-# Rich Console Instance
-console = Console()
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Pipeline metrics in the Prometheus text format
+    """
+    if not config.METRICS_ENABLED:
+        abort(404)
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
 
 
-def create_webhooks(webhook_name, webhook_url, resource, event):
+@app.route('/trace/<trace_id>', methods=['GET'])
+def trace(trace_id):
     """
-    Create webhooks for chatbot, listen for standard messages and card actions
+    Debug view of a request trace: text timeline, or the raw spans with ?format=json. Spans recorded by other
+    processes are only shown with TRACE_EXPORT_PATH (see tracing.Tracer.get)
     """
-    # Check if a webhook with the same name and target URL already exists
-    existing_webhooks = api.webhooks.list()
-    for webhook in existing_webhooks:
-        if webhook.targetUrl == webhook_url:
-            console.print(f"Webhook {webhook_url} already exists... skipping")
-            return
-
-    api.webhooks.create(webhook_name, webhook_url, resource=resource, event=event)
-    console.print(f'[green]Successfully created webhook at {webhook_url}[/]')
+    if not config.TRACING_ENABLED:
+        abort(404)
+    spans = tracer.get(trace_id)
+    if spans is None:
+        abort(404)
+    if request.args.get('format') == 'json':
+        return jsonify({'trace_id': trace_id, 'spans': spans})
+    return Response(tracer.timeline(trace_id, spans), mimetype='text/plain')
 
 
 @app.route('/', methods=['GET', 'POST'])
@@ -79,125 +144,164 @@ def webhook():
     """
     payload = request.json
     if not payload['data']['personEmail'] == config.BOT_EMAIL:
-        # Message received in bot space which isn't from the bot
-        info = api.messages.get(payload['data']['id']).to_dict()
-        console.print(f'Message: {info}')
-
-        if re.search('network-help', info['text'], re.IGNORECASE):
-            # Network-help command, display test card for user to launch ThousandEyes test
-            api.messages.create(roomId=info['roomId'],
-                                text='Let me help!',
-                                attachments=[json.loads(config.CARD_PAYLOAD)])  # where to load the card
-        else:
-            # All other input, redirect user to network-help command
-            api.messages.create(roomId=info['roomId'], text='Hello! Please enter the "network-help" '
-                                                                             'command to begin the troubleshooting '
-                                                                             'workflow.')
+        # Message received in bot space which isn't from the bot, once (redeliveries of the webhook are ignored)
+        with webhook_dedupe.handling(payload['data']['id']) as claimed:
+            if not claimed:
+                return jsonify({'info': 'Duplicate delivery, ignored'})
+            handle_message(payload)
 
     return jsonify({'info': 'Hello from the ThousandEyes Chatbot!'})
 
 
+def handle_message(payload):
+    """
+    Answer a message sent to the bot (see webhook)
+    """
+    info = api.messages.get(payload['data']['id']).to_dict()
+    console.print(f'Message: {info}')
+
+    if re.search('network-help', info['text'], re.IGNORECASE):
+        # Network-help command, display test card for user to launch ThousandEyes test
+        outbox.messages.create(roomId=info['roomId'],
+                               text='Let me help!',
+                               attachments=[cards.HELP_CARD])  # where to load the card
+    else:
+        # All other input, redirect user to network-help command
+        outbox.messages.create(roomId=info['roomId'], text='Hello! Please enter the "network-help" '
+                                                                        'command to begin the troubleshooting '
+                                                                        'workflow.')
+
+
 @app.route('/card', methods=['GET', 'POST'])
 def card_webhook():
     """
     Respond to card attachment actions (clicking submit), run an endpoint instant test, enterprise instant test,
-    or both with the specified application
+    or both with the specified application. In 'queue' dispatch mode, the card is validated and the test workflow
+    is handed to the background work queue, so the webhook returns immediately
     """
 
     payload = request.json
-    console.print(f'Card Payload: {payload}')
 
+    # Webex redelivers webhooks that aren't answered in time, a redelivery is dropped before any other call
+    action_id = payload['data']['id']
+    with webhook_dedupe.handling(action_id) as claimed:
+        if not claimed:
+            console.print(f'Duplicate card webhook {action_id}... skipping')
+            return jsonify({'info': 'Duplicate delivery, ignored'})
+
+        console.print(f'Card Payload: {payload}')
+
+        # Every card submission is traced from here to the delivery of its results (see /trace/<id>)
+        trace_id = tracer.new_trace()
+        with tracer.activate(trace_id), tracer.span('webhook.card'):
+            return handle_card(payload, trace_id)
+
+
+def handle_card(payload, trace_id):
+    """
+    Validate a card submission and dispatch its test workflow (see card_webhook)
+    """
     # Extract card attachment actions
-    info = api.attachment_actions.get(payload['data']['id']).to_dict()['inputs']
+    with tracer.span('webex.attachment'):
+        info = api.attachment_actions.get(payload['data']['id']).to_dict()['inputs']
     if info['action'] == 'newTest':
 
         # Submit action detected, sanity check an application has been selected (or there's a custom url)
         if info['IssueSelectVal'] != '' or info['CustomURLVal'] != '':
             # Sanity check at least one value provided
             if info['hostnameVal'] == '' and info['sitenameVal'] == '':
-                api.messages.create(roomId=payload['data']['roomId'],
-                                    text='Please enter at least one of the following: Enterprise Agent Name, Endpoint '
-                                         'Agent Hostname')
+                outbox.messages.create(roomId=payload['data']['roomId'],
+                                       text='Please enter at least one of the following: Enterprise Agent Name, '
+                                            'Endpoint Agent Hostname')
                 return jsonify({'info': 'Not quite... try another request!'})
 
-            # Delete card, user feedback of test received
-            api.messages.delete(messageId=payload['data']['messageId'])
-            api.messages.create(roomId=payload['data']['roomId'],
-                                text='Your test request has been received. Test results will be '
-                                     'returned in ~5 minutes')
-
-            # Endpoint Agent Case
-            if info['hostnameVal'] != '':
-                cardinfo = {'hostnameVal': info['hostnameVal'], 'IssueSelectVal': info['IssueSelectVal'],
-                            'CustomURLVal': info['CustomURLVal']}
-                console.print(f'[blue]Endpoint[/] Agent Test: {cardinfo}')
-
-                # Find Endpoint Agent Unique ID (required for instant test)
-                agent_id = test_creation.find_endpoint_agent_id(cardinfo['hostnameVal'])
-
-                if agent_id:
-                    # Perform endpoint instant test (select from pre-selected apps, or custom url)
-                    test_result = test_creation.test_selector(agent_id, cardinfo, test_type='endpoint')
-
-                    print("================================================")
-                    console.print(f'ThousandEyes Results: {test_result}')
-                    print("================================================")
-
-                    # Schedule job to return result cards after a specific time, this provides time for test results
-                    # to return (critical) and supports parallel processing
-                    for result in test_result:
-                        try:
-                            generate_result.schedule_result(json.loads(result), payload['data']['roomId'],
-                                                            sender_store,
-                                                            api, cardinfo['hostnameVal'])
-                        except Exception as e:
-                            print(f'There was an exception: {str(e)}')
-                else:
-                    api.messages.create(roomId=payload['data']['roomId'],
-                                        text='Endpoint Agent Name not found, please double check the provided name.')
-
-            # Enterprise Agent Case
-            if info['sitenameVal'] != '':
-                cardinfo = {'sitenameVal': info['sitenameVal'], 'IssueSelectVal': info['IssueSelectVal'],
-                            'CustomURLVal': info['CustomURLVal']}
-                console.print(f'[blue]Enterprise[/] Agent Test: {cardinfo}')
-
-                agent_id = test_creation.find_enterprise_agent_id(cardinfo['sitenameVal'])
-
-                if agent_id:
-                    # Perform endpoint instant test (select from pre-selected apps, or custom url)
-                    test_result = test_creation.test_selector(agent_id, cardinfo, test_type='enterprise')
-
-                    print("================================================")
-                    console.print(f'ThousandEyes Results: {test_result}')
-                    print("================================================")
-
-                    # Schedule job to return result cards after a specific time, this provides time for test results
-                    # to return (critical) and supports parallel processing
-                    for result in test_result:
-                        try:
-                            generate_result.schedule_result(json.loads(result), payload['data']['roomId'],
-                                                            sender_store,
-                                                            api, cardinfo['sitenameVal'])
-                        except Exception as e:
-                            print(f'There was an exception: {str(e)}')
-                else:
-                    api.messages.create(roomId=payload['data']['roomId'],
-                                        text='Enterprise Agent Name not found, please double check the provided name.')
+            # The same card submitted again (ex: double click) is only run once, cards that failed validation above
+            # can still be corrected and submitted
+            card_key = f"card:{payload['data']['messageId']}"
+            with webhook_dedupe.handling(card_key) as claimed:
+                if not claimed:
+                    return jsonify({'info': 'Card already submitted'})
+                if not dispatch_card(payload, info, trace_id, card_key):
+                    return jsonify({'info': 'Busy... try again later!'})
 
         else:
-            api.messages.create(roomId=payload['data']['roomId'],
-                                text='Please select an application to test (or provide your own URL)')
+            outbox.messages.create(roomId=payload['data']['roomId'],
+                                   text='Please select an application to test (or provide your own URL)')
 
     return jsonify({'info': 'Hello from the ThousandEyes Chatbot!'})
 
 
+def dispatch_card(payload, info, trace_id, card_key):
+    """
+    Hand a validated card submission to the configured dispatch (durable job queue, asyncio engine, work queue, or
+    inline), the user is told to try again if it is too busy
+    :param card_key: dedupe key of the card, released if the card is refused
+    :return: False if the card was refused
+    """
+    room_id = payload['data']['roomId']
+    if job_queue is not None:
+        # Hand the card to the worker processes through the durable job queue, return to Webex right away
+        queued = job_queue.put({'data': payload['data'], 'info': info, 'trace_id': trace_id,
+                                'card_key': card_key, 'submitted_at': time.time()})
+        if queued is None:
+            notify_dropped(room_id, card_key)
+            return False
+    elif async_engine is not None:
+        # Hand the test workflow to the asyncio engine, return to Webex right away
+        if not async_engine.submit_card(payload['data'], info, trace_id=trace_id):
+            notify_dropped(room_id, card_key)
+            return False
+    elif config.DISPATCH_MODE == 'queue':
+        # Hand the test workflow to a background worker, return to Webex right away
+        queued = work_queue.submit(process_card, payload['data'], info, trace_id=trace_id,
+                                   submitted_at=time.time(), on_drop=lambda: notify_dropped(room_id, card_key))
+        if not queued:
+            notify_dropped(room_id, card_key)
+            return False
+    else:
+        process_card(payload['data'], info, trace_id=trace_id)
+    return True
+
+
+def desired_webhooks():
+    """
+    Webex Bot Webhooks: standard messages, and card actions
+    """
+    return [{'name': 'ThousandEyes Chatbot All', 'targetUrl': config.WEBHOOK_BASE_URL, 'resource': 'messages',
+             'event': 'all'},
+            {'name': 'ThousandEyes Chatbot Card', 'targetUrl': config.WEBHOOK_BASE_URL + '/card',
+             'resource': 'attachmentActions', 'event': 'created'}]
+
+
+def reconcile_webhooks():
+    """
+    Reconcile the Webex Bot Webhooks with the desired ones (see webhooks.reconcile), report how long it took
+    """
+    start = time.perf_counter()
+    try:
+        outcomes = webhooks.reconcile(api, desired_webhooks(), workers=config.WEBHOOK_RECONCILE_WORKERS)
+    except Exception as e:
+        console.print(f'[red]Unable to reconcile webhooks: {str(e)}[/]')
+        return
+
+    changes = ', '.join(f'{count} {action}' for action, count in sorted(outcomes.items())) or 'nothing to do'
+    console.print(f'[green]Webhooks reconciled in {time.perf_counter() - start:.2f}s ({changes})[/]')
+
+
+def register_webhooks():
+    """
+    Reconcile the Webex Bot Webhooks in the background, the server listens meanwhile (existing webhooks keep being
+    delivered to it)
+    """
+    threading.Thread(target=reconcile_webhooks, name='webhook-reconcile', daemon=True).start()
+
+
 if __name__ == '__main__':
-    # Create Webex Bot Webhooks
-    console.print(Panel.fit(f"Creating Webhooks", title="Step 1"))
-    create_webhooks('ThousandEyes Chatbot All', config.WEBHOOK_BASE_URL, 'messages', 'all')
-    create_webhooks('ThousandEyes Chatbot Card', config.WEBHOOK_BASE_URL + '/card', 'attachmentActions', 'created')
+    # Reconcile Webex Bot Webhooks
+    console.print(Panel.fit(f"Reconciling Webhooks", title="Step 1"))
+    register_webhooks()
 
-    console.print(Panel.fit(f"Listening for Requests", title="Step 2"))
+    console.print(Panel.fit(f"Listening for Requests (started in {time.perf_counter() - STARTED_AT:.2f}s)",
+                            title="Step 2"))
 
     app.run(port=4000)
@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+__author__ = "Trevor Maco <tmaco@cisco.com>, Josh Ingeniero <jingenie@cisco.com>"
+__copyright__ = "Copyright (c) 2023 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+import asyncio
+import concurrent.futures
+import contextvars
+import functools
+import threading
+import time
+
+from rich.console import Console
+
+import config
+import generate_result
+import test_creation
+from tracing import current_trace, tracer
+from transport import endpoint_name, thousandeyes, thousandeyes_limiter
+
+try:
+    import aiohttp
+except ImportError:  # optional dependency, only required for EXECUTION_ENGINE = "asyncio"
+    aiohttp = None
+
+# Rich Console Instance
+console = Console()
+
+
+class AsyncEngine:
+    """
+    asyncio execution engine: launches instant tests, waits for results and posts Webex cards as coroutines on one
+    event loop (running in a background thread), so thousands of tests can be in flight on a few threads. Blocking
+    work (agent lookups, SQLite) runs on a small fixed thread pool, Webex messages go through the outbound dispatcher
+    """
+
+    def __init__(self, te_token, outbox):
+        """
+        :param te_token: ThousandEyes OAuth bearer token
+        :param outbox: WebexDispatcher, outbound Webex messages are queued through it
+        """
+        if aiohttp is None:
+            raise RuntimeError('EXECUTION_ENGINE = "asyncio" requires aiohttp (pip3 install aiohttp)')
+
+        self.te_headers = {
+            'Content-Type': 'application/json',
+            'Accept': 'application/json',
+            'Authorization': f"Bearer {te_token}"
+        }
+        self.outbox = outbox
+
+        self.loop = asyncio.new_event_loop()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=config.ASYNC_BLOCKING_WORKERS,
+                                                              thread_name_prefix='async-blocking')
+        self.session = None
+        self._thread = threading.Thread(target=self._run, name='async-engine', daemon=True)
+
+        # In-flight instant tests (coalescing key -> (task, start time)), see test_creation.in_flight_tests
+        self._in_flight = {}
+
+        # Counters
+        self.active_cards = 0
+        self.rejected_cards = 0
+        self._cards_lock = threading.Lock()
+
+    def start(self):
+        """
+        Start the event loop thread and open the shared HTTP session
+        """
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._open(), self.loop).result()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.set_default_executor(self.executor)
+        self.loop.run_forever()
+
+    async def _open(self):
+        connector = aiohttp.TCPConnector(limit=config.ASYNC_MAX_CONNECTIONS)
+        timeout = aiohttp.ClientTimeout(sock_connect=config.TE_CONNECT_TIMEOUT, sock_read=config.TE_READ_TIMEOUT)
+        self.session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+    def submit_card(self, data, info, trace_id=None):
+        """
+        Hand a validated card submission to the event loop (returns immediately)
+        :param data: Webex webhook data (roomId, messageId of the card)
+        :param info: Card attachment action inputs
+        :param trace_id: trace of the request (see tracing), created by app.card_webhook
+        :return: True if accepted, False if too many cards are already in progress
+        """
+        with self._cards_lock:
+            if self.active_cards >= config.ASYNC_MAX_CARDS:
+                self.rejected_cards += 1
+                return False
+            self.active_cards += 1
+
+        asyncio.run_coroutine_threadsafe(self.process_card(data, info, trace_id), self.loop)
+        return True
+
+    async def blocking(self, func, *args):
+        """
+        Run a blocking call on the engine's thread pool, in the context of the calling task (trace)
+        """
+        return await self.loop.run_in_executor(None, functools.partial(contextvars.copy_context().run, func, *args))
+
+    async def process_card(self, data, info, trace_id=None):
+        """
+        Run the test workflow for a validated card submission (see bot.process_card)
+        :param data: Webex webhook data (roomId, messageId of the card)
+        :param info: Card attachment action inputs
+        :param trace_id: trace of the request (see tracing)
+        """
+        try:
+            with tracer.activate(trace_id), tracer.span('card.process'):
+                await self.run_card(data, info, trace_id)
+        except Exception as e:
+            console.print(f'[red]Async card processing failed: {str(e)}[/]')
+        finally:
+            with self._cards_lock:
+                self.active_cards -= 1
+
+    async def run_card(self, data, info, trace_id):
+        """
+        Test workflow of process_card, inside the request trace
+        """
+        room_id = data['roomId']
+
+        # Delete card, user feedback of test received (the request id identifies the trace, see /trace/<id>)
+        await self.delete_message(data['messageId'], room_id)
+        await self.send_message(roomId=room_id, text='Your test request has been received. Test results will be '
+                                                     'returned in ~5 minutes' +
+                                                     (f' (request id: {trace_id})' if trace_id else ''))
+
+        lookups = []
+        if info['hostnameVal'] != '':
+            lookups.append(('endpoint', info['hostnameVal'], test_creation.find_endpoint_agents, 'Endpoint'))
+        if info['sitenameVal'] != '':
+            lookups.append(('enterprise', info['sitenameVal'], test_creation.find_enterprise_agents, 'Enterprise'))
+
+        cardinfo = {'IssueSelectVal': info['IssueSelectVal'], 'CustomURLVal': info['CustomURLVal']}
+        runs = []
+        for test_type, value, find_agents, label in lookups:
+            console.print(f'[blue]{label}[/] Agent Test: {value} {cardinfo}')
+            agents, missing = await self.blocking(find_agents, test_creation.agent_names(value))
+            if missing:
+                await self.send_message(roomId=room_id, text=f'{label} Agent Name not found: {", ".join(missing)}. '
+                                                             f'Please double check the provided name.')
+            if agents:
+                runs.append(self.run_agent_tests(agents, cardinfo, test_type))
+
+        # One delivery for the whole request, once every test on every agent is launched
+        launches = [launch for run in await asyncio.gather(*runs) for launch in run]
+        if launches:
+            await self.deliver(launches, room_id)
+
+    async def run_agent_tests(self, agents, cardinfo, test_type):
+        """
+        Launch instant tests on one or more agents, concurrently (see bot.run_agent_tests)
+        :return: instant test launches (see test_creation.test_selector)
+        """
+        with tracer.span('tests.launch', type=test_type, agents=len(agents)):
+            launches = await self.blocking(test_creation.plan_launches, agents, cardinfo, test_type,
+                                           generate_result.result_cache)
+            await asyncio.gather(*(self.launch_one(launch) for launch in launches if not launch['cached']))
+        return launches
+
+    async def launch_one(self, launch):
+        """
+        Launch (or attach to) the instant test of a launch, its ThousandEyes result (or the error) is kept in the launch
+        """
+        test_type, agent_ids, _, target = launch['key']
+        try:
+            launch['result'] = await self.launch(launch['key'], launch['test'], agent_ids, test_type, target)
+        except Exception as e:
+            console.print(f'[red]Instant test launch failed: {str(e)}[/]')
+            launch['result'] = str(e)
+
+    async def launch(self, key, test_name, agent_ids, test_type, target):
+        """
+        Launch an instant test, or attach to the matching in-flight test
+        :return: ThousandEyes Instant Test result
+        """
+        with tracer.span('thousandeyes.launch', test=test_name, kind=key[2], target=target, agents=len(agent_ids),
+                         shared=False) as span:
+            now = time.monotonic()
+            entry = self._in_flight.get(key)
+            if entry is not None and now - entry[1] <= config.COALESCE_WINDOW:
+                console.print(f'[blue]Attached to in-flight test[/] {key}')
+                span['attributes']['shared'] = True
+                return await asyncio.shield(entry[0])
+
+            task = self.loop.create_task(self.launch_test(test_name, agent_ids, test_type, target))
+            self._in_flight[key] = (task, now)
+            # Stop sharing the test once the coalescing window is over
+            self.loop.call_later(config.COALESCE_WINDOW, self._forget, key, task)
+            try:
+                result = await task
+            except Exception:
+                self._forget(key, task)
+                raise
+
+            if not test_creation.test_launched(result):
+                self._forget(key, task)
+            return result
+
+    def _forget(self, key, task):
+        """
+        Stop sharing an in-flight test with later requests (requests already attached to it still get its result)
+        """
+        entry = self._in_flight.get(key)
+        if entry is not None and entry[0] is task:
+            del self._in_flight[key]
+
+    async def launch_test(self, test_name, agent_ids, test_type, target):
+        """
+        ThousandEyes Instant Test for a catalog test (see test_creation.launch_test)
+        """
+        url, payload = test_creation.build_payload(test_name, agent_ids, test_type, target)
+        attempt = 0
+        while True:
+            start = status = headers = None
+            try:
+                await thousandeyes_limiter.acquire_async()
+                start = time.perf_counter()
+                async with self.session.post(url, headers=self.te_headers, json=payload) as response:
+                    status, headers = response.status, response.headers
+                    text = await response.text()
+            finally:
+                # No slot to give back if acquire_async didn't finish (it gives it back itself)
+                if start is not None:
+                    elapsed = time.perf_counter() - start
+                    retry_after = thousandeyes_limiter.release(elapsed, status, headers)
+                    thousandeyes.record_call(endpoint_name('POST', url), elapsed,
+                                             status if status is not None else 'error')
+
+            # Throttled: the test was not created, send it again after Retry-After
+            if status != 429 or attempt >= config.TE_THROTTLE_RETRIES:
+                return text
+            attempt += 1
+            await asyncio.sleep(retry_after or 0)
+
+    async def deliver(self, launches, room_id):
+        """
+        Poll the result links of every test of a request with backoff, send the results once they are all in (or what
+        came in by the deadline), see generate_result.schedule_request. The delivery is also kept in the durable
+        delivery store, so a restart resumes it
+        """
+        tests = generate_result.request_tests(launches)
+        records = generate_result.initial_records(tests)
+        delivery_id = None
+
+        if generate_result.open_tests(tests, records):
+            now = time.time()
+            delay = config.RESULT_POLL_INITIAL_DELAY
+            deadline = now + config.RESULT_DEADLINE
+            # Multi-worker mode: the scheduler leader polls due deliveries, this one is polled here and only becomes due
+            # (taken over by the leader) after the last poll here would be done, if this process exits before sending it
+            due_at = now + delay
+            if config.SCHEDULER_LOCK_PATH:
+                due_at = deadline + config.RESULT_FETCH_TIMEOUT + config.RESULT_POLL_MAX_INTERVAL
+            delivery_id = await self.blocking(generate_result.delivery_store.add, tests, room_id, due_at, deadline,
+                                              delay, records, current_trace())
+
+            while True:
+                await asyncio.sleep(max(0, min(delay, deadline - time.time())))
+
+                indexes = generate_result.open_tests(tests, records)
+                with tracer.span('delivery.poll', tests=len(indexes)) as span:
+                    links_list = [generate_result.result_links(tests[i]['result']) for i in indexes]
+                    fetched = await self.fetch_batch([links for links in links_list if links is not None])
+                    # Parsing and result cache writes (SQLite in multi-worker mode) run off the event loop
+                    await self.blocking(generate_result.collect_results, tests, records, indexes, links_list, fetched)
+                    span['attributes']['open'] = len(generate_result.open_tests(tests, records))
+
+                if not span['attributes']['open'] or time.time() >= deadline:
+                    break
+
+                delay = min(delay * config.RESULT_POLL_BACKOFF, config.RESULT_POLL_MAX_INTERVAL)
+
+        # Card rendering, dispatch and span export (file writes) run off the event loop
+        if delivery_id is None:
+            generate_result.DELIVERY_SECONDS.observe(0, outcome='cached')
+            await self.blocking(generate_result.send_results, tests, records, room_id, self.outbox)
+        else:
+            await self.blocking(generate_result.send_results, tests, records, room_id, self.outbox, now)
+            await self.blocking(generate_result.delivery_store.remove, delivery_id)
+
+    async def fetch_batch(self, links_list):
+        """
+        Get test results for every component of every test in a batch concurrently, bounded by one batch deadline
+        (see generate_result.fetch_batch)
+        :param links_list: list of result data links, one per test
+        :return: list of fetched result data, in the same order as links_list
+        """
+        tasks = [{component: asyncio.ensure_future(self.fetch_json(link)) for component, link in links.items()}
+                 for links in links_list]
+        pending = [task for test in tasks for task in test.values()]
+        if not pending:
+            return [{} for _ in tasks]
+
+        # Wait for the slowest fetch (or the deadline), components that didn't make it count as missing
+        _, late = await asyncio.wait(pending, timeout=config.RESULT_FETCH_TIMEOUT)
+        for task in late:
+            task.cancel()
+
+        return [{component: task.result() if task.done() and not task.cancelled() else None
+                 for component, task in test.items()} for test in tasks]
+
+    async def fetch_json(self, url):
+        """
+        Download and decode one ThousandEyes result link
+        :return: ThousandEyes result data, or None if the download failed
+        """
+        start = status = headers = None
+        try:
+            await thousandeyes_limiter.acquire_async()
+            start = time.perf_counter()
+            async with self.session.get(url, headers=self.te_headers) as response:
+                status, headers = response.status, response.headers
+                if response.status != 200:
+                    return None
+                return await response.json(content_type=None)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            console.print(f'[red]Unable to fetch {url}: {str(e)}[/]')
+            return None
+        finally:
+            # No slot to give back if acquire_async didn't finish (it gives it back itself)
+            if start is not None:
+                elapsed = time.perf_counter() - start
+                thousandeyes_limiter.release(elapsed, status, headers)
+                thousandeyes.record_call(endpoint_name('GET', url), elapsed, status if status is not None else 'error')
+
+    async def send_message(self, **fields):
+        """
+        Queue a Webex message (roomId, text, markdown, attachments) on the outbound dispatcher
+        """
+        self.outbox.messages.create(**fields)
+
+    async def delete_message(self, message_id, room_id):
+        """
+        Queue a Webex message deletion on the outbound dispatcher
+        """
+        self.outbox.messages.delete(message_id, roomId=room_id)
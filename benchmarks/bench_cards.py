@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+
+Micro-benchmark: per-card cost of building a result card attachment, parse-per-card (previous implementation) vs the
+parse-once renderer (cards.ResultCardRenderer).
+
+Usage: python3 benchmarks/bench_cards.py [iterations]
+"""
+
+__author__ = "Trevor Maco <tmaco@cisco.com>, Josh Ingeniero <jingenie@cisco.com>"
+__copyright__ = "Copyright (c) 2023 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+import json
+import os
+import sys
+import timeit
+
+# Run from the repository root, fall back to the sample config if config.py doesn't exist yet
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+try:
+    import config
+except ImportError:
+    import config_sample as config
+    sys.modules['config'] = config
+
+from cards import ResultCardRenderer
+
+RECORD = {'date': '2023-09-01 10:00:00', 'url': 'https://login.microsoftonline.com', 'code': 200,
+          'status': 'Everything seems normal at office, try rebooting your PC.', 'total': 252, 'loss': 0.0,
+          'latency': 12.3, 'jitter': 0.4, 'cpu': 10.25}
+TARGET = 'branch-office-agent'
+
+
+def parse_per_card(record, test_target):
+    """
+    Previous implementation: parse RESULT_CARD and CARD_BASE for every card, patch by index
+    """
+    result_card = json.loads(config.RESULT_CARD)
+
+    result_card['body'][1]['text'] = f"Created {record['date']}"
+    result_card['body'][2]['text'] = f"Agent: {test_target}"
+    result_card['body'][3]['text'] = f"Test Target: {record['url']}"
+    result_card['body'][4]['text'] = record['status']
+    result_card['body'][5]['facts'][0]['value'] = str(record['code'])
+    result_card['body'][5]['facts'][1]['value'] = f"{record['total']} ms"
+    result_card['body'][5]['facts'][2]['value'] = f"{record['loss']} %"
+    result_card['body'][5]['facts'][3]['value'] = f"{record['latency']} ms"
+    result_card['body'][5]['facts'][4]['value'] = f"{record['jitter']} ms"
+    result_card['body'][5]['facts'][5]['value'] = f"{record['cpu']} %"
+
+    card_base = json.loads(config.CARD_BASE)
+    card_base['content'] = result_card
+    return card_base
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    renderer = ResultCardRenderer(config.CARD_BASE, config.RESULT_CARD)
+
+    # Both implementations must produce the same card
+    assert parse_per_card(RECORD, TARGET) == renderer.render(RECORD, TARGET)
+
+    results = {
+        'parse per card': min(timeit.repeat(lambda: parse_per_card(RECORD, TARGET), number=iterations, repeat=5)),
+        'parse once renderer': min(timeit.repeat(lambda: renderer.render(RECORD, TARGET), number=iterations,
+                                                 repeat=5)),
+    }
+
+    baseline = results['parse per card']
+    print(f'{iterations} cards per run, best of 5')
+    for name, elapsed in results.items():
+        print(f'{name:<22} {elapsed / iterations * 1e6:8.2f} us/card  ({baseline / elapsed:5.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
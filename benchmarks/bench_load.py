@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+
+End-to-end load benchmark: runs the bot (app.py) against local ThousandEyes and Webex stand-ins (see stubs.py),
+drives its / and /card webhooks at a target rate, and reports webhook latency, time from card submission to results
+in the room, and ThousandEyes / Webex API calls per card.
+
+Usage: python3 benchmarks/bench_load.py [--rate 2] [--duration 30] [--te-latency 0.2] [--te-error-rate 0.01] ...
+(see --help)
+"""
+
+__author__ = "Trevor Maco <tmaco@cisco.com>, Josh Ingeniero <jingenie@cisco.com>"
+__copyright__ = "Copyright (c) 2023 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+import argparse
+import concurrent.futures
+import contextlib
+import io
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+# Run from the repository root, fall back to the sample config if config.py doesn't exist yet
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS, '..'))
+sys.path.insert(0, BENCHMARKS)
+try:
+    import config
+except ImportError:
+    import config_sample as config
+    sys.modules['config'] = config
+
+from stubs import ThousandEyesStub, WebexStub
+
+# Messages the bot posts with the results of a request
+RESULT_TEXT = 'ThousandEyes Webex Card Results'
+RESULT_MARKDOWN = ('**Timed out:**', '**Error:**')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='End-to-end load benchmark against local API stand-ins')
+    parser.add_argument('--rate', type=float, default=2, help='card submissions per second')
+    parser.add_argument('--duration', type=float, default=30, help='seconds of load')
+    parser.add_argument('--message-ratio', type=float, default=0.2,
+                        help='plain messages (/ route) sent per card submission')
+    parser.add_argument('--agents-per-card', type=int, default=1, help='agents listed on each card')
+    parser.add_argument('--agent-type', choices=('endpoint', 'enterprise', 'both'), default='endpoint')
+    parser.add_argument('--applications', default='Office365,WebexAudio,salesforce',
+                        help='applications picked from at random for each card (comma separated)')
+    parser.add_argument('--endpoint-agents', type=int, default=50, help='Endpoint Agents known to the stand-in')
+    parser.add_argument('--enterprise-agents', type=int, default=20, help='Enterprise Agents known to the stand-in')
+    parser.add_argument('--test-duration', type=float, default=5, help='seconds before instant tests have results')
+    parser.add_argument('--te-latency', type=float, default=0.1, help='mean ThousandEyes response time (seconds)')
+    parser.add_argument('--te-error-rate', type=float, default=0.0, help='fraction of ThousandEyes calls failing (503)')
+    parser.add_argument('--te-throttle-rate', type=float, default=0.0, help='fraction of ThousandEyes calls throttled')
+    parser.add_argument('--te-rate-limit', type=int, default=None,
+                        help='organization rate limit advertised by the ThousandEyes stand-in (per minute)')
+    parser.add_argument('--webex-latency', type=float, default=0.05, help='mean Webex response time (seconds)')
+    parser.add_argument('--webex-error-rate', type=float, default=0.0, help='fraction of Webex calls failing (503)')
+    parser.add_argument('--webex-throttle-rate', type=float, default=0.0, help='fraction of Webex calls throttled')
+    parser.add_argument('--poll-delay', type=float, default=2, help='RESULT_POLL_INITIAL_DELAY for the run')
+    parser.add_argument('--engine', choices=('threaded', 'asyncio'), default=config.EXECUTION_ENGINE)
+    parser.add_argument('--dispatch', choices=('queue', 'inline'), default=config.DISPATCH_MODE)
+    parser.add_argument('--timeout', type=float, default=config.RESULT_DEADLINE + 30,
+                        help='seconds to wait for results after the load stops')
+    parser.add_argument('--senders', type=int, default=32, help='concurrent webhook senders')
+    parser.add_argument('--seed', type=int, default=None)
+    return parser.parse_args()
+
+
+def percentile(values, fraction):
+    """
+    Nearest-rank percentile
+    :param values: observations
+    :param fraction: percentile (0 to 1)
+    :return: percentile value, None without observations
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, int(round(fraction * len(values))) - 1))]
+
+
+def summary(values, scale=1.0):
+    """
+    p50 / p90 / p99 / max line
+    """
+    if not values:
+        return '     n/a'
+    return '  '.join(f'{percentile(values, fraction) * scale:8.1f}' for fraction in (0.5, 0.9, 0.99, 1.0))
+
+
+def start_app(args, te_stub, webex_stub, workdir):
+    """
+    Import the bot configured against the stand-ins, serve it on a local port
+    :return: (app module, bot url)
+    """
+    os.environ['BOT_TOKEN'] = 'bench-bot-token'
+    os.environ['THOUSAND_EYES_TOKEN'] = 'bench-te-token'
+
+    config.TE_API_URL = te_stub.url
+    config.WEBEX_API_URL = f'{webex_stub.url}/v1/'
+    config.BOT_EMAIL = 'bench-bot@webex.bot'
+    config.DELIVERY_STORE_PATH = os.path.join(workdir, 'deliveries.db')
+    config.RESULT_POLL_INITIAL_DELAY = args.poll_delay
+    config.EXECUTION_ENGINE = args.engine
+    config.DISPATCH_MODE = args.dispatch
+    config.TRACE_EXPORT_PATH = ''
+
+    # app.log and other files the bot writes go to the scratch directory
+    os.chdir(workdir)
+    import app
+    from werkzeug.serving import make_server
+
+    server = make_server('127.0.0.1', 0, app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='bench-app', daemon=True).start()
+    return app, f'http://127.0.0.1:{server.server_port}'
+
+
+def card_inputs(args, te_stub):
+    """
+    Inputs of a random card submission
+    """
+    count = args.agents_per_card
+    hosts = random.sample([agent['computerName'] for agent in te_stub.endpoint_agents], count)
+    sites = random.sample([agent['agentName'] for agent in te_stub.enterprise_agents], count)
+    return {'action': 'newTest',
+            'IssueSelectVal': random.choice(args.applications.split(',')),
+            'CustomURLVal': '',
+            'hostnameVal': ', '.join(hosts) if args.agent_type in ('endpoint', 'both') else '',
+            'sitenameVal': ', '.join(sites) if args.agent_type in ('enterprise', 'both') else ''}
+
+
+def post(bot_url, route, data, latencies, errors):
+    """
+    Send one webhook to the bot, record its latency
+    """
+    start = time.perf_counter()
+    try:
+        response = requests.post(f'{bot_url}{route}', json={'data': data}, timeout=60)
+        ok = response.ok
+    except requests.RequestException:
+        ok = False
+    latencies[route].append(time.perf_counter() - start)
+    if not ok:
+        errors[route] += 1
+
+
+def drive(args, bot_url, te_stub, webex_stub):
+    """
+    Send card submissions (and plain messages) at the target rate
+    :return: (list of (roomId, submitted at), webhook latencies per route, webhook errors per route)
+    """
+    latencies = {'/card': [], '/': []}
+    errors = {'/card': 0, '/': 0}
+    cards = []
+    total = int(args.rate * args.duration)
+    messages = 0.0
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.senders) as senders:
+        start = time.time()
+        for i in range(total):
+            time.sleep(max(0.0, start + i / args.rate - time.time()))
+
+            room_id = f'bench-room-{i}'
+            card_message = webex_stub.add_message(room_id, 'help card', person_email='bench-bot@webex.bot')
+            action_id = webex_stub.add_action(room_id, card_message, card_inputs(args, te_stub))
+            cards.append((room_id, time.time()))
+            senders.submit(post, bot_url, '/card', {'id': action_id, 'roomId': room_id, 'messageId': card_message},
+                           latencies, errors)
+
+            messages += args.message_ratio
+            while messages >= 1:
+                messages -= 1
+                message_id = webex_stub.add_message(room_id, 'network-help')
+                senders.submit(post, bot_url, '/', {'id': message_id, 'roomId': room_id,
+                                                    'personEmail': 'user@example.com'}, latencies, errors)
+
+    return cards, latencies, errors
+
+
+def delivered_at(webex_stub, room_id):
+    """
+    Time the first result message reached a room (None if no results yet)
+    """
+    for posted_at, message in webex_stub.posted_to(room_id):
+        if message.get('text') == RESULT_TEXT or message.get('markdown', '').startswith(RESULT_MARKDOWN):
+            return posted_at
+    return None
+
+
+def main():
+    args = parse_args()
+    random.seed(args.seed)
+
+    te_stub = ThousandEyesStub(endpoint_agents=args.endpoint_agents, enterprise_agents=args.enterprise_agents,
+                               test_duration=args.test_duration, rate_limit=args.te_rate_limit,
+                               latency=args.te_latency, error_rate=args.te_error_rate,
+                               throttle_rate=args.te_throttle_rate).start()
+    webex_stub = WebexStub(latency=args.webex_latency, error_rate=args.webex_error_rate,
+                           throttle_rate=args.webex_throttle_rate).start()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # The bot's console output would drown the report
+        with contextlib.redirect_stdout(io.StringIO()):
+            app, bot_url = start_app(args, te_stub, webex_stub, workdir)
+            run_start = time.time()
+            cards, latencies, errors = drive(args, bot_url, te_stub, webex_stub)
+            load_seconds = time.time() - run_start
+
+            # Wait for every request's results (or the timeout)
+            deadline = time.time() + args.timeout
+            pending = dict(cards)
+            delivery = []
+            while pending and time.time() < deadline:
+                for room_id, submitted_at in list(pending.items()):
+                    posted_at = delivered_at(webex_stub, room_id)
+                    if posted_at is not None:
+                        delivery.append(posted_at - submitted_at)
+                        del pending[room_id]
+                time.sleep(0.2)
+
+            dispatcher = app.outbox.stats()
+
+    te_stub.stop()
+    webex_stub.stop()
+
+    count = len(cards) or 1
+    print(f'{len(cards)} cards in {load_seconds:.1f}s ({len(cards) / load_seconds:.2f}/s, target {args.rate}/s), '
+          f'{len(latencies["/"])} messages, engine {args.engine}, dispatch {args.dispatch}')
+    print(f'\n{"":<28}{"p50":>8}  {"p90":>8}  {"p99":>8}  {"max":>8}')
+    for route in ('/card', '/'):
+        print(f'{"webhook " + route + " (ms)":<28}{summary(latencies[route], 1000)}  errors {errors[route]}')
+    print(f'{"delivery (s)":<28}{summary(delivery)}  delivered {len(delivery)}/{len(cards)}')
+
+    print(f'\nAPI calls per card (ThousandEyes {te_stub.call_count() / count:.2f}, Webex '
+          f'{webex_stub.call_count() / count:.2f})')
+    for name, stub in (('ThousandEyes', te_stub), ('Webex', webex_stub)):
+        for endpoint, calls in sorted(stub.calls.items()):
+            print(f'  {name:<13} {endpoint:<52} {calls / count:6.2f}')
+    print(f'\nWebex dispatcher: sent {dispatcher["sent"]}, retried {dispatcher["retried"]}, '
+          f'failed {dispatcher["failed"]}, max queue latency {dispatcher["latency_max"]:.2f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+
+Micro-benchmark: per-result cost of the delivery hot path (decode the result links, parse, render the result card)
+for each result parsing path, endpoint and enterprise, http-server and agent-to-server, from the recorded
+ThousandEyes responses in benchmarks/fixtures (served through transport.FixtureTransport), with peak memory
+allocated per result.
+
+Usage: python3 benchmarks/bench_results.py [iterations] [fixture.json ...]
+"""
+
+__author__ = "Trevor Maco <tmaco@cisco.com>, Josh Ingeniero <jingenie@cisco.com>"
+__copyright__ = "Copyright (c) 2023 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+import glob
+import json
+import os
+import sys
+import timeit
+import tracemalloc
+
+# Run from the repository root, fall back to the sample config if config.py doesn't exist yet
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS, '..'))
+try:
+    import config
+except ImportError:
+    import config_sample as config
+    sys.modules['config'] = config
+
+# No delivery store file for a benchmark
+config.DELIVERY_STORE_PATH = ':memory:'
+
+import generate_result
+from cards import result_cards
+from transport import FixtureTransport
+
+
+def load_fixture(path):
+    """
+    Load a fixture and serve its recorded responses to generate_result
+    :return: fixture (description, test_type, kind, agents, result, responses)
+    """
+    with open(path) as fixture_file:
+        fixture = json.load(fixture_file)
+    generate_result.result_transport = FixtureTransport(fixture['responses'])
+    return fixture
+
+
+def fetch(links):
+    """
+    Download and decode the result links (one at a time, the fetch pool is not measured)
+    """
+    return {component: generate_result.fetch_url_json(link) for component, link in links.items()}
+
+
+def parse(result, links, data, agents):
+    """
+    Result record of every agent
+    """
+    if len(agents) == 1:
+        return [generate_result.parse_result(result, links, data)]
+    return [generate_result.parse_result(result, links, data, agent_id) for agent_id, _ in agents]
+
+
+def render(records, agents):
+    """
+    Result card attachment of every agent
+    """
+    return [result_cards.attachment(generate_result.build_result_card(record, name))
+            for record, (_, name) in zip(records, agents)]
+
+
+def measure(fixture, iterations):
+    """
+    Time each stage of the hot path for a fixture, and the peak memory of one pass
+    :return: dictionary of stage -> seconds per result, and 'peak' bytes per result
+    """
+    result, agents = fixture['result'], [tuple(agent) for agent in fixture['agents']]
+    links = generate_result.result_links(result)
+    data = fetch(links)
+    records = parse(result, links, data, agents)
+
+    # The benchmark must take the same path as the bot (generate_result fetches through the pool)
+    assert generate_result.generate_result(result, agents[0][1]) == \
+        generate_result.build_result_card(records[0], agents[0][1])
+
+    stages = {
+        'fetch': lambda: fetch(links),
+        'parse': lambda: parse(result, links, data, agents),
+        'render': lambda: render(records, agents),
+        'total': lambda: render(parse(result, links, fetch(links), agents), agents),
+    }
+    timings = {name: min(timeit.repeat(stage, number=iterations, repeat=5)) / iterations / len(agents)
+               for name, stage in stages.items()}
+
+    tracemalloc.start()
+    try:
+        stages['total']()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    timings['peak'] = peak / len(agents)
+    return timings
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    paths = sys.argv[2:] or sorted(glob.glob(os.path.join(BENCHMARKS, 'fixtures', '*.json')))
+
+    print(f'{iterations} iterations per run, best of 5, per result (one agent)')
+    print(f'{"fixture":<34}{"agents":>7}{"fetch us":>11}{"parse us":>11}{"render us":>11}{"total us":>11}'
+          f'{"peak KiB":>10}')
+    for path in paths:
+        fixture = load_fixture(path)
+        timings = measure(fixture, iterations)
+        name = os.path.splitext(os.path.basename(path))[0]
+        print(f'{name:<34}{len(fixture["agents"]):>7}' +
+              ''.join(f'{timings[stage] * 1e6:11.1f}' for stage in ('fetch', 'parse', 'render', 'total')) +
+              f'{timings["peak"] / 1024:10.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+
+Record a result fixture (see bench_results.py): launch a real instant test on one or more agents, wait for every
+agent's results, and save the test creation response and result link responses as a fixture file. Uses the
+THOUSAND_EYES_TOKEN of the bot.
+
+Usage: python3 benchmarks/record_fixture.py <endpoint|enterprise> <agent[,agent...]> <catalog test> <fixture.json>
+       [custom url]
+ex: python3 benchmarks/record_fixture.py endpoint LAPTOP-1234 o365_test benchmarks/fixtures/my_o365.json
+"""
+
+__author__ = "Trevor Maco <tmaco@cisco.com>, Josh Ingeniero <jingenie@cisco.com>"
+__copyright__ = "Copyright (c) 2023 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+import json
+import os
+import sys
+import time
+
+# Run from the repository root, fall back to the sample config if config.py doesn't exist yet
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+try:
+    import config
+except ImportError:
+    import config_sample as config
+    sys.modules['config'] = config
+
+config.DELIVERY_STORE_PATH = ':memory:'
+
+import generate_result
+import test_creation
+from transport import RecordingTransport, thousandeyes
+
+POLL_INTERVAL = 10
+
+
+def main():
+    if len(sys.argv) < 5:
+        print(__doc__)
+        sys.exit(1)
+    test_type, names, test_name, path = sys.argv[1:5]
+    test = test_creation.TEST_CATALOG[test_name]
+    target = test['target'] or sys.argv[5]
+
+    find_agents = test_creation.find_endpoint_agents if test_type == 'endpoint' \
+        else test_creation.find_enterprise_agents
+    agents, missing = find_agents(test_creation.agent_names(names))
+    if missing:
+        sys.exit(f'Agents not found: {", ".join(missing)}')
+
+    agent_ids = [agent_id for agent_id, _ in agents]
+    result = json.loads(test_creation.launch_test(test_name, agent_ids, test_type, target))
+    links = generate_result.result_links(result)
+    if links is None:
+        sys.exit(f'Instant test failed: {result}')
+
+    # Result link responses are kept for the fixture (the last response of each link)
+    recorder = RecordingTransport(thousandeyes)
+    generate_result.result_transport = recorder
+
+    deadline = time.time() + config.RESULT_DEADLINE
+    while True:
+        time.sleep(POLL_INTERVAL)
+        data = generate_result.fetch_result_data(links)
+        ready = generate_result.agents_with_results(result, data, agent_ids)
+        print(f'{len(ready)}/{len(agent_ids)} agents with results')
+        if len(ready) == len(agent_ids) or time.time() >= deadline:
+            break
+
+    recorder.save(path, description=test['endpoint' if test_type == 'endpoint' else 'enterprise']['testName'],
+                  test_type=test_type, kind=test['kind'], agents=agents, result=result)
+    print(f'Fixture saved to {path}')
+
+
+if __name__ == '__main__':
+    main()
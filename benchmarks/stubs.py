@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+
+Local stand-ins for the ThousandEyes v6 and Webex APIs used by the bot (see bench_load.py), with injected latency,
+errors (503) and throttling (429). Point TE_API_URL and WEBEX_API_URL at them.
+"""
+
+__author__ = "Trevor Maco <tmaco@cisco.com>, Josh Ingeniero <jingenie@cisco.com>"
+__copyright__ = "Copyright (c) 2023 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+import collections
+import http.server
+import itertools
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from urllib.parse import parse_qs, urlsplit
+
+# Ids in paths (numbers, 32 hex character ids), replaced by {id} in call counts
+ID_SEGMENT = re.compile(r'/(\d+|[0-9a-f]{32})(?=/|\.json|$)')
+
+CREATED_DATE = '2023-09-01 10:00:00'
+
+
+class StubServer:
+    """
+    Threaded local HTTP server answering with JSON, every call is counted per endpoint and can be delayed, failed or
+    throttled at random
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, throttle_rate=0.0):
+        """
+        :param latency: mean response delay (seconds, uniformly spread between half and one and a half times that)
+        :param error_rate: fraction of calls answered with 503
+        :param throttle_rate: fraction of calls answered with 429 (Retry-After: 1)
+        """
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.calls = collections.Counter()
+        self._lock = threading.Lock()
+
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), self._handler_class())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        """
+        Base url of the server (ex: http://127.0.0.1:12345)
+        """
+        return f'http://127.0.0.1:{self.server.server_address[1]}'
+
+    def start(self):
+        """
+        Serve in a background thread
+        """
+        self._thread = threading.Thread(target=self.server.serve_forever, name=type(self).__name__, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stop serving
+        """
+        self.server.shutdown()
+        self.server.server_close()
+
+    def call_count(self):
+        """
+        :return: total number of calls received
+        """
+        with self._lock:
+            return sum(self.calls.values())
+
+    def handle(self, method, path, query, body):
+        """
+        Answer a call (implemented by each stand-in)
+        :return: (status, JSON payload or None, extra headers)
+        """
+        raise NotImplementedError
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            # Keep-alive, like the real APIs (the bot's transport pools connections)
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                stub._dispatch(self, 'GET')
+
+            def do_POST(self):
+                stub._dispatch(self, 'POST')
+
+            def do_PUT(self):
+                stub._dispatch(self, 'PUT')
+
+            def do_DELETE(self):
+                stub._dispatch(self, 'DELETE')
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def _dispatch(self, request, method):
+        """
+        Count, delay, fail or answer a call
+        """
+        parts = urlsplit(request.path)
+        length = int(request.headers.get('Content-Length') or 0)
+        body = json.loads(request.rfile.read(length)) if length else None
+
+        with self._lock:
+            self.calls[f'{method} {ID_SEGMENT.sub("/{id}", parts.path)}'] += 1
+
+        if self.latency:
+            time.sleep(random.uniform(0.5, 1.5) * self.latency)
+
+        roll = random.random()
+        if roll < self.throttle_rate:
+            status, payload, headers = 429, {'message': 'Too many requests'}, {'Retry-After': '1'}
+        elif roll < self.throttle_rate + self.error_rate:
+            status, payload, headers = 503, {'message': 'Service unavailable'}, {}
+        else:
+            try:
+                status, payload, headers = self.handle(method, parts.path, parse_qs(parts.query), body)
+            except Exception as e:
+                status, payload, headers = 500, {'message': str(e)}, {}
+
+        data = json.dumps(payload).encode() if payload is not None else b''
+        request.send_response(status)
+        request.send_header('Content-Type', 'application/json')
+        request.send_header('Content-Length', str(len(data)))
+        for name, value in headers.items():
+            request.send_header(name, value)
+        request.end_headers()
+        request.wfile.write(data)
+
+
+class ThousandEyesStub(StubServer):
+    """
+    ThousandEyes v6 stand-in: Endpoint Agents (bench-host-<n>), Enterprise Agents (bench-site-<n>) and an agent label
+    (bench-group), instant tests on both, and their result links. Results come in test_duration seconds after launch
+    """
+
+    def __init__(self, endpoint_agents=50, enterprise_agents=20, test_duration=5.0, page_size=100, rate_limit=None,
+                 **kwargs):
+        """
+        :param endpoint_agents: number of Endpoint Agents
+        :param enterprise_agents: number of Enterprise Agents
+        :param test_duration: seconds before an instant test has results
+        :param page_size: Endpoint Agents per listing page
+        :param rate_limit: organization rate limit advertised in X-Organization-Rate-Limit-Limit (per minute)
+        """
+        super().__init__(**kwargs)
+        self.endpoint_agents = [{'agentId': uuid.uuid4().hex, 'computerName': f'bench-host-{i}'}
+                                for i in range(endpoint_agents)]
+        self.enterprise_agents = [{'agentId': 1000 + i, 'agentName': f'bench-site-{i}', 'agentType': 'Enterprise'}
+                                  for i in range(enterprise_agents)]
+        self.test_duration = test_duration
+        self.page_size = page_size
+        self.rate_limit = rate_limit
+
+        self._tests = {}  # test id -> (launched at, test type, kind, target, agent ids)
+        self._test_ids = itertools.count(1)
+
+    def handle(self, method, path, query, body):
+        headers = {'X-Organization-Rate-Limit-Limit': str(self.rate_limit)} if self.rate_limit else {}
+
+        if path == '/v6/endpoint-agents.json':
+            if 'computerName' in query:
+                agents = [agent for agent in self.endpoint_agents if agent['computerName'] == query['computerName'][0]]
+                return 200, {'endpointAgents': agents}, headers
+            page = int(query.get('page', ['0'])[0])
+            start = page * self.page_size
+            payload = {'endpointAgents': self.endpoint_agents[start:start + self.page_size]}
+            if start + self.page_size < len(self.endpoint_agents):
+                payload['pages'] = {'next': f'{self.url}/v6/endpoint-agents.json?page={page + 1}'}
+            return 200, payload, headers
+
+        if path == '/v6/agents.json':
+            return 200, {'agents': self.enterprise_agents}, headers
+        if path == '/v6/groups/agents.json':
+            return 200, {'groups': [{'groupId': 1, 'name': 'bench-group', 'type': 'agents'}]}, headers
+        if path == '/v6/groups/1.json':
+            return 200, {'groups': [{'groupId': 1, 'name': 'bench-group', 'agents': self.enterprise_agents[:5]}]}, \
+                headers
+
+        match = re.fullmatch(r'/v6/(endpoint-instant|instant)/(http-server|agent-to-server)\.json', path)
+        if match and method == 'POST':
+            return 200, self.launch(match.group(1) == 'endpoint-instant', match.group(2), body), headers
+
+        match = re.fullmatch(r'/v6/(?:endpoint-data/tests/)?(web/http-server|net/metrics)/(\d+)\.json', path)
+        if match:
+            return 200, self.results(int(match.group(2)), match.group(1)), headers
+
+        return 404, {'message': f'No stand-in for {method} {path}'}, headers
+
+    def launch(self, endpoint, kind, payload):
+        """
+        Create an instant test
+        :return: test creation response, with its result links
+        """
+        if endpoint:
+            agent_ids = payload['agentIds']
+            target = payload.get('url') or payload.get('serverName')
+        else:
+            agent_ids = [agent['agentId'] for agent in payload['agents']]
+            target = payload.get('url') or payload.get('server')
+
+        test_id = next(self._test_ids)
+        with self._lock:
+            self._tests[test_id] = (time.time(), endpoint, kind, target, agent_ids)
+
+        data = f'{self.url}/v6/endpoint-data/tests' if endpoint else f'{self.url}/v6'
+        links = [{'rel': 'self', 'href': f'{self.url}/v6/tests/{test_id}'}]
+        if kind == 'http-server':
+            links.append({'rel': 'data', 'href': f'{data}/web/http-server/{test_id}.json'})
+        links.append({'rel': 'data', 'href': f'{data}/net/metrics/{test_id}.json'})
+
+        return {'endpointTest' if endpoint else 'test': [{'testId': test_id, 'testName': payload.get('testName'),
+                                                          'apiLinks': links}]}
+
+    def results(self, test_id, component):
+        """
+        Result data of a test component, with one row per agent once the test has run
+        """
+        with self._lock:
+            launched_at, endpoint, kind, target, agent_ids = self._tests[test_id]
+        done = time.time() - launched_at >= self.test_duration
+        test, web, net = ('endpointTest', 'endpointWeb', 'endpointNet') if endpoint else ('test', 'web', 'net')
+        test_info = {'testId': test_id, 'createdDate': CREATED_DATE, 'url': target, 'server': target}
+        system = {'systemMetrics': {'cpuUtilization': {'mean': 0.1}}} if endpoint else {}
+
+        if component == 'web/http-server':
+            rows = [dict(system, agentId=agent_id, responseCode=200, totalTime=random.randint(50, 400))
+                    for agent_id in agent_ids] if done else []
+            return {web: {test: test_info, 'httpServer': rows}}
+
+        rows = [dict(system, agentId=agent_id, loss=0.0, avgLatency=round(random.uniform(5, 50), 1),
+                     jitter=round(random.uniform(0, 2), 1)) for agent_id in agent_ids] if done else []
+        return {net: {test: test_info, 'metrics': rows}}
+
+
+class WebexStub(StubServer):
+    """
+    Webex API stand-in: messages (get, create, delete), attachment actions and webhooks. Messages and card submissions
+    the bot looks up are registered beforehand (see add_message, add_action), messages the bot posts are kept per room
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.messages = {}  # message id -> message
+        self.actions = {}  # attachment action id -> attachment action
+        self.webhooks = {}  # webhook id -> webhook
+        self.posted = collections.defaultdict(list)  # roomId -> list of (epoch time, message posted by the bot)
+
+    def add_message(self, room_id, text, person_email='user@example.com'):
+        """
+        Register a user message (the bot reads it when its webhook fires)
+        :return: message id
+        """
+        message_id = uuid.uuid4().hex
+        self.messages[message_id] = {'id': message_id, 'roomId': room_id, 'roomType': 'direct', 'text': text,
+                                     'personEmail': person_email, 'created': CREATED_DATE}
+        return message_id
+
+    def add_action(self, room_id, message_id, inputs):
+        """
+        Register a card submission (the bot reads its inputs when its webhook fires)
+        :return: attachment action id
+        """
+        action_id = uuid.uuid4().hex
+        self.actions[action_id] = {'id': action_id, 'type': 'submit', 'messageId': message_id, 'roomId': room_id,
+                                   'inputs': inputs, 'created': CREATED_DATE}
+        return action_id
+
+    def posted_to(self, room_id):
+        """
+        :return: list of (epoch time, message) posted by the bot to a room
+        """
+        with self._lock:
+            return list(self.posted.get(room_id, []))
+
+    def handle(self, method, path, query, body):
+        match = re.fullmatch(r'/v1/(messages|attachment/actions|webhooks)(?:/([^/]+))?', path)
+        if not match:
+            return 404, {'message': f'No stand-in for {method} {path}'}, {}
+        resource, item_id = match.groups()
+
+        if resource == 'messages':
+            if method == 'POST':
+                message = dict(body, id=uuid.uuid4().hex, personEmail='bench-bot@webex.bot', created=CREATED_DATE)
+                with self._lock:
+                    self.posted[body['roomId']].append((time.time(), message))
+                return 200, message, {}
+            if method == 'DELETE':
+                return 204, None, {}
+            message = self.messages.get(item_id)
+            return (200, message, {}) if message else (404, {'message': 'Message not found'}, {})
+
+        if resource == 'attachment/actions':
+            action = self.actions.get(item_id)
+            return (200, action, {}) if action else (404, {'message': 'Attachment action not found'}, {})
+
+        # Webhooks
+        with self._lock:
+            if method == 'GET' and item_id is None:
+                return 200, {'items': list(self.webhooks.values())}, {}
+            if method == 'POST':
+                webhook = dict(body, id=uuid.uuid4().hex, status='active', created=CREATED_DATE)
+                self.webhooks[webhook['id']] = webhook
+                return 200, webhook, {}
+            if item_id not in self.webhooks:
+                return 404, {'message': 'Webhook not found'}, {}
+            if method == 'PUT':
+                self.webhooks[item_id].update(body)
+                return 200, self.webhooks[item_id], {}
+            if method == 'DELETE':
+                del self.webhooks[item_id]
+                return 204, None, {}
+            return 200, self.webhooks[item_id], {}
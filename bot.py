@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+
+Setup shared by the bot (app.py / wsgi.py) and its worker processes (worker.py): Webex API and outbound dispatcher,
+result delivery scheduling, durable job queue, webhook dedupe index, and the card test workflow. Background threads
+only one of them needs are started by that one
+"""
+
+__author__ = "Trevor Maco <tmaco@cisco.com>, Josh Ingeniero <jingenie@cisco.com>"
+__copyright__ = "Copyright (c) 2023 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+import logging
+import os
+import threading
+import time
+
+import urllib3
+from apscheduler.schedulers.background import BackgroundScheduler
+from rich.console import Console
+from webexteamssdk import WebexTeamsAPI
+from dotenv import load_dotenv
+
+import config
+import generate_result
+import test_creation
+from dedupe import WebhookDedupe
+from job_queue import JobQueue
+from leader import LeaderLock
+from tracing import tracer
+from webex_dispatcher import WebexDispatcher
+
+# Load env variables
+load_dotenv()
+BOT_TOKEN = os.getenv("BOT_TOKEN")
+
+# Rich Console Instance
+console = Console()
+
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+# Declare logger (writes all errors and basic calls to app.log)
+logging.basicConfig(filename='app.log', filemode='a', format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+# Webex API (rate limits are handled by the outbound dispatcher, not by waiting inside the SDK)
+api = WebexTeamsAPI(access_token=BOT_TOKEN, base_url=config.WEBEX_API_URL, wait_on_rate_limit=False)
+
+# Outbound Webex message dispatcher (every message create/delete goes through it)
+outbox = WebexDispatcher(api, rate=config.WEBEX_RATE_LIMIT, burst=config.WEBEX_RATE_BURST,
+                         workers=config.WEBEX_DISPATCH_WORKERS, max_retries=config.WEBEX_MAX_RETRIES)
+outbox.start()
+
+# Background scheduler (for running ThousandEyes tests as background processes)
+sender_store = BackgroundScheduler()
+
+
+def start_delivery_sweep():
+    """
+    Multi-worker mode: this worker process was elected scheduler leader, poll every due delivery from now on
+    """
+    console.print(f'Worker {os.getpid()} is the scheduler leader')
+    sender_store.add_job(generate_result.sweep_deliveries, trigger='interval', seconds=config.DELIVERY_SWEEP_INTERVAL,
+                         args=[outbox], id='delivery-sweep', max_instances=1, coalesce=True)
+    sender_store.start()
+
+
+def start_delivery_scheduler():
+    """
+    Poll and send result deliveries from this process, with its own scheduler or, in multi-worker mode, through the
+    scheduler leader's sweep (worker.py processes always use the sweep, several of them share the delivery store)
+    """
+    global delivery_jobs, scheduler_leader
+
+    lock_path = config.SCHEDULER_LOCK_PATH
+    if not lock_path and config.DISPATCH_MODE == 'durable':
+        lock_path = f'{config.DELIVERY_STORE_PATH}.lock'
+
+    if lock_path:
+        # Multi-worker mode: deliveries are only persisted here (no job store), the leader's sweep polls them,
+        # including deliveries left pending by a previous run
+        delivery_jobs = None
+        scheduler_leader = LeaderLock(lock_path, retry_interval=config.SCHEDULER_LOCK_RETRY)
+        scheduler_leader.start(on_elected=start_delivery_sweep)
+    else:
+        delivery_jobs = sender_store
+        sender_store.start()
+
+        # Resume result deliveries left pending by a previous run (in the background, doesn't delay startup)
+        threading.Thread(target=generate_result.resume_deliveries, args=(sender_store, outbox, time.time()),
+                         name='delivery-catch-up', daemon=True).start()
+
+
+delivery_jobs = None
+scheduler_leader = None
+
+# Durable dispatch: the bot is the ingress, card submissions are validated and queued in the durable job queue.
+# Tests are run and results delivered by the worker processes (worker.py)
+job_queue = None
+if config.DISPATCH_MODE == 'durable':
+    job_queue = JobQueue(config.JOB_QUEUE_PATH, config.JOB_QUEUE_DEPTH,
+                         visibility_timeout=config.JOB_VISIBILITY_TIMEOUT, max_attempts=config.JOB_MAX_ATTEMPTS,
+                         retry_delay=config.JOB_RETRY_DELAY, failed_retention=config.JOB_FAILED_RETENTION)
+
+# Webhook ids already handled (Webex redeliveries are ignored)
+webhook_dedupe = WebhookDedupe(config.WEBHOOK_DEDUPE_TTL, config.WEBHOOK_DEDUPE_SIZE,
+                               path=config.WEBHOOK_DEDUPE_PATH or config.SHARED_STATE_PATH or None)
+
+
+def run_agent_tests(agents, cardinfo, test_type):
+    """
+    Launch instant tests on one or more agents
+    :param agents: list of (agent id, agent name) of Endpoint or Enterprise Agents
+    :param cardinfo: Card data containing selected test, custom url, etc.
+    :param test_type: test type (options: endpoint, enterprise)
+    :return: instant test launches (see test_creation.test_selector)
+    """
+    # Perform instant tests (select from pre-selected apps, or custom url), one launch per test for all agents
+    with tracer.span('tests.launch', type=test_type, agents=len(agents)):
+        test_result = test_creation.test_selector(agents, cardinfo, test_type=test_type,
+                                                  result_cache=generate_result.result_cache)
+
+    print("================================================")
+    console.print(f'ThousandEyes Results: {test_result}')
+    print("================================================")
+
+    return test_result
+
+
+def process_card(data, info, trace_id=None, submitted_at=None, acknowledge=True):
+    """
+    Run the test workflow for a validated card submission (agent lookup, instant tests, result scheduling). Each
+    agent field can list several agents (comma separated), Enterprise Agent labels are given as "group:<label>".
+    The results of every test on every agent are sent back together, once they are all in
+    :param data: Webex webhook data (roomId, messageId of the card)
+    :param info: Card attachment action inputs
+    :param trace_id: trace of the request (see tracing), created by app.card_webhook
+    :param submitted_at: epoch time the card was handed to the work queue (recorded as the queue wait)
+    :param acknowledge: False if the card was already acknowledged (see acknowledge_card)
+    """
+    with tracer.activate(trace_id):
+        if submitted_at is not None:
+            tracer.record('queue.wait', submitted_at, time.time())
+        with tracer.span('card.process'):
+            run_card(data, info, trace_id, acknowledge)
+
+
+def acknowledge_card(data, trace_id):
+    """
+    Delete the submitted card, user feedback of test received (the request id identifies the trace, see /trace/<id>)
+    :param data: Webex webhook data (roomId, messageId of the card)
+    :param trace_id: trace of the request (see tracing)
+    """
+    outbox.messages.delete(messageId=data['messageId'], roomId=data['roomId'])
+    outbox.messages.create(roomId=data['roomId'],
+                           text='Your test request has been received. Test results will be '
+                                'returned in ~5 minutes' + (f' (request id: {trace_id})' if trace_id else ''))
+
+
+def run_card(data, info, trace_id, acknowledge=True):
+    """
+    Test workflow of process_card, inside the request trace
+    """
+    if acknowledge:
+        acknowledge_card(data, trace_id)
+
+    cardinfo = {'IssueSelectVal': info['IssueSelectVal'], 'CustomURLVal': info['CustomURLVal']}
+    launches = []
+
+    # Endpoint Agent Case
+    if info['hostnameVal'] != '':
+        console.print(f'[blue]Endpoint[/] Agent Test: {info["hostnameVal"]} {cardinfo}')
+
+        # Find Endpoint Agent Unique IDs (required for instant test), uncached hostnames resolved in parallel
+        agents, missing = test_creation.find_endpoint_agents(test_creation.agent_names(info['hostnameVal']))
+
+        if missing:
+            outbox.messages.create(roomId=data['roomId'],
+                                   text=f'Endpoint Agent Name not found: {", ".join(missing)}. Please double check the '
+                                        f'provided name.')
+        if agents:
+            launches += run_agent_tests(agents, cardinfo, 'endpoint')
+
+    # Enterprise Agent Case
+    if info['sitenameVal'] != '':
+        console.print(f'[blue]Enterprise[/] Agent Test: {info["sitenameVal"]} {cardinfo}')
+
+        agents, missing = test_creation.find_enterprise_agents(test_creation.agent_names(info['sitenameVal']))
+
+        if missing:
+            outbox.messages.create(roomId=data['roomId'],
+                                   text=f'Enterprise Agent Name not found: {", ".join(missing)}. Please double check '
+                                        f'the provided name.')
+        if agents:
+            launches += run_agent_tests(agents, cardinfo, 'enterprise')
+
+    # Schedule one delivery for the whole request, recent results are part of it. A delivery that can't be stored
+    # fails the card (retried by the durable job queue, logged by the work queue)
+    if launches:
+        generate_result.schedule_request(launches, data['roomId'], delivery_jobs, outbox, trace_id=trace_id)
+
+
+def notify_dropped(room_id, card_key=None):
+    """
+    Let the user know their queued request was dropped because the work queue overflowed
+    :param room_id: roomId of the dropped request
+    :param card_key: dedupe key of the dropped card, released so the card can be submitted again
+    """
+    if card_key is not None:
+        webhook_dedupe.release(card_key)
+    outbox.messages.create(roomId=room_id,
+                           text='Sorry, the chatbot is too busy to run your test right now. Please try again in a few '
+                                'minutes.')
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+__author__ = "Trevor Maco <tmaco@cisco.com>, Josh Ingeniero <jingenie@cisco.com>"
+__copyright__ = "Copyright (c) 2023 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+import json
+
+import config
+
+
+class ResultCardRenderer:
+    """
+    Result card renderer: the card templates are parsed once, each render only rebuilds the card elements that change
+    (elements that never change are shared between rendered cards, rendered cards must not be modified in place)
+    """
+
+    # Result card body elements (indexes in RESULT_CARD)
+    DATE = 1
+    AGENT = 2
+    TARGET = 3
+    STATUS = 4
+    FACTS = 5
+
+    def __init__(self, card_base, result_card):
+        """
+        :param card_base: card attachment wrapper (JSON string, see config.CARD_BASE)
+        :param result_card: result card content (JSON string, see config.RESULT_CARD)
+        """
+        self.card_base = json.loads(card_base)
+        self.result_card = json.loads(result_card)
+
+        body = self.result_card['body']
+        self._date = body[self.DATE]
+        self._agent = body[self.AGENT]
+        self._target = body[self.TARGET]
+        self._status = body[self.STATUS]
+        self._facts = body[self.FACTS]
+        self._fact_titles = [fact['title'] for fact in self._facts['facts']]
+
+    def content(self, record, test_target, age=None):
+        """
+        Render the result card content for a result record
+        :param record: result record (see generate_result.parse_result)
+        :param test_target: Target of Test (Endpoint Hostname, Enterprise Agent Name)
+        :param age: seconds since the result was collected, if it is served from the result cache
+        :return: result card content
+        """
+        created = f"Created {record['date']}"
+        if age is not None:
+            created += f" (recent result, {int(age)}s old)"
+
+        values = (str(record['code']),  # Response Code
+                  f"{record['total']} ms",  # Total Response Time
+                  f"{record['loss']} %",  # Loss
+                  f"{record['latency']} ms",  # Average Latency
+                  f"{record['jitter']} ms",  # Jitter
+                  f"{record['cpu']} %")  # CPU
+
+        body = list(self.result_card['body'])
+        body[self.DATE] = dict(self._date, text=created)  # Date message
+        body[self.AGENT] = dict(self._agent, text=f"Agent: {test_target}")  # test target
+        body[self.TARGET] = dict(self._target, text=f"Test Target: {record['url']}")  # url
+        body[self.STATUS] = dict(self._status, text=record['status'])  # Status message
+        body[self.FACTS] = dict(self._facts, facts=[{'title': title, 'value': value}
+                                                    for title, value in zip(self._fact_titles, values)])
+
+        return dict(self.result_card, body=body)
+
+    def attachment(self, content):
+        """
+        Wrap card content into a Webex card attachment
+        :param content: card content
+        :return: Webex card attachment
+        """
+        return dict(self.card_base, content=content)
+
+    def render(self, record, test_target, age=None):
+        """
+        Render the Webex card attachment for a result record
+        :param record: result record (see generate_result.parse_result)
+        :param test_target: Target of Test (Endpoint Hostname, Enterprise Agent Name)
+        :param age: seconds since the result was collected, if it is served from the result cache
+        :return: Webex card attachment
+        """
+        return self.attachment(self.content(record, test_target, age))
+
+
+class SummaryCardRenderer:
+    """
+    Summary card renderer: one card for every result of a request, one row per test target and agent. Like the result
+    card renderer, the template is parsed once and only the changing elements are rebuilt
+    """
+
+    # Summary card body elements (indexes in SUMMARY_CARD)
+    SUBTITLE = 1
+    HEADER = 2
+    ROW = 3
+
+    def __init__(self, card_base, summary_card):
+        """
+        :param card_base: card attachment wrapper (JSON string, see config.CARD_BASE)
+        :param summary_card: summary card content (JSON string, see config.SUMMARY_CARD)
+        """
+        self.card_base = json.loads(card_base)
+        self.summary_card = json.loads(summary_card)
+
+        body = self.summary_card['body']
+        self._head = body[:self.HEADER + 1]
+        self._subtitle = body[self.SUBTITLE]
+        self._row = body[self.ROW]
+        self._cells = [(column, column['items'][0]) for column in self._row['columns']]
+
+    def content(self, rows, subtitle):
+        """
+        Render the summary card content
+        :param rows: list of rows, each a list of (text, color) cells (color None for the template color)
+        :param subtitle: text under the card title (ex: number of results, partial results)
+        :return: summary card content
+        """
+        body = list(self._head)
+        body[self.SUBTITLE] = dict(self._subtitle, text=subtitle)
+
+        for row in rows:
+            columns = []
+            for (column, item), (text, color) in zip(self._cells, row):
+                cell = dict(item, text=text)
+                if color is not None:
+                    cell['color'] = color
+                columns.append(dict(column, items=[cell]))
+            body.append(dict(self._row, columns=columns))
+
+        return dict(self.summary_card, body=body)
+
+    def attachment(self, content):
+        """
+        Wrap card content into a Webex card attachment
+        :param content: card content
+        :return: Webex card attachment
+        """
+        return dict(self.card_base, content=content)
+
+
+# Card templates, parsed once at startup
+HELP_CARD = json.loads(config.CARD_PAYLOAD)
+result_cards = ResultCardRenderer(config.CARD_BASE, config.RESULT_CARD)
+summary_cards = SummaryCardRenderer(config.CARD_BASE, config.SUMMARY_CARD)
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+__author__ = "Trevor Maco <tmaco@cisco.com>, Josh Ingeniero <jingenie@cisco.com>"
+__copyright__ = "Copyright (c) 2023 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+import concurrent.futures
+import threading
+import time
+
+
+class SingleFlight:
+    """
+    Coalesce calls with the same key: the first caller runs the call, callers arriving while it is in flight (or
+    within the sharing window after it started) get the same result instead of running it again
+    """
+
+    def __init__(self, window, keep=None):
+        """
+        :param window: seconds a call's result is shared after the call started
+        :param keep: optional callable(result) -> bool, rejected results (ex: errors) aren't shared with later callers
+        """
+        self.window = window
+        self.keep = keep
+
+        self._calls = {}
+        self._lock = threading.Lock()
+
+        # Counters
+        self.calls = 0
+        self.coalesced = 0
+
+    def do(self, key, func, *args):
+        """
+        Run func(*args) unless a call with the same key is in flight, then share its result
+        :param key: coalescing key
+        :param func: callable to run
+        :return: (result, shared) where shared is True if the result came from another caller's call
+        """
+        now = time.monotonic()
+        with self._lock:
+            # Drop expired calls
+            expired = [k for k, (_, started) in self._calls.items() if now - started > self.window]
+            for k in expired:
+                del self._calls[k]
+
+            entry = self._calls.get(key)
+            if entry is not None:
+                self.coalesced += 1
+                future = entry[0]
+                owner = False
+            else:
+                self.calls += 1
+                future = concurrent.futures.Future()
+                self._calls[key] = (future, now)
+                owner = True
+
+        if not owner:
+            return future.result(), True
+
+        try:
+            result = func(*args)
+        except Exception as e:
+            self._forget(key, future)
+            future.set_exception(e)
+            raise
+
+        if self.keep is not None and not self.keep(result):
+            self._forget(key, future)
+        future.set_result(result)
+        return result, False
+
+    def _forget(self, key, future):
+        """
+        Stop sharing a call's result with later callers (callers already waiting still get it)
+        """
+        with self._lock:
+            entry = self._calls.get(key)
+            if entry is not None and entry[0] is future:
+                del self._calls[key]
+
+    def stats(self):
+        """
+        Snapshot of coalescing state and counters
+        :return: dictionary of coalescing statistics
+        """
+        with self._lock:
+            return {'in_flight': len(self._calls), 'calls': self.calls, 'coalesced': self.coalesced}
@@ -1,6 +1,143 @@
 # Webex Bot
 BOT_EMAIL = ""
 WEBHOOK_BASE_URL = ""
+WEBEX_API_URL = "https://webexapis.com/v1/"  # Webex API base url (ex: local stand-ins, see benchmarks/bench_load.py)
+WEBHOOK_RECONCILE_WORKERS = 4  # concurrent Webex calls when creating/updating/deleting webhooks at startup
+
+# Metrics (Prometheus text format on the /metrics route of the bot)
+METRICS_ENABLED = True
+
+# Request tracing (timed spans of every card request, shown on the /trace/<id> route of the bot). Spans can also be
+# appended to TRACE_EXPORT_PATH, as JSON lines ('jsonl') or OTLP/JSON lines ('otlp', OpenTelemetry file exporter format),
+# /trace/<id> then also shows the spans recorded by other worker processes
+TRACING_ENABLED = True
+TRACE_MAX_TRACES = 500
+TRACE_EXPORT_PATH = ""
+TRACE_EXPORT_FORMAT = "jsonl"
+
+# Card dispatch ('queue': acknowledge card submissions immediately and run tests on background workers,
+# 'inline': run tests before returning the webhook response, 'durable': the bot only validates card submissions and
+# queues them in a SQLite file, separate worker.py processes run tests and deliver results)
+DISPATCH_MODE = "queue"
+WORK_QUEUE_DEPTH = 100  # maximum number of card submissions waiting for a worker
+WORK_QUEUE_WORKERS = 4  # number of background worker threads
+WORK_QUEUE_OVERFLOW = "reject"  # full queue policy ('reject': refuse new request, 'drop_oldest': evict oldest request)
+
+# Durable job queue ('durable' card dispatch). At most JOB_QUEUE_DEPTH card submissions wait or run (further ones are
+# refused). Each worker.py process runs JOB_WORKER_THREADS submissions at once, checking for new ones every
+# JOB_POLL_INTERVAL seconds when idle. A submission not acknowledged within JOB_VISIBILITY_TIMEOUT seconds (its worker
+# exited) is claimed again; failed ones are retried after JOB_RETRY_DELAY seconds (doubling), JOB_MAX_ATTEMPTS times,
+# then kept as failed for JOB_FAILED_RETENTION seconds
+JOB_QUEUE_PATH = "jobs.db"
+JOB_QUEUE_DEPTH = 1000
+JOB_WORKER_THREADS = 4
+JOB_POLL_INTERVAL = 0.5
+JOB_VISIBILITY_TIMEOUT = 300
+JOB_MAX_ATTEMPTS = 3
+JOB_RETRY_DELAY = 5
+JOB_FAILED_RETENTION = 604800
+
+# Webhook deduplication (Webex redelivers webhooks that aren't answered in time: a webhook id seen in the last
+# WEBHOOK_DEDUPE_TTL seconds is ignored, at most WEBHOOK_DEDUPE_SIZE ids are kept in memory). Set WEBHOOK_DEDUPE_PATH
+# to a SQLite file to share the index between worker processes ("" = this process only)
+WEBHOOK_DEDUPE_TTL = 600
+WEBHOOK_DEDUPE_SIZE = 10000
+WEBHOOK_DEDUPE_PATH = ""
+
+# Execution engine ('threaded': work queue, thread pools and scheduler threads, 'asyncio': one event loop running
+# tests, result polling and Webex delivery as coroutines, requires aiohttp). ASYNC_MAX_CARDS card submissions can be
+# in progress at once, ASYNC_MAX_CONNECTIONS is the HTTP connection limit, ASYNC_BLOCKING_WORKERS threads run blocking
+# work (agent lookups, SQLite)
+EXECUTION_ENGINE = "threaded"
+ASYNC_MAX_CARDS = 1000
+ASYNC_MAX_CONNECTIONS = 100
+ASYNC_BLOCKING_WORKERS = 4
+
+# Outbound Webex messages (one dispatcher queue: messages to a room are sent in order, at most WEBEX_RATE_LIMIT
+# messages per second overall, throttled or failed sends retried up to WEBEX_MAX_RETRIES times)
+WEBEX_RATE_LIMIT = 5
+WEBEX_RATE_BURST = 10
+WEBEX_DISPATCH_WORKERS = 4
+WEBEX_MAX_RETRIES = 3
+
+# Enterprise Agent directory (seconds before the cached agent list is refreshed in the background)
+ENTERPRISE_AGENT_TTL = 300
+
+# Endpoint Agent hostname cache (found hostnames are kept for ENDPOINT_AGENT_TTL seconds, unknown hostnames for
+# ENDPOINT_AGENT_NEGATIVE_TTL seconds)
+ENDPOINT_AGENT_CACHE_SIZE = 1000
+ENDPOINT_AGENT_TTL = 600
+ENDPOINT_AGENT_NEGATIVE_TTL = 30
+
+# ThousandEyes API transport (shared keep-alive connection pool, timeouts in seconds, retries on 5xx and connection
+# errors with exponential backoff)
+TE_API_URL = "https://api.thousandeyes.com"  # ThousandEyes API base url (ex: local stand-ins, see benchmarks)
+TE_POOL_SIZE = 20
+TE_CONNECT_TIMEOUT = 5
+TE_READ_TIMEOUT = 30
+TE_RETRIES = 3
+TE_RETRY_BACKOFF = 0.5
+
+# ThousandEyes rate limiting (shared by every ThousandEyes call in the process): token bucket at the organization rate
+# limit (requests per minute, replaced by the X-Organization-Rate-Limit-Limit header once seen, spent together by the
+# worker processes sharing SHARED_STATE_PATH), adaptive concurrency between TE_MIN_CONCURRENCY and TE_MAX_CONCURRENCY
+# per process (halved on 429 or calls slower than TE_LATENCY_TARGET seconds), throttled calls retried up to
+# TE_THROTTLE_RETRIES times after Retry-After
+TE_RATE_LIMIT_PER_MINUTE = 240
+TE_RATE_LIMIT_BURST = 10
+TE_MIN_CONCURRENCY = 2
+TE_MAX_CONCURRENCY = 32
+TE_LATENCY_TARGET = 5
+TE_THROTTLE_RETRIES = 3
+
+# Multi-agent tests (a card can list several agents, each test is launched for up to INSTANT_TEST_MAX_AGENTS agents
+# per ThousandEyes call)
+INSTANT_TEST_MAX_AGENTS = 25
+
+# Instant test coalescing (seconds after launch during which requests for the same agent, test and target attach to
+# the running test instead of launching a new one)
+COALESCE_WINDOW = 60
+
+# Result readiness polling (first poll after RESULT_POLL_INITIAL_DELAY seconds, each following wait is multiplied by
+# RESULT_POLL_BACKOFF up to RESULT_POLL_MAX_INTERVAL, give up RESULT_DEADLINE seconds after the test was launched)
+RESULT_POLL_INITIAL_DELAY = 5
+RESULT_POLL_BACKOFF = 1.5
+RESULT_POLL_MAX_INTERVAL = 30
+RESULT_DEADLINE = 300
+
+# Result fetching (result links of a batch of tests are downloaded concurrently by RESULT_FETCH_WORKERS threads, the
+# whole batch waits at most RESULT_FETCH_TIMEOUT seconds)
+RESULT_FETCH_WORKERS = 16
+RESULT_FETCH_TIMEOUT = 30
+
+# Result cache (recent results for the same agent and target are answered from the cache for RESULT_FRESHNESS
+# seconds, 0 disables the cache)
+RESULT_CACHE_SIZE = 500
+RESULT_FRESHNESS = 120
+
+# Result summary (True: the results of a request are sent as one summary card, one row per test target and agent,
+# once every result is in or at the deadline with partial results; False: one result card per test and agent).
+# Summaries with more than SUMMARY_MAX_ROWS rows are split over several cards
+RESULT_SUMMARY = True
+SUMMARY_MAX_ROWS = 40
+
+# Durable store of pending result deliveries (SQLite file), and startup catch-up of deliveries that became due while
+# the bot was down (at most CATCH_UP_LIMIT deliveries, CATCH_UP_WORKERS at a time)
+DELIVERY_STORE_PATH = "deliveries.db"
+CATCH_UP_LIMIT = 200
+CATCH_UP_WORKERS = 8
+
+# Multi-worker deployment (ex: gunicorn -w 4 wsgi:app, see README). SHARED_STATE_PATH is a SQLite file holding the
+# agent lookups, result cache, webhook dedupe index and ThousandEyes rate budget of every worker process ("" = each
+# process keeps its own, except under wsgi.py and worker.py, which use DELIVERY_STORE_PATH + ".shared").
+# With SCHEDULER_LOCK_PATH set, deliveries are only persisted by the worker that received the card, and the worker
+# holding the lock file polls every due delivery each DELIVERY_SWEEP_INTERVAL seconds; the other workers retry the
+# lock every SCHEDULER_LOCK_RETRY seconds and take over if the leader exits ("" = this process runs its own scheduler,
+# except under wsgi.py and in durable mode, which use DELIVERY_STORE_PATH + ".lock")
+SHARED_STATE_PATH = ""
+SCHEDULER_LOCK_PATH = ""
+SCHEDULER_LOCK_RETRY = 5
+DELIVERY_SWEEP_INTERVAL = 1
 
 # Card payload for launching tests
 CARD_PAYLOAD = """{
@@ -20,14 +157,14 @@ CARD_PAYLOAD = """{
         },
         {
             "type": "Input.Text",
-            "placeholder": "Enterprise Agent Name (case-sensitive)",
+            "placeholder": "Enterprise Agent Name(s) (case-sensitive, comma separated, group:<label> for a label)",
             "style": "text",
             "maxLength": 0,
             "id": "sitenameVal"
         },
         {
             "type": "Input.Text",
-            "placeholder": "Endpoint Agent Device Hostname (case-sensitive)",
+            "placeholder": "Endpoint Agent Device Hostname(s) (case-sensitive, comma separated)",
             "style": "text",
             "maxLength": 0,
             "id": "hostnameVal"
@@ -155,4 +292,188 @@ RESULT_CARD = """{
             ]
         }
     ]
-}"""
\ No newline at end of file
+}"""
+
+# Summary card (one row per test target and agent, the last body element is the row template)
+SUMMARY_CARD = """{
+    "$schema": "http://adaptivecards.io/schemas/adaptive-card.json",
+    "type": "AdaptiveCard",
+    "version": "1.2",
+    "body": [
+        {
+            "type": "TextBlock",
+            "text": "ThousandEyes Test Summary",
+            "weight": "Bolder",
+            "size": "Medium"
+        },
+        {
+            "type": "TextBlock",
+            "spacing": "None",
+            "text": "9 of 9 results",
+            "isSubtle": true,
+            "wrap": true
+        },
+        {
+            "type": "ColumnSet",
+            "separator": true,
+            "columns": [
+                {
+                    "type": "Column",
+                    "width": "stretch",
+                    "items": [
+                        {
+                            "type": "TextBlock",
+                            "text": "Target",
+                            "wrap": true,
+                            "size": "Small",
+                            "weight": "Bolder"
+                        }
+                    ]
+                },
+                {
+                    "type": "Column",
+                    "width": "stretch",
+                    "items": [
+                        {
+                            "type": "TextBlock",
+                            "text": "Agent",
+                            "wrap": true,
+                            "size": "Small",
+                            "weight": "Bolder"
+                        }
+                    ]
+                },
+                {
+                    "type": "Column",
+                    "width": "auto",
+                    "items": [
+                        {
+                            "type": "TextBlock",
+                            "text": "Response",
+                            "wrap": true,
+                            "size": "Small",
+                            "weight": "Bolder"
+                        }
+                    ]
+                },
+                {
+                    "type": "Column",
+                    "width": "auto",
+                    "items": [
+                        {
+                            "type": "TextBlock",
+                            "text": "Time",
+                            "wrap": true,
+                            "size": "Small",
+                            "weight": "Bolder"
+                        }
+                    ]
+                },
+                {
+                    "type": "Column",
+                    "width": "auto",
+                    "items": [
+                        {
+                            "type": "TextBlock",
+                            "text": "Loss",
+                            "wrap": true,
+                            "size": "Small",
+                            "weight": "Bolder"
+                        }
+                    ]
+                },
+                {
+                    "type": "Column",
+                    "width": "auto",
+                    "items": [
+                        {
+                            "type": "TextBlock",
+                            "text": "Latency",
+                            "wrap": true,
+                            "size": "Small",
+                            "weight": "Bolder"
+                        }
+                    ]
+                }
+            ]
+        },
+        {
+            "type": "ColumnSet",
+            "spacing": "Small",
+            "columns": [
+                {
+                    "type": "Column",
+                    "width": "stretch",
+                    "items": [
+                        {
+                            "type": "TextBlock",
+                            "text": "https://login.microsoftonline.com",
+                            "wrap": true,
+                            "size": "Small"
+                        }
+                    ]
+                },
+                {
+                    "type": "Column",
+                    "width": "stretch",
+                    "items": [
+                        {
+                            "type": "TextBlock",
+                            "text": "Branch-01",
+                            "wrap": true,
+                            "size": "Small"
+                        }
+                    ]
+                },
+                {
+                    "type": "Column",
+                    "width": "auto",
+                    "items": [
+                        {
+                            "type": "TextBlock",
+                            "text": "200",
+                            "wrap": true,
+                            "size": "Small"
+                        }
+                    ]
+                },
+                {
+                    "type": "Column",
+                    "width": "auto",
+                    "items": [
+                        {
+                            "type": "TextBlock",
+                            "text": "252 ms",
+                            "wrap": true,
+                            "size": "Small"
+                        }
+                    ]
+                },
+                {
+                    "type": "Column",
+                    "width": "auto",
+                    "items": [
+                        {
+                            "type": "TextBlock",
+                            "text": "0 %",
+                            "wrap": true,
+                            "size": "Small"
+                        }
+                    ]
+                },
+                {
+                    "type": "Column",
+                    "width": "auto",
+                    "items": [
+                        {
+                            "type": "TextBlock",
+                            "text": "25 ms",
+                            "wrap": true,
+                            "size": "Small"
+                        }
+                    ]
+                }
+            ]
+        }
+    ]
+}"""
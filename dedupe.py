@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+__author__ = "Trevor Maco <tmaco@cisco.com>, Josh Ingeniero <jingenie@cisco.com>"
+__copyright__ = "Copyright (c) 2023 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+import collections
+import contextlib
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Expired ids are purged from the shared index every PURGE_EVERY claims
+PURGE_EVERY = 100
+
+
+class WebhookDedupe:
+    """
+    Bounded, time-expiring index of the webhooks already handled, so Webex redeliveries (sent when a webhook isn't
+    answered fast enough) are dropped before any ThousandEyes or Webex call. Ids are kept in memory, a redelivery to
+    the same process costs one dictionary lookup; with a SQLite file, the index is shared by every worker process
+    """
+
+    def __init__(self, ttl, max_size, path=None):
+        """
+        :param ttl: seconds a webhook id is remembered
+        :param max_size: maximum number of ids kept in memory (oldest are forgotten first)
+        :param path: optional SQLite file shared by worker processes
+        """
+        self.ttl = ttl
+        self.max_size = max_size
+        self.path = path
+
+        self._seen = collections.OrderedDict()  # webhook id -> expiry (epoch time)
+        self._lock = threading.Lock()
+
+        # Counters
+        self.claimed = 0
+        self.duplicates = 0
+        self.shared_errors = 0
+
+        if self.path:
+            with self._connect() as conn:
+                conn.execute('PRAGMA journal_mode=WAL')
+                conn.execute('''CREATE TABLE IF NOT EXISTS webhook_events (
+                                    id TEXT PRIMARY KEY,
+                                    expires_at REAL NOT NULL)''')
+                conn.execute('CREATE INDEX IF NOT EXISTS webhook_events_expires_at ON webhook_events (expires_at)')
+
+    @contextlib.contextmanager
+    def _connect(self):
+        """
+        New connection per call (webhooks are handled on several threads), committed and closed on exit
+        """
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def claim(self, key):
+        """
+        Record a webhook id, unless it was already seen
+        :param key: webhook id (ex: data.id of the webhook)
+        :return: True the first time (handle the webhook), False for a redelivery within the ttl
+        """
+        now = time.time()
+        with self._lock:
+            expires_at = self._seen.get(key)
+            if expires_at is not None and expires_at > now:
+                self.duplicates += 1
+                return False
+
+            # Remembered before the shared index is checked: concurrent redeliveries to this process stop here
+            self._seen[key] = now + self.ttl
+            self._seen.move_to_end(key)
+            while len(self._seen) > self.max_size:
+                self._seen.popitem(last=False)
+
+        if self.path and not self._claim_shared(key, now):
+            with self._lock:
+                self.duplicates += 1
+            return False
+
+        with self._lock:
+            self.claimed += 1
+        return True
+
+    def _claim_shared(self, key, now):
+        """
+        Record a webhook id in the shared index
+        :return: True if no other process handled it within the ttl
+        """
+        try:
+            with self._connect() as conn:
+                conn.execute('DELETE FROM webhook_events WHERE id = ? AND expires_at <= ?', (key, now))
+                cursor = conn.execute('INSERT OR IGNORE INTO webhook_events (id, expires_at) VALUES (?, ?)',
+                                      (key, now + self.ttl))
+                if (self.claimed + self.duplicates) % PURGE_EVERY == 0:
+                    conn.execute('DELETE FROM webhook_events WHERE expires_at <= ?', (now,))
+                return cursor.rowcount == 1
+        except sqlite3.Error as e:
+            # Handling a webhook twice beats dropping it
+            logger.error(f'Shared webhook index unavailable: {str(e)}')
+            with self._lock:
+                self.shared_errors += 1
+            return True
+
+    @contextlib.contextmanager
+    def handling(self, key):
+        """
+        Claim a webhook id while it is handled, and release it if the handling raises: Webex redelivers webhooks that
+        failed, the redelivery is let through
+        :param key: webhook id (ex: data.id of the webhook)
+        :return: context manager giving True if the webhook should be handled, False for a redelivery
+        """
+        claimed = self.claim(key)
+        try:
+            yield claimed
+        except BaseException:
+            if claimed:
+                self.release(key)
+            raise
+
+    def release(self, key):
+        """
+        Forget a webhook id (ex: its handling failed, let Webex redeliver it)
+        :param key: webhook id
+        """
+        with self._lock:
+            self._seen.pop(key, None)
+
+        if self.path:
+            try:
+                with self._connect() as conn:
+                    conn.execute('DELETE FROM webhook_events WHERE id = ?', (key,))
+            except sqlite3.Error as e:
+                logger.error(f'Shared webhook index unavailable: {str(e)}')
+
+    def stats(self):
+        """
+        Snapshot of index state and counters
+        :return: dictionary of dedupe statistics
+        """
+        with self._lock:
+            return {'entries': len(self._seen), 'claimed': self.claimed, 'duplicates': self.duplicates,
+                    'shared_errors': self.shared_errors}
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+__author__ = "Trevor Maco <tmaco@cisco.com>, Josh Ingeniero <jingenie@cisco.com>"
+__copyright__ = "Copyright (c) 2023 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+import contextlib
+import json
+import sqlite3
+import time
+
+
+def compact_result(result):
+    """
+    Reduce a ThousandEyes test creation response to what result delivery needs (test ids and apiLinks)
+    :param result - ThousandEyes response for creating tests
+    :return: compact result, same shape as the ThousandEyes response
+    """
+    for test in ('endpointTest', 'test'):
+        if test in result:
+            return {test: [{'testId': t.get('testId'), 'testName': t.get('testName'), 'type': t.get('type'),
+                            'interval': t.get('interval'),
+                            'apiLinks': [{'rel': link.get('rel'), 'href': link['href']} for link in t['apiLinks']]}
+                           for t in result[test]]}
+
+    # ThousandEyes error response, keep it as is (it's small, and shown to the user)
+    return result
+
+
+class DeliveryStore:
+    """
+    Durable SQLite store of pending result deliveries, so scheduled deliveries survive restarts and deploys
+    """
+
+    def __init__(self, path):
+        """
+        :param path: SQLite database file
+        """
+        self.path = path
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''CREATE TABLE IF NOT EXISTS deliveries (
+                                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                room_id TEXT NOT NULL,
+                                test_target TEXT NOT NULL,
+                                result TEXT NOT NULL,
+                                due_at REAL NOT NULL,
+                                deadline REAL NOT NULL,
+                                delay REAL NOT NULL,
+                                created_at REAL NOT NULL,
+                                records TEXT NOT NULL,
+                                trace_id TEXT)''')
+            conn.execute('CREATE INDEX IF NOT EXISTS deliveries_due_at ON deliveries (due_at)')
+
+    @contextlib.contextmanager
+    def _connect(self):
+        """
+        New connection per call (SQLite connections can't be shared across scheduler threads), committed and closed
+        on exit
+        """
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def add(self, tests, room_id, due_at, deadline, delay, records=None, trace_id=None):
+        """
+        Persist a pending delivery (all the tests of one request)
+        :param tests: list of tests, dictionaries with the ThousandEyes 'result' for creating the test (stored
+        compacted), its 'agents' (list of (agent id, agent name)), 'test_key', 'target' and 'applications'
+        :param room_id: roomId to send the results to
+        :param due_at: epoch time of the next poll
+        :param deadline: epoch time after which polling stops
+        :param delay: seconds waited before the next poll
+        :param records: results already collected (see generate_result.update_records)
+        :param trace_id: trace of the request (see tracing), the polls continue it
+        :return: delivery id
+        """
+        test_target = ', '.join(dict.fromkeys(name for test in tests for _, name in test['agents']))
+        stored = [{'result': compact_result(test['result']) if test['result'] is not None else None,
+                   'agents': test['agents'], 'test_key': test['test_key'], 'target': test['target'],
+                   'applications': test['applications']} for test in tests]
+        with self._connect() as conn:
+            cursor = conn.execute('INSERT INTO deliveries (room_id, test_target, result, due_at, deadline, delay, '
+                                  'created_at, records, trace_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                  (room_id, test_target, json.dumps(stored), due_at, deadline, delay, time.time(),
+                                   json.dumps(records or {}), trace_id))
+            return cursor.lastrowid
+
+    def get(self, delivery_id):
+        """
+        Load a pending delivery
+        :param delivery_id: delivery id
+        :return: delivery dictionary or None if it was already completed
+        """
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            row = conn.execute('SELECT * FROM deliveries WHERE id = ?', (delivery_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def reschedule(self, delivery_id, due_at, delay, records=None):
+        """
+        Move the next poll of a pending delivery
+        :param delivery_id: delivery id
+        :param due_at: epoch time of the next poll
+        :param delay: seconds waited before the next poll
+        :param records: optional results collected so far, kept for the next poll
+        """
+        with self._connect() as conn:
+            if records is None:
+                conn.execute('UPDATE deliveries SET due_at = ?, delay = ? WHERE id = ?', (due_at, delay, delivery_id))
+            else:
+                conn.execute('UPDATE deliveries SET due_at = ?, delay = ?, records = ? WHERE id = ?',
+                             (due_at, delay, json.dumps(records), delivery_id))
+
+    def remove(self, delivery_id):
+        """
+        Delete a completed delivery
+        :param delivery_id: delivery id
+        """
+        with self._connect() as conn:
+            conn.execute('DELETE FROM deliveries WHERE id = ?', (delivery_id,))
+
+    def count(self):
+        """
+        Number of pending deliveries
+        """
+        with self._connect() as conn:
+            return conn.execute('SELECT COUNT(*) FROM deliveries').fetchone()[0]
+
+    def pending(self, created_before=None):
+        """
+        All pending deliveries, earliest due first
+        :param created_before: optional epoch time, only deliveries created before it (ex: by a previous run)
+        :return: list of delivery dictionaries
+        """
+        created_before = time.time() if created_before is None else created_before
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            rows = conn.execute('SELECT * FROM deliveries WHERE created_at < ? ORDER BY due_at',
+                                (created_before,)).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def due(self, due_before, limit=None):
+        """
+        Pending deliveries due for a poll, earliest due first
+        :param due_before: epoch time
+        :param limit: optional maximum number of deliveries
+        :return: list of delivery dictionaries
+        """
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            rows = conn.execute('SELECT * FROM deliveries WHERE due_at <= ? ORDER BY due_at LIMIT ?',
+                                (due_before, -1 if limit is None else limit)).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    @staticmethod
+    def _to_dict(row):
+        delivery = dict(row)
+        delivery['records'] = json.loads(delivery['records'])
+        delivery['tests'] = [dict(test, agents=[tuple(agent) for agent in test['agents']],
+                                  test_key=tuple(test['test_key']) if test['test_key'] else None, cached=None)
+                             for test in json.loads(delivery.pop('result'))]
+        return delivery
@@ -17,23 +17,55 @@ __author__ = "Trevor Maco <tmaco@cisco.com>, Josh Ingeniero <jingenie@cisco.com>
 __copyright__ = "Copyright (c) 2023 Cisco and/or its affiliates."
 __license__ = "Cisco Sample Code License, Version 1.1"
 
+import concurrent.futures
+import contextvars
 import datetime
 import json
-import os
+import time
 
-import requests
 from rich.console import Console
-from dotenv import load_dotenv
 
 import config
-
-# Load env variables
-load_dotenv()
-THOUSAND_EYES_TOKEN = os.getenv("THOUSAND_EYES_TOKEN")
+from cards import result_cards, summary_cards
+from delivery_store import DeliveryStore
+from metrics import DELIVERY_BUCKETS, registry
+from result_cache import ResultCache, result_key
+from shared_store import SharedCache
+from tracing import tracer
+from transport import thousandeyes
 
 # Rich Console Instance
 console = Console()
 
+# Transport result links are downloaded through (anything with get(url) returning a response, ex:
+# transport.FixtureTransport serving recorded responses in benchmarks)
+result_transport = thousandeyes
+
+# Shared pool for fetching result links concurrently
+fetch_pool = concurrent.futures.ThreadPoolExecutor(max_workers=config.RESULT_FETCH_WORKERS,
+                                                   thread_name_prefix='result-fetch')
+
+# Durable store of pending result deliveries
+delivery_store = DeliveryStore(config.DELIVERY_STORE_PATH)
+
+# Recently completed test results, keyed on (test type, agent id, test kind, target), see result_cache.result_key
+# (shared by the worker processes of a multi-worker deployment)
+result_cache = ResultCache(config.RESULT_CACHE_SIZE, config.RESULT_FRESHNESS,
+                           shared=SharedCache(config.SHARED_STATE_PATH, 'results')
+                           if config.SHARED_STATE_PATH else None)
+
+# Result delivery metrics
+DELIVERY_SECONDS = registry.histogram('chatbot_result_delivery_seconds',
+                                      'Time from scheduling a request to sending its results, by outcome',
+                                      labels=('outcome',), buckets=DELIVERY_BUCKETS)
+registry.counter_from('chatbot_result_cache_lookups_total', 'Result cache lookups by outcome',
+                      lambda: {'hit': result_cache.stats()['hits'], 'miss': result_cache.stats()['misses']},
+                      labels=('result',))
+registry.gauge_from('chatbot_pending_deliveries', 'Result deliveries waiting for results', delivery_store.count)
+# ThreadPoolExecutor has no public queue size, its work queue is read directly
+registry.gauge_from('chatbot_fetch_pool_queued', 'Result link downloads waiting for a fetch thread',
+                    lambda: fetch_pool._work_queue.qsize())
+
 
 def call_url(url):
     """
@@ -41,68 +73,207 @@ def call_url(url):
     :param url - ThousandEyes apiLink
     :return: ThousandEyes test result data
     """
-    payload = {}
-    headers = {
-        'Accept': 'application/json',
-        'Authorization': f"Bearer {THOUSAND_EYES_TOKEN}"
-    }
-
-    response = requests.get(url, headers=headers, data=payload)
+    response = result_transport.get(url)
     return response
 
 
-def generate_result(result, test_target):
+def result_keys(result):
+    """
+    Returns the ThousandEyes response keys for the test type of a result
+    :param result - ThousandEyes response for creating tests
+    :return: (test, web, net) keys, endpoint or enterprise flavour
+    """
+    if 'endpointTest' in result.keys():
+        return 'endpointTest', 'endpointWeb', 'endpointNet'
+    return 'test', 'web', 'net'
+
+
+def result_links(result):
+    """
+    Extract the result data links from a ThousandEyes test creation response
+    :param result - ThousandEyes response for creating tests
+    :return: dictionary with 'metrics' link (and 'http' link for http-server tests), or None if apiLinks do not exist
+    """
+    test, _, _ = result_keys(result)
+
+    # Error check test returned error
+    if test not in result:
+        return None
+
+    api_links = result[test][0]['apiLinks']
+    if 'metrics' not in api_links[1]['href']:  # both exist = http-server test
+        return {'http': api_links[1]['href'], 'metrics': api_links[2]['href']}
+
+    # only metrics = agent-server
+    return {'metrics': api_links[1]['href']}
+
+
+def fetch_url_json(url):
+    """
+    Download and decode one ThousandEyes result link
+    :param url - ThousandEyes apiLink
+    :return: ThousandEyes result data, or None if the download failed
+    """
+    try:
+        response = call_url(url)
+        return response.json() if response.ok else None
+    except Exception as e:
+        console.print(f'[red]Unable to fetch {url}: {str(e)}[/]')
+        return None
+
+
+def fetch_batch(links_list, timeout=None):
+    """
+    Get test results for every component of every test in a batch concurrently, bounded by a batch deadline
+    :param links_list: list of result data links (see result_links), one per test
+    :param timeout: seconds to wait for the whole batch (defaults to RESULT_FETCH_TIMEOUT)
+    :return: list of fetched result data (see fetch_result_data), in the same order as links_list
+    """
+    timeout = config.RESULT_FETCH_TIMEOUT if timeout is None else timeout
+    # Downloads run in the context of the request (trace), each in its own copy
+    futures = [{component: fetch_pool.submit(contextvars.copy_context().run, fetch_url_json, link)
+                for component, link in links.items()} for links in links_list]
+
+    # Wait for the slowest fetch (or the deadline), components that didn't make it count as missing
+    _, late = concurrent.futures.wait([future for test in futures for future in test.values()], timeout=timeout)
+
+    # Drop the late fetches still queued, so they don't hold up later batches on the shared pool (fetches already
+    # running can't be interrupted, they end with the transport's read timeout)
+    for future in late:
+        future.cancel()
+
+    return [{component: future.result() if future.done() and not future.cancelled() else None
+             for component, future in test.items()} for test in futures]
+
+
+def fetch_result_data(links):
+    """
+    Get test results for each component from ThousandEyes (components are fetched concurrently)
+    :param links: result data links (see result_links)
+    :return: dictionary of component -> ThousandEyes result data (None for components that failed to download)
+    """
+    return fetch_batch([links])[0]
+
+
+def agent_row(rows, agent_id=None):
+    """
+    Pick one agent's row from a ThousandEyes result list (tests on several agents have one row per agent)
+    :param rows: ThousandEyes result rows (httpServer, metrics)
+    :param agent_id: Endpoint or Enterprise Agent ID, None for the first row
+    :return: result row
+    """
+    if agent_id is None:
+        return rows[0]
+    for row in rows:
+        if row.get('agentId') == agent_id:
+            return row
+    raise IndexError(f'no results for agent {agent_id}')
+
+
+def ready_agents(result, data, agent_ids):
+    """
+    Agents ThousandEyes has finished collecting data for
+    :param result - ThousandEyes response for creating tests
+    :param data: fetched result data (see fetch_result_data)
+    :param agent_ids: Endpoint or Enterprise Agent IDs the test runs on
+    :return: set of agent ids with at least one round of results in every component
+    """
+    _, web, net = result_keys(result)
+    try:
+        reported = {row.get('agentId') for row in data['metrics'][net]['metrics']}
+        if 'http' in data:
+            reported &= {row.get('agentId') for row in data['http'][web]['httpServer']}
+    except (KeyError, TypeError):
+        return set()
+    return {agent_id for agent_id in agent_ids if agent_id in reported}
+
+
+def result_ready(result, data):
+    """
+    Check whether ThousandEyes has finished collecting the data for a test
+    :param result - ThousandEyes response for creating tests
+    :param data: fetched result data (see fetch_result_data)
+    :return: True if every component has at least one round of results
+    """
+    _, web, net = result_keys(result)
+    try:
+        if 'http' in data and not data['http'][web]['httpServer']:
+            return False
+        return bool(data['metrics'][net]['metrics'])
+    except (KeyError, TypeError):
+        return False
+
+
+def agents_with_results(result, data, agent_ids):
+    """
+    Agents whose results are ready to be sent (a test on a single agent only needs a round of results)
+    :param result - ThousandEyes response for creating tests
+    :param data: fetched result data (see fetch_result_data)
+    :param agent_ids: Endpoint or Enterprise Agent IDs the test runs on
+    :return: set of agent ids
+    """
+    if len(agent_ids) > 1:
+        return ready_agents(result, data, agent_ids)
+    return set(agent_ids) if result_ready(result, data) else set()
+
+
+def generate_result(result, test_target, data=None):
     """
     Returns a JSON-formatted card for Webex Cards from ThousandEyes Test results
     :param result - ThousandEyes response for creating tests
     :param test_target: Target of Test (Endpoint Hostname, Enterprise Agent Name)
+    :param data: already fetched result data (see fetch_result_data), downloaded from ThousandEyes if not provided
     :return card - formatted for Webex or None if apiLinks do not exist
     """
-    # Endpoint Test Case
-    if 'endpointTest' in result.keys():
-        web = 'endpointWeb'
-        test = 'endpointTest'
-        net = 'endpointNet'
+    links = result_links(result)
+    if links is None:
+        return None
+
+    if data is None:
+        data = fetch_result_data(links)
 
-        # Error check test returned error
-        if test not in result:
-            return None
+    return build_result_card(parse_result(result, links, data), test_target)
 
-        if 'metrics' not in result[test][0]['apiLinks'][1]['href']:  # both exist = http-server test
-            # Extract links from response payload
-            http_link = result[test][0]['apiLinks'][1]['href']
-            metrics_link = result[test][0]['apiLinks'][2]['href']
 
-            # Get test results for each component from ThousandEyes
-            http = call_url(http_link).json()
-            metrics = call_url(metrics_link).json()
+def parse_result(result, links, data, agent_id=None):
+    """
+    Extract the values shown on a result card from ThousandEyes Test results
+    :param result - ThousandEyes response for creating tests
+    :param links: result data links (see result_links)
+    :param data: fetched result data (see fetch_result_data)
+    :param agent_id: agent to extract the values of (tests on several agents), None for the first agent
+    :return: result record (date, url, status, code, total, loss, latency, jitter, cpu)
+    """
+    test, web, net = result_keys(result)
+    http = data.get('http')
+    metrics = data['metrics']
+    if 'http' in links:
+        server = agent_row(http[web]['httpServer'], agent_id)
+    metric = agent_row(metrics[net]['metrics'], agent_id)
 
+    # Endpoint Test Case
+    if test == 'endpointTest':
+        if 'http' in links:  # both exist = http-server test
             # Extract relevant values from results
-            code = http[web]['httpServer'][0]['responseCode']
+            code = server['responseCode']
             if code == 200:
                 status = 'Everything seems normal at office, try rebooting your PC.'
-                total = http[web]['httpServer'][0]['totalTime']
-                cpu = http[web]['httpServer'][0]['systemMetrics']['cpuUtilization']['mean'] * 100
+                total = server['totalTime']
+                cpu = server['systemMetrics']['cpuUtilization']['mean'] * 100
                 cpu = round(cpu, 2)
                 date = http[web][test]['createdDate']
             else:
                 status = "Unfortunately it looks like your endpoint is having network issues with this application. " \
                          "Please call the help desk. "
                 total = 'N/A'
-                cpu = http[web]['httpServer'][0]['systemMetrics']['cpuUtilization']['mean'] * 100
+                cpu = server['systemMetrics']['cpuUtilization']['mean'] * 100
                 cpu = round(cpu, 2)
                 date = 'N/A'
             url = http[web][test]['server']
         else:  # only metrics = agent-server
-            # Extract links from response payload
-            metrics_link = result[test][0]['apiLinks'][1]['href']
-
-            # Get test results for each component from ThousandEyes
-            metrics = call_url(metrics_link).json()
-
             # Extract relevant values from results
             date = metrics[net][test]['createdDate']
-            cpu = metrics[net]['metrics'][0]['systemMetrics']['cpuUtilization']['mean'] * 100
+            cpu = metric['systemMetrics']['cpuUtilization']['mean'] * 100
             cpu = round(cpu, 2)
             url = metrics[net][test]['server']
             status = 'Agent-to-server Test'
@@ -111,28 +282,12 @@ def generate_result(result, test_target):
 
     # Enterprise Test Case
     else:
-        web = 'web'
-        test = 'test'
-        net = 'net'
-
-        # Error check test returned error
-        if test not in result:
-            return None
-
-        if 'metrics' not in result[test][0]['apiLinks'][1]['href']:  # both exist = http-server test
-            # Extract links from response payload
-            http_link = result[test][0]['apiLinks'][1]['href']
-            metrics_link = result[test][0]['apiLinks'][2]['href']
-
-            # Get test results for each component from ThousandEyes
-            http = call_url(http_link).json()
-            metrics = call_url(metrics_link).json()
-
+        if 'http' in links:  # both exist = http-server test
             # Extract relevant values from results
-            code = http[web]['httpServer'][0]['responseCode']
+            code = server['responseCode']
             if code == 200:
                 status = 'Everything seems normal at office, try rebooting your PC.'
-                total = http[web]['httpServer'][0]['totalTime']
+                total = server['totalTime']
                 cpu = 'N/A'
                 date = http[web][test]['createdDate']
             else:
@@ -144,12 +299,6 @@ def generate_result(result, test_target):
             url = http[web][test]['url']
 
         else:  # only metrics = agent-server
-            # Extract links from response payload
-            metrics_link = result[test][0]['apiLinks'][1]['href']
-
-            # Get test results for each component from ThousandEyes
-            metrics = call_url(metrics_link).json()
-
             # Extract relevant values from results
             date = metrics[net][test]['createdDate']
             cpu = 'N/A'
@@ -159,11 +308,11 @@ def generate_result(result, test_target):
             total = 'N/A'
 
     # Extract loss, latency, jitter from metrics results
-    if 'loss' in metrics[net]['metrics'][0].keys():
-        loss = metrics[net]['metrics'][0]['loss']
-        if 'jitter' in metrics[net]['metrics'][0].keys():
-            latency = metrics[net]['metrics'][0]['avgLatency']
-            jitter = metrics[net]['metrics'][0]['jitter']
+    if 'loss' in metric.keys():
+        loss = metric['loss']
+        if 'jitter' in metric.keys():
+            latency = metric['avgLatency']
+            jitter = metric['jitter']
         else:
             latency = 'N/A'
             jitter = 'N/A'
@@ -172,67 +321,459 @@ def generate_result(result, test_target):
         latency = 'N/A'
         jitter = 'N/A'
 
-    # Build contents of Webex Card
-    result_card = json.loads(config.RESULT_CARD)
+    return {'date': date, 'url': url, 'status': status, 'code': code, 'total': total, 'loss': loss,
+            'latency': latency, 'jitter': jitter, 'cpu': cpu}
 
-    result_card['body'][1]['text'] = f"Created {date}"  # Date message
-    result_card['body'][2]['text'] = f"Agent: {test_target}"  # test target
-    result_card['body'][3]['text'] = f"Test Target: {url}"  # url
-    result_card['body'][4]['text'] = status  # Status message
-    result_card['body'][5]['facts'][0]['value'] = str(code)  # Response Code
-    result_card['body'][5]['facts'][1]['value'] = f"{total} ms"  # Total Response Time
-    result_card['body'][5]['facts'][2]['value'] = f"{loss} %"  # Loss
-    result_card['body'][5]['facts'][3]['value'] = f"{latency} ms"  # Average Latency
-    result_card['body'][5]['facts'][4]['value'] = f"{jitter} ms"  # Jitter
-    result_card['body'][5]['facts'][5]['value'] = f"{cpu} %"  # CPU
 
-    return result_card
+def build_result_card(record, test_target, age=None):
+    """
+    Returns a JSON-formatted card for Webex Cards from a result record
+    :param record: result record (see parse_result)
+    :param test_target: Target of Test (Endpoint Hostname, Enterprise Agent Name)
+    :param age: seconds since the result was collected, if it is served from the result cache
+    :return card - formatted for Webex
+    """
+    return result_cards.content(record, test_target, age=age)
 
 
-def send_result(result, sender, api_object, test_target):
+def error_message(result, test_target):
     """
-    Callable method for scheduler, create and send webex card with ThousandEyes test results
+    Markdown message for results that could not be parsed
+    :param result - ThousandEyes response from creating tests
+    :param test_target: Target of Test (Endpoint Hostname, Enterprise Agent Name)
+    :return: markdown message
+    """
+    return f"**Error:**  \nUnable to parse test results from ThousandEyes API for target: '{test_target}'\n\n**Results:**  \n```{result}```"
+
+
+def timeout_message(test_target):
+    """
+    Markdown message for results that were not ready by the deadline
     :param test_target: Target of Test (Endpoint Hostname, Enterprise Agent Name)
+    :return: markdown message
+    """
+    return f"**Timed out:**  \nThousandEyes did not return test results for target: '{test_target}' in time. " \
+           f"Please try again."
+
+
+def send_card(card, result, sender, api_object, test_target):
+    """
+    Send a result card to Webex, or an error message if the results could not be parsed
+    :param card: Webex card content (None if the results could not be parsed)
     :param result - ThousandEyes response from creating tests
     :param sender - roomId to send card to in Webex
     :param api_object - webexteamssdk api instance
+    :param test_target: Target of Test (Endpoint Hostname, Enterprise Agent Name)
     """
-    # Generate Card Data (ThousandEyes Test Results)
-    card = generate_result(result, test_target)
-
     if card:
-        # Build Webex Card
-        card_base = json.loads(config.CARD_BASE)
-        card_base['content'] = card
-
         # Send Card to Webex
         api_object.messages.create(roomId=sender,
                                    text='ThousandEyes Webex Card Results',
-                                   attachments=[card_base])
+                                   attachments=[result_cards.attachment(card)])
         console.print(f'[green]Webex result delivered![/]')
     else:
         # Send Error Message
-        error_message = f"**Error:**  \nUnable to parse test results from ThousandEyes API for target: '{test_target}'\n\n**Results:**  \n```{result}```"
         api_object.messages.create(roomId=sender,
-                                   markdown=error_message)
+                                   markdown=error_message(result, test_target))
 
 
-def schedule_result(result, sender, job_store, api_object, test_target):
+def send_result(result, sender, api_object, test_target):
     """
-    Scheduled job to send result cards at a specific time
+    Callable method for scheduler, create and send webex card with ThousandEyes test results
     :param test_target: Target of Test (Endpoint Hostname, Enterprise Agent Name)
-    :param result - ThousandEyes response for creating tests
-    :param sender - roomId from Webex
+    :param result - ThousandEyes response from creating tests
+    :param sender - roomId to send card to in Webex
+    :param api_object - webexteamssdk api instance
+    """
+    # Generate Card Data (ThousandEyes Test Results)
+    try:
+        card = generate_result(result, test_target)
+    except (KeyError, IndexError, TypeError) as e:
+        console.print(f'[red]Unable to parse test results: {str(e)}[/]')
+        card = None
+
+    send_card(card, result, sender, api_object, test_target)
+
+
+def record_key(test_index, agent_index):
+    """
+    Key of one agent's result in the results collected for a request
+    :param test_index: test index in the request
+    :param agent_index: agent index in the test
+    :return: record key
+    """
+    return f'{test_index}:{agent_index}'
+
+
+def request_tests(launches):
+    """
+    Build the tests of a request from its instant test launches (see test_creation.plan_launches)
+    :param launches: launches, launched ones with the ThousandEyes 'result' text
+    :return: list of tests: dictionaries with the ThousandEyes 'result' (None for cached launches), 'agents',
+    'test_key', 'target', 'applications' and 'cached' results
+    """
+    tests = []
+    for launch in launches:
+        result = None
+        if not launch['cached']:
+            try:
+                result = json.loads(launch['result'])
+            except (TypeError, ValueError):
+                # Not a ThousandEyes response (ex: proxy error page), reported like a ThousandEyes error
+                result = {'errorMessage': launch['result']}
+        tests.append({'result': result, 'agents': launch['agents'], 'test_key': launch['test_key'],
+                      'target': launch['target'], 'applications': launch['applications'],
+                      'cached': launch['cached']})
+    return tests
+
+
+def initial_records(tests):
+    """
+    Results known when a request is scheduled (results answered from the result cache)
+    :param tests: tests of the request (see request_tests)
+    :return: dictionary of record key -> {'record', 'age'}
+    """
+    records = {}
+    for i, test in enumerate(tests):
+        for j, (record, age) in enumerate(test['cached'] or []):
+            records[record_key(i, j)] = {'record': record, 'age': age}
+    return records
+
+
+def open_tests(tests, records):
+    """
+    Tests of a request still missing results for some of their agents
+    :param tests: tests of the request
+    :param records: results collected so far
+    :return: list of test indexes
+    """
+    return [i for i, test in enumerate(tests)
+            if any(record_key(i, j) not in records for j in range(len(test['agents'])))]
+
+
+def update_records(tests, records, index, data):
+    """
+    Collect the ready results of one test of a request (parsed, and cached in the result cache)
+    :param tests: tests of the request
+    :param records: results collected so far, updated in place
+    :param index: test index
+    :param data: fetched result data (see fetch_result_data), None if ThousandEyes returned an error for the test
+    """
+    test = tests[index]
+    agents = test['agents']
+    links = result_links(test['result']) if data is not None else None
+    if links is None:
+        for j in range(len(agents)):
+            records[record_key(index, j)] = {'error': True}
+        return
+
+    ready = agents_with_results(test['result'], data, [agent_id for agent_id, _ in agents])
+    for j, (agent_id, test_target) in enumerate(agents):
+        key = record_key(index, j)
+        if key in records or agent_id not in ready:
+            continue
+
+        try:
+            record = parse_result(test['result'], links, data, agent_id=agent_id if len(agents) > 1 else None)
+        except (KeyError, IndexError, TypeError) as e:
+            console.print(f'[red]Unable to parse test results for {test_target}: {str(e)}[/]')
+            records[key] = {'error': True}
+            continue
+
+        if test['test_key'] is not None and agent_id is not None:
+            result_cache.put(result_key(test['test_key'], agent_id), record)
+        records[key] = {'record': record, 'age': None}
+
+
+def collect_results(tests, records, indexes, links_list, fetched):
+    """
+    Collect the ready results of the polled tests of a request (see update_records)
+    :param tests: tests of the request
+    :param records: results collected so far, updated in place
+    :param indexes: polled test indexes
+    :param links_list: result data links of the polled tests, None for tests ThousandEyes returned an error for
+    :param fetched: fetched result data of the tests with links, in the same order
+    """
+    fetched = iter(fetched)
+    for i, links in zip(indexes, links_list):
+        update_records(tests, records, i, next(fetched) if links is not None else None)
+
+
+def poll_request(tests, records, deadline):
+    """
+    Fetch the results of every test of a request that is still missing results (all tests are fetched concurrently)
+    :param tests: tests of the request
+    :param records: results collected so far, updated in place
+    :param deadline: epoch time after which polling stops
+    :return: True if the request is finished (every result is in, or the deadline passed)
+    """
+    indexes = open_tests(tests, records)
+    with tracer.span('delivery.poll', tests=len(indexes)) as span:
+        links_list = [result_links(tests[i]['result']) for i in indexes]
+        fetched = fetch_batch([links for links in links_list if links is not None])
+        collect_results(tests, records, indexes, links_list, fetched)
+        span['attributes']['open'] = len(open_tests(tests, records))
+
+    return not span['attributes']['open'] or time.time() >= deadline
+
+
+def summary_row(target, agent_name, entry):
+    """
+    Summary card row of one agent's result
+    :param target: test target
+    :param agent_name: Endpoint Hostname or Enterprise Agent Name
+    :param entry: collected result ({'record', 'age'}, {'error'}), None if the result never came in
+    :return: list of (text, color) cells: target, agent, response, total time, loss, latency
+    """
+    if entry is None or entry.get('error'):
+        state = 'Timed out' if entry is None else 'Error'
+        return [(target, None), (agent_name, None), (state, 'Attention'), ('-', None), ('-', None), ('-', None)]
+
+    record = entry['record']
+    if entry['age'] is not None:
+        agent_name = f"{agent_name} ({int(entry['age'])}s old)"
+    code = record['code']
+    color = None if code == 'N/A' else 'Good' if code == 200 else 'Attention'
+    return [(target, None), (agent_name, None), (str(code), color), (f"{record['total']} ms", None),
+            (f"{record['loss']} %", None), (f"{record['latency']} ms", None)]
+
+
+def build_summary_cards(tests, records):
+    """
+    Returns the JSON-formatted summary cards of a request, one row per test target and agent (split over several
+    cards past SUMMARY_MAX_ROWS rows)
+    :param tests: tests of the request
+    :param records: results collected for the request
+    :return: list of summary card contents
+    """
+    rows = [summary_row(test['target'] or '', agent_name, records.get(record_key(i, j)))
+            for i, test in enumerate(tests) for j, (_, agent_name) in enumerate(test['agents'])]
+
+    received = sum(1 for entry in records.values() if 'record' in entry)
+    subtitle = f'{received} of {len(rows)} results'
+    if received < len(rows):
+        subtitle += ' (partial results, some tests timed out or failed)'
+
+    chunks = [rows[i:i + config.SUMMARY_MAX_ROWS] for i in range(0, len(rows), config.SUMMARY_MAX_ROWS)]
+    if len(chunks) == 1:
+        return [summary_cards.content(chunks[0], subtitle)]
+    return [summary_cards.content(chunk, f'{subtitle}, part {n} of {len(chunks)}')
+            for n, chunk in enumerate(chunks, start=1)]
+
+
+def send_results(tests, records, sender, api_object, created_at=None):
+    """
+    Send the results of a request: one summary card (RESULT_SUMMARY), or a card per test and agent
+    :param tests: tests of the request
+    :param records: results collected for the request
+    :param sender - roomId to send cards to in Webex
+    :param api_object - webexteamssdk api instance
+    :param created_at: epoch time the request was scheduled (for delivery time metrics)
+    """
+    if created_at is not None:
+        complete = all('record' in records.get(record_key(i, j), {})
+                       for i, test in enumerate(tests) for j in range(len(test['agents'])))
+        outcome = 'complete' if complete else 'partial'
+        DELIVERY_SECONDS.observe(time.time() - created_at, outcome=outcome)
+        tracer.record('delivery', created_at, time.time(), outcome=outcome)
+
+    with tracer.span('webex.send', summary=config.RESULT_SUMMARY):
+        send_cards(tests, records, sender, api_object)
+
+
+def send_cards(tests, records, sender, api_object):
+    """
+    Post the result cards of a request (see send_results)
+    """
+    if config.RESULT_SUMMARY:
+        for content in build_summary_cards(tests, records):
+            api_object.messages.create(roomId=sender,
+                                       text='ThousandEyes Webex Card Results',
+                                       attachments=[summary_cards.attachment(content)])
+
+        # The summary only marks failed tests as errors, the ThousandEyes response (ex: quota or offline agent
+        # details) follows, once per failed test
+        for i, test in enumerate(tests):
+            failed = [test_target for j, (_, test_target) in enumerate(test['agents'])
+                      if records.get(record_key(i, j), {}).get('error')]
+            if failed:
+                api_object.messages.create(roomId=sender,
+                                           markdown=error_message(test['result'], ', '.join(failed)))
+        console.print(f'[green]Webex result summary delivered![/]')
+        return
+
+    for i, test in enumerate(tests):
+        for j, (_, test_target) in enumerate(test['agents']):
+            entry = records.get(record_key(i, j))
+            if entry is None:
+                console.print(f'[red]Test results for {test_target} not ready by deadline, giving up[/]')
+                api_object.messages.create(roomId=sender,
+                                           markdown=timeout_message(test_target))
+            elif entry.get('error'):
+                send_card(None, test['result'], sender, api_object, test_target)
+            else:
+                send_card(build_result_card(entry['record'], test_target, age=entry['age']), test['result'], sender,
+                          api_object, test_target)
+
+
+def add_delivery_job(delivery_id, due_at, job_store, api_object):
+    """
+    Schedule the next poll of a pending delivery
+    :param delivery_id: delivery id in the durable delivery store
+    :param due_at: epoch time of the poll
+    :param job_store - apscheduler scheduler instance, None in multi-worker mode (the scheduler leader polls the
+    delivery once it is due in the delivery store, see sweep_deliveries)
+    :param api_object - webexteamssdk api instance
+    """
+    if job_store is None:
+        return
+    job_store.add_job(run_delivery, trigger='date', run_date=datetime.datetime.fromtimestamp(due_at),
+                      args=[delivery_id, job_store, api_object], id=f'delivery-{delivery_id}', replace_existing=True)
+
+
+def run_delivery(delivery_id, job_store, api_object):
+    """
+    Callable method for scheduler, poll a pending delivery: send the results once every result is in (or the deadline
+    passed), otherwise keep the results collected so far and poll again later (backing off, never past the deadline)
+    :param delivery_id: delivery id in the durable delivery store
     :param job_store - apscheduler scheduler instance
     :param api_object - webexteamssdk api instance
     """
-    now = datetime.datetime.now()
-    if 'endpointTest' in result.keys():
-        interval = int(result['endpointTest'][0]['interval']) + 10
-    else:
-        interval = 70
-    delta = datetime.timedelta(0, interval)
-    when = now + delta
+    delivery = delivery_store.get(delivery_id)
+    if delivery is None:
+        # Already delivered (ex: by the startup catch-up pass)
+        return
+
+    # Polls continue the trace of the request
+    with tracer.activate(delivery.get('trace_id')):
+        try:
+            poll_delivery(delivery, job_store, api_object)
+        except Exception as e:
+            # Multi-worker mode: sweep_deliveries retries failed polls
+            if job_store is None:
+                raise
+            console.print(f'[red]Result delivery {delivery_id} failed: {str(e)}[/]')
+            retry_delivery(delivery, job_store, api_object)
+
+
+def poll_delivery(delivery, job_store, api_object):
+    """
+    Poll a pending delivery (see run_delivery)
+    """
+    delivery_id = delivery['id']
+    tests, records = delivery['tests'], delivery['records']
+    if poll_request(tests, records, delivery['deadline']):
+        send_results(tests, records, delivery['room_id'], api_object, created_at=delivery['created_at'])
+        delivery_store.remove(delivery_id)
+        return
+
+    # Not ready yet, back off before the next poll
+    delay = min(delivery['delay'] * config.RESULT_POLL_BACKOFF, config.RESULT_POLL_MAX_INTERVAL)
+    due_at = min(time.time() + delay, delivery['deadline'])
+    delivery_store.reschedule(delivery_id, due_at, delay, records=records)
+    add_delivery_job(delivery_id, due_at, job_store, api_object)
+
+
+def retry_delivery(delivery, job_store, api_object):
+    """
+    Poll a delivery whose last poll failed again later, so a failing poll doesn't leave it pending until the next
+    restart. Past its deadline, the results collected so far are sent instead
+    :param delivery: delivery dictionary (see delivery_store.get)
+    :param job_store - apscheduler scheduler instance, None in multi-worker mode
+    :param api_object - webexteamssdk api instance
+    """
+    delivery_id = delivery['id']
+    if time.time() >= delivery['deadline']:
+        try:
+            send_results(delivery['tests'], delivery['records'], delivery['room_id'], api_object,
+                         created_at=delivery['created_at'])
+        finally:
+            delivery_store.remove(delivery_id)
+        return
+
+    # Don't poll a failing delivery right away again
+    due_at = time.time() + config.RESULT_POLL_MAX_INTERVAL
+    delivery_store.reschedule(delivery_id, due_at, delivery['delay'])
+    add_delivery_job(delivery_id, due_at, job_store, api_object)
+
+
+def schedule_request(launches, sender, job_store, api_object, trace_id=None):
+    """
+    Scheduled job to send the results of a request (every test, on every agent) as soon as they are ready, results
+    answered from the result cache are part of it. A request fully answered from the cache is sent right away
+    :param launches: instant test launches of the request (see test_creation.test_selector)
+    :param sender - roomId from Webex
+    :param job_store - apscheduler scheduler instance, None to only persist the delivery (see add_delivery_job)
+    :param api_object - webexteamssdk api instance
+    :param trace_id: trace of the request (see tracing), continued by the scheduled polls
+    """
+    tests = request_tests(launches)
+    records = initial_records(tests)
+    if not open_tests(tests, records):
+        DELIVERY_SECONDS.observe(0, outcome='cached')
+        send_results(tests, records, sender, api_object)
+        return
 
-    console.print(f'Scheduling Webex Result Delivery at {when}...')
-    job_store.add_job(send_result, trigger='date', run_date=when, args=[result, sender, api_object, test_target])
+    now = time.time()
+    delay = config.RESULT_POLL_INITIAL_DELAY
+    due_at = now + delay
+    deadline = now + config.RESULT_DEADLINE
+
+    # Persist the delivery first, so it survives a restart
+    delivery_id = delivery_store.add(tests, sender, due_at, deadline, delay, records=records, trace_id=trace_id)
+
+    console.print(f'Polling for Webex Result Delivery from {datetime.datetime.fromtimestamp(due_at)}...')
+    add_delivery_job(delivery_id, due_at, job_store, api_object)
+
+
+def resume_deliveries(job_store, api_object, started_at):
+    """
+    Startup catch-up pass: drain deliveries left by a previous run that became due while the bot was down (in
+    parallel, bounded), and reschedule the rest
+    :param job_store - apscheduler scheduler instance
+    :param api_object - webexteamssdk api instance
+    :param started_at: epoch time this run started (deliveries created since then are already scheduled)
+    """
+    now = time.time()
+    pending = delivery_store.pending(created_before=started_at)
+    overdue = [delivery for delivery in pending if delivery['due_at'] <= now][:config.CATCH_UP_LIMIT]
+    overdue_ids = {delivery['id'] for delivery in overdue}
+
+    # Future deliveries (and overdue ones beyond the catch-up limit) go back on the scheduler
+    for delivery in pending:
+        if delivery['id'] not in overdue_ids:
+            add_delivery_job(delivery['id'], max(delivery['due_at'], now), job_store, api_object)
+
+    if overdue:
+        console.print(f'Catching up on {len(overdue)} overdue Webex Result Deliveries...')
+        with concurrent.futures.ThreadPoolExecutor(max_workers=config.CATCH_UP_WORKERS) as executor:
+            futures = [executor.submit(run_delivery, delivery['id'], job_store, api_object) for delivery in overdue]
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f'There was an exception: {str(e)}')
+
+
+def sweep_deliveries(api_object):
+    """
+    Multi-worker mode, run periodically by the scheduler leader only: poll every delivery that is due, whichever
+    worker process persisted it (in parallel, bounded). Polls that aren't done move the delivery's due time in the
+    store, a later sweep picks it up again
+    :param api_object - webexteamssdk api instance
+    """
+    due = delivery_store.due(time.time(), limit=config.CATCH_UP_LIMIT)
+    if not due:
+        return
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=config.CATCH_UP_WORKERS) as executor:
+        futures = {executor.submit(run_delivery, delivery['id'], None, api_object): delivery for delivery in due}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                print(f'There was an exception: {str(e)}')
+                try:
+                    retry_delivery(futures[future], None, api_object)
+                except Exception as e:
+                    print(f'There was an exception: {str(e)}')
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+__author__ = "Trevor Maco <tmaco@cisco.com>, Josh Ingeniero <jingenie@cisco.com>"
+__copyright__ = "Copyright (c) 2023 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+import contextlib
+import json
+import sqlite3
+import threading
+import time
+
+
+class JobQueue:
+    """
+    Durable SQLite (WAL) job queue between processes: the web process enqueues, worker processes claim jobs, and
+    acknowledge them once done. A claimed job is leased for the visibility timeout, if its worker exits before
+    acknowledging it, another worker claims it again. Failed jobs are retried with backoff, then kept as failed
+    """
+
+    def __init__(self, path, max_depth, visibility_timeout=300, max_attempts=3, retry_delay=5, failed_retention=604800):
+        """
+        :param path: SQLite database file (shared by the web and worker processes)
+        :param max_depth: maximum number of jobs waiting or running, further jobs are refused
+        :param visibility_timeout: seconds a claimed job is leased to its worker
+        :param max_attempts: attempts before a job is kept as failed
+        :param retry_delay: seconds before the first retry, doubled on each retry
+        :param failed_retention: seconds failed jobs are kept (for operators), older ones are purged
+        """
+        self.path = path
+        self.max_depth = max_depth
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.failed_retention = failed_retention
+        self._lock = threading.Lock()
+
+        # Counters (this process), abandoned: jobs kept as failed
+        self.enqueued = 0
+        self.rejected = 0
+        self.acked = 0
+        self.retried = 0
+        self.abandoned = 0
+
+        with contextlib.closing(sqlite3.connect(self.path, timeout=30)) as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+        with self._connect() as conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS jobs (
+                                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                payload TEXT NOT NULL,
+                                enqueued_at REAL NOT NULL,
+                                available_at REAL NOT NULL,
+                                attempts INTEGER NOT NULL DEFAULT 0,
+                                worker TEXT,
+                                error TEXT,
+                                failed_at REAL)''')
+            conn.execute('CREATE INDEX IF NOT EXISTS jobs_available_at ON jobs (failed_at, available_at)')
+            self._purge_failed(conn)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        """
+        New connection per call, in a write transaction taken up front (BEGIN IMMEDIATE): two processes can't claim
+        the same job. Committed (rolled back on error) and closed on exit
+        """
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+
+    @contextlib.contextmanager
+    def _read(self):
+        """
+        New read-only connection per call (no write lock, readers don't hold up workers claiming jobs), closed on exit
+        """
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def _purge_failed(self, conn):
+        """
+        Delete the failed jobs older than the retention (in the caller's transaction)
+        """
+        conn.execute('DELETE FROM jobs WHERE failed_at IS NOT NULL AND failed_at <= ?',
+                     (time.time() - self.failed_retention,))
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def put(self, payload):
+        """
+        Enqueue a job
+        :param payload: JSON serializable job payload
+        :return: job id, None if the queue is full
+        """
+        now = time.time()
+        with self._connect() as conn:
+            backlog = conn.execute('SELECT COUNT(*) FROM jobs WHERE failed_at IS NULL').fetchone()[0]
+            if backlog >= self.max_depth:
+                job_id = None
+            else:
+                job_id = conn.execute('INSERT INTO jobs (payload, enqueued_at, available_at) VALUES (?, ?, ?)',
+                                      (json.dumps(payload), now, now)).lastrowid
+
+        self._count('rejected' if job_id is None else 'enqueued')
+        return job_id
+
+    def claim(self, worker):
+        """
+        Lease the oldest available job (new, retried, or whose worker didn't acknowledge it in time)
+        :param worker: worker name, recorded on the job
+        :return: job dictionary (id, payload, enqueued_at, attempts, counting this one) or None if there is none.
+        A job past max_attempts was left by workers that exited while running it, see fail
+        """
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute('SELECT id, payload, enqueued_at, attempts FROM jobs WHERE failed_at IS NULL AND '
+                               'available_at <= ? ORDER BY available_at, id LIMIT 1', (now,)).fetchone()
+            if row is None:
+                return None
+            conn.execute('UPDATE jobs SET attempts = attempts + 1, available_at = ?, worker = ? WHERE id = ?',
+                         (now + self.visibility_timeout, worker, row[0]))
+
+        return {'id': row[0], 'payload': json.loads(row[1]), 'enqueued_at': row[2], 'attempts': row[3] + 1}
+
+    def ack(self, job_id):
+        """
+        Acknowledge a job that is done (it is deleted)
+        :param job_id: job id
+        """
+        with self._connect() as conn:
+            conn.execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+        self._count('acked')
+
+    def retry(self, job_id, error):
+        """
+        Give a job that raised back to the queue, after a backoff, unless it used its last attempt
+        :param job_id: job id
+        :param error: error message, kept on the job
+        :return: True if the job will be retried, False if it is now failed
+        """
+        with self._connect() as conn:
+            row = conn.execute('SELECT attempts FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            if row is None:
+                return False
+            if row[0] >= self.max_attempts:
+                conn.execute('UPDATE jobs SET failed_at = ?, error = ?, worker = NULL WHERE id = ?',
+                             (time.time(), error, job_id))
+                self._purge_failed(conn)
+                retried = False
+            else:
+                available_at = time.time() + self.retry_delay * 2 ** (row[0] - 1)
+                conn.execute('UPDATE jobs SET available_at = ?, error = ?, worker = NULL WHERE id = ?',
+                             (available_at, error, job_id))
+                retried = True
+
+        self._count('retried' if retried else 'abandoned')
+        return retried
+
+    def fail(self, job_id, error):
+        """
+        Keep a job as failed, without retrying it
+        :param job_id: job id
+        :param error: error message, kept on the job
+        """
+        with self._connect() as conn:
+            conn.execute('UPDATE jobs SET failed_at = ?, error = ?, worker = NULL WHERE id = ?',
+                         (time.time(), error, job_id))
+            self._purge_failed(conn)
+        self._count('abandoned')
+
+    def update(self, job_id, payload):
+        """
+        Replace the payload of a claimed job, ex: to record the progress of its steps, so a retry doesn't repeat them
+        :param job_id: job id
+        :param payload: JSON serializable job payload
+        """
+        with self._connect() as conn:
+            conn.execute('UPDATE jobs SET payload = ? WHERE id = ?', (json.dumps(payload), job_id))
+
+    def depth(self):
+        """
+        Jobs in the queue (every process)
+        :return: dictionary of queued (waiting, including retries and jobs whose lease expired), running (leased to a
+        worker), failed jobs, and the age in seconds of the oldest queued job (None if there is none)
+        """
+        now = time.time()
+        with self._read() as conn:
+            queued, running, failed, oldest = conn.execute(
+                'SELECT COALESCE(SUM(failed_at IS NULL AND (worker IS NULL OR available_at <= :now)), 0), '
+                'COALESCE(SUM(failed_at IS NULL AND worker IS NOT NULL AND available_at > :now), 0), '
+                'COALESCE(SUM(failed_at IS NOT NULL), 0), '
+                'MIN(CASE WHEN failed_at IS NULL AND (worker IS NULL OR available_at <= :now) THEN enqueued_at END) '
+                'FROM jobs', {'now': now}).fetchone()
+        return {'queued': queued, 'running': running, 'failed': failed,
+                'oldest': now - oldest if oldest is not None else None}
+
+    def counters(self):
+        """
+        Counters of this process
+        :return: dictionary of enqueued, rejected, acked, retried and abandoned jobs
+        """
+        with self._lock:
+            return {'enqueued': self.enqueued, 'rejected': self.rejected, 'acked': self.acked, 'retried': self.retried,
+                    'abandoned': self.abandoned}
+
+    def stats(self):
+        """
+        Snapshot of queue depth and counters (counters are this process's)
+        :return: dictionary of queue statistics
+        """
+        stats = self.depth()
+        stats.update(self.counters(), max_depth=self.max_depth)
+        return stats
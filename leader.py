@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+__author__ = "Trevor Maco <tmaco@cisco.com>, Josh Ingeniero <jingenie@cisco.com>"
+__copyright__ = "Copyright (c) 2023 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+import fcntl
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class LeaderLock:
+    """
+    Leader election between the worker processes of one host, on an exclusive lock file: the process holding the lock
+    is the leader until it exits (the operating system releases the lock even if it crashes), the others keep trying
+    and one of them takes over
+    """
+
+    def __init__(self, path, retry_interval=5):
+        """
+        :param path: lock file (every worker process uses the same file)
+        :param retry_interval: seconds between attempts of the processes that aren't the leader
+        """
+        self.path = path
+        self.retry_interval = retry_interval
+
+        self._file = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self.elected_at = None
+
+    @property
+    def is_leader(self):
+        return self._file is not None
+
+    def acquire(self):
+        """
+        Try to become the leader, without waiting
+        :return: True if this process is the leader
+        """
+        with self._lock:
+            if self._file is not None:
+                return True
+
+            lock_file = open(self.path, 'a+')
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                return False
+
+            # The pid of the leader, for operators (the lock itself is what counts)
+            lock_file.truncate(0)
+            lock_file.write(f'{os.getpid()}\n')
+            lock_file.flush()
+            self._file = lock_file
+            self.elected_at = time.time()
+            return True
+
+    def start(self, on_elected):
+        """
+        Become the leader now if possible, otherwise keep trying in the background
+        :param on_elected: callable run once, in the process that becomes the leader
+        :return: True if this process is the leader already
+        """
+        if self.acquire():
+            on_elected()
+            return True
+
+        threading.Thread(target=self._campaign, args=(on_elected,), name='leader-election', daemon=True).start()
+        return False
+
+    def _campaign(self, on_elected):
+        while not self._stopped.wait(self.retry_interval):
+            if self.acquire():
+                logger.warning(f'Process {os.getpid()} took over as leader ({self.path})')
+                on_elected()
+                return
+
+    def release(self):
+        """
+        Stop campaigning and give up the leadership (another process takes over)
+        """
+        self._stopped.set()
+        with self._lock:
+            if self._file is not None:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+                self._file.close()
+                self._file = None
+
+    def stats(self):
+        """
+        Snapshot of election state
+        :return: dictionary of leader statistics
+        """
+        return {'leader': self.is_leader, 'elected_at': self.elected_at}
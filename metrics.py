@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+__author__ = "Trevor Maco <tmaco@cisco.com>, Josh Ingeniero <jingenie@cisco.com>"
+__copyright__ = "Copyright (c) 2023 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+import bisect
+import contextlib
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Default latency buckets (seconds), from fast cache hits to slow ThousandEyes calls
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Result delivery buckets (seconds), instant tests take minutes
+DELIVERY_BUCKETS = (1, 5, 10, 30, 60, 90, 120, 180, 240, 300, 600)
+
+
+def format_labels(names, values):
+    """
+    Render a label set in Prometheus text format
+    :param names: label names
+    :param values: label values
+    :return: {name="value",...} or an empty string
+    """
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+class Counter:
+    """
+    Monotonic counter, optionally split by labels
+    """
+
+    type = 'counter'
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        """
+        Add to the counter
+        :param amount: increment
+        :param labels: label values
+        """
+        key = tuple(labels.get(name, '') for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        """
+        :return: list of (sample name, labels, value)
+        """
+        with self._lock:
+            return [(self.name, format_labels(self.labels, key), value) for key, value in self._values.items()]
+
+
+class Histogram:
+    """
+    Cumulative histogram (Prometheus buckets, sum and count), optionally split by labels
+    """
+
+    type = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # label values -> [per-bucket counts (last one is +Inf), sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        """
+        Record an observation
+        :param value: observed value (seconds for latencies)
+        :param labels: label values
+        """
+        key = tuple(labels.get(name, '') for name in self.labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        """
+        Observe the duration of a block
+        :param labels: label values
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        """
+        :return: list of (sample name, labels, value), cumulative buckets then sum and count
+        """
+        samples = []
+        names = self.labels + ('le',)
+        with self._lock:
+            for key, (counts, total) in self._values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets + ('+Inf',), counts):
+                    cumulative += count
+                    samples.append((f'{self.name}_bucket', format_labels(names, key + (bound,)), cumulative))
+                samples.append((f'{self.name}_sum', format_labels(self.labels, key), total))
+                samples.append((f'{self.name}_count', format_labels(self.labels, key), cumulative))
+        return samples
+
+
+class Collected:
+    """
+    Metric read at scrape time from existing statistics (ex: a component's stats() snapshot)
+    """
+
+    def __init__(self, name, description, kind, collect, labels=()):
+        """
+        :param kind: metric type ('gauge' or 'counter')
+        :param collect: callable returning a number, or a dictionary of label value(s) -> number (labels given)
+        """
+        self.name = name
+        self.description = description
+        self.type = kind
+        self.labels = tuple(labels)
+        self.collect = collect
+
+    def samples(self):
+        """
+        :return: list of (sample name, labels, value)
+        """
+        value = self.collect()
+        if not self.labels:
+            return [(self.name, '', value)] if value is not None else []
+        return [(self.name, format_labels(self.labels, key if isinstance(key, tuple) else (key,)), number)
+                for key, number in value.items()]
+
+
+class Registry:
+    """
+    Process-wide metric registry, rendered in the Prometheus text exposition format
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        """
+        Add a metric (metrics are keyed by name)
+        """
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None and not isinstance(metric, Collected):
+                # Modules imported twice (ex: benchmarks) get the metric that is already registered
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, description, labels=()):
+        """
+        Register a counter
+        """
+        return self._register(Counter(name, description, labels))
+
+    def histogram(self, name, description, labels=(), buckets=LATENCY_BUCKETS):
+        """
+        Register a histogram
+        """
+        return self._register(Histogram(name, description, labels, buckets))
+
+    def gauge_from(self, name, description, collect, labels=()):
+        """
+        Register a gauge read at scrape time
+        """
+        return self._register(Collected(name, description, 'gauge', collect, labels))
+
+    def counter_from(self, name, description, collect, labels=()):
+        """
+        Register a counter read at scrape time (from a component's own counters)
+        """
+        return self._register(Collected(name, description, 'counter', collect, labels))
+
+    def render(self):
+        """
+        Render every metric
+        :return: Prometheus text exposition format
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+
+        lines = []
+        for metric in metrics:
+            try:
+                samples = metric.samples()
+            except Exception as e:
+                # A broken collector must not take the whole endpoint down
+                logger.error(f'Metric {metric.name} collection failed: {str(e)}')
+                continue
+
+            lines.append(f'# HELP {metric.name} {metric.description}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for name, labels, value in samples:
+                lines.append(f'{name}{labels} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+# Process-wide registry (see app /metrics)
+registry = Registry()
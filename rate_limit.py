@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+__author__ = "Trevor Maco <tmaco@cisco.com>, Josh Ingeniero <jingenie@cisco.com>"
+__copyright__ = "Copyright (c) 2023 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+import asyncio
+import collections
+import contextlib
+import email.utils
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def retry_after_seconds(value, default):
+    """
+    Parse a Retry-After header (seconds or HTTP date)
+    :param value: header value (or None)
+    :param default: seconds to use if the header is missing or invalid
+    :return: seconds to wait
+    """
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return default
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: `rate` tokens per second, up to `burst` tokens saved up
+    """
+
+    def __init__(self, rate, burst):
+        """
+        :param rate: tokens per second
+        :param burst: bucket size
+        """
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self):
+        """
+        Take a token if one is available
+        :return: 0 if a token was taken, otherwise seconds until one should be available
+        """
+        with self._lock:
+            now = time.monotonic()
+            if now < self._paused_until:
+                return self._paused_until - now
+            self._refill(now)
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        """
+        Take a token, waiting as long as needed
+        """
+        while True:
+            wait = self.try_acquire()
+            if wait == 0:
+                return
+            time.sleep(wait)
+
+    def set_rate(self, rate):
+        """
+        Change the refill rate (ex: from the server's advertised rate limit)
+        :param rate: tokens per second
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = rate
+
+    def pause(self, seconds):
+        """
+        Hand out no tokens for a while (ex: after a 429 with Retry-After), and drain saved up tokens
+        :param seconds: pause duration
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._paused_until = max(self._paused_until, now + seconds)
+            self._tokens = 0
+            self._updated = max(now, self._paused_until)
+
+
+class SharedTokenBucket(TokenBucket):
+    """
+    Token bucket kept in a SQLite file, shared by the worker processes of a multi-worker deployment so they spend one
+    organization budget together (a pause after a 429 pauses every process). The bucket fails open: on a database
+    error, this process falls back to its own bucket
+    """
+
+    def __init__(self, path, name, rate, burst):
+        """
+        :param path: SQLite database file
+        :param name: bucket name (one row per limited API)
+        :param rate: tokens per second
+        :param burst: bucket size
+        """
+        super().__init__(rate, burst)
+        self.path = path
+        self.name = name
+        self.shared_errors = 0
+
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+        finally:
+            conn.close()
+
+        with self._transaction() as conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS token_buckets (
+                                name TEXT PRIMARY KEY,
+                                tokens REAL NOT NULL,
+                                updated REAL NOT NULL,
+                                paused_until REAL NOT NULL)''')
+            conn.execute('INSERT OR IGNORE INTO token_buckets (name, tokens, updated, paused_until) VALUES (?, ?, ?, 0)',
+                         (name, burst, time.time()))
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """
+        New connection per call (the bucket is used from several threads), in a write transaction taken up front so
+        concurrent processes read and update the bucket one at a time
+        """
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+
+    def _error(self, e):
+        logger.error(f'Shared token bucket {self.name} unavailable: {str(e)}')
+        with self._lock:
+            self.shared_errors += 1
+
+    def try_acquire(self):
+        """
+        Take a token from the shared bucket if one is available
+        :return: 0 if a token was taken, otherwise seconds until one should be available
+        """
+        try:
+            with self._transaction() as conn:
+                tokens, updated, paused_until = conn.execute(
+                    'SELECT tokens, updated, paused_until FROM token_buckets WHERE name = ?', (self.name,)).fetchone()
+                now = time.time()
+                if now < paused_until:
+                    return paused_until - now
+                tokens = min(self.burst, tokens + max(0.0, now - updated) * self.rate)
+                wait = 0 if tokens >= 1 else (1 - tokens) / self.rate
+                conn.execute('UPDATE token_buckets SET tokens = ?, updated = ? WHERE name = ?',
+                             (tokens - 1 if wait == 0 else tokens, max(now, updated), self.name))
+                return wait
+        except (sqlite3.Error, TypeError) as e:
+            self._error(e)
+            return super().try_acquire()
+
+    def pause(self, seconds):
+        """
+        Hand out no tokens to any process for a while (ex: after a 429 with Retry-After), and drain saved up tokens
+        :param seconds: pause duration
+        """
+        super().pause(seconds)
+        try:
+            with self._transaction() as conn:
+                now = time.time()
+                conn.execute('UPDATE token_buckets SET tokens = 0, paused_until = MAX(paused_until, ?), '
+                             'updated = MAX(?, paused_until, ?) WHERE name = ?',
+                             (now + seconds, now, now + seconds, self.name))
+        except sqlite3.Error as e:
+            self._error(e)
+
+
+class RateLimiter:
+    """
+    Process-wide limiter for an API with an organization rate limit: a token bucket for request rate, plus an AIMD
+    adaptive concurrency limit (grows by one slot per window of fast successful calls, halves on 429 or slow calls)
+    """
+
+    def __init__(self, rate, burst, min_concurrency, max_concurrency, latency_target, path=None):
+        """
+        :param rate: requests per second
+        :param burst: requests that can be sent back to back
+        :param min_concurrency: lowest concurrency limit
+        :param max_concurrency: highest concurrency limit
+        :param latency_target: calls slower than this (seconds) count as congestion
+        :param path: optional SQLite file shared by worker processes, they share the rate budget (the concurrency
+        limit stays per process)
+        """
+        self.bucket = SharedTokenBucket(path, 'rate_limit', rate, burst) if path else TokenBucket(rate, burst)
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.latency_target = latency_target
+
+        self.limit = float(min_concurrency)
+        self.in_flight = 0
+        self.waiting = 0
+        self._cond = threading.Condition()
+        # Coroutines waiting for a slot, (event loop, future) in arrival order
+        self._async_waiters = collections.deque()
+
+        # Counters
+        self.throttled = 0
+        self.calls = 0
+
+    def acquire(self):
+        """
+        Wait for a concurrency slot and a rate token (blocking)
+        """
+        with self._cond:
+            self.waiting += 1
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+            self.waiting -= 1
+        self.bucket.acquire()
+
+    async def acquire_async(self):
+        """
+        Wait for a concurrency slot and a rate token (without blocking the event loop, waiters are woken by release)
+        """
+        loop = asyncio.get_running_loop()
+        with self._cond:
+            self.waiting += 1
+        try:
+            while True:
+                with self._cond:
+                    if self.in_flight < int(self.limit):
+                        self.in_flight += 1
+                        break
+                    waiter = loop.create_future()
+                    self._async_waiters.append((loop, waiter))
+                try:
+                    await waiter
+                except asyncio.CancelledError:
+                    with self._cond:
+                        if waiter.done() and not waiter.cancelled():
+                            # Woken for a free slot, hand it to the next waiter
+                            self._wake_async()
+                        elif (loop, waiter) in self._async_waiters:
+                            self._async_waiters.remove((loop, waiter))
+                    raise
+        finally:
+            with self._cond:
+                self.waiting -= 1
+
+        try:
+            while True:
+                wait = self.bucket.try_acquire()
+                if wait == 0:
+                    return
+                await asyncio.sleep(wait)
+        except asyncio.CancelledError:
+            # Cancelled while waiting for a token (ex: a fetch deadline), the slot was never used
+            self._give_back()
+            raise
+
+    def _give_back(self):
+        """
+        Return a concurrency slot that wasn't used for a call (no adaptation)
+        """
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+            self._wake_async()
+
+    def release(self, latency, status, headers=None):
+        """
+        Give back a concurrency slot and adapt to the call's outcome
+        :param latency: call duration (seconds)
+        :param status: HTTP status code (None if the call failed)
+        :param headers: response headers (Retry-After, X-Organization-Rate-Limit-*)
+        :return: seconds to wait before retrying if the call was throttled (429), otherwise None
+        """
+        headers = headers or {}
+        retry_after = None
+
+        with self._cond:
+            self.in_flight -= 1
+            self.calls += 1
+
+            if status == 429:
+                # Multiplicative decrease, and stop sending until the server says so
+                self.throttled += 1
+                self.limit = max(self.min_concurrency, self.limit / 2)
+                retry_after = retry_after_seconds(headers.get('Retry-After'), default=1.0)
+            elif status is not None and latency > self.latency_target:
+                self.limit = max(self.min_concurrency, self.limit / 2)
+            elif status is not None and status < 500:
+                # Additive increase: one slot per `limit` fast calls
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+
+            self._cond.notify_all()
+            self._wake_async()
+
+        if retry_after is not None:
+            self.bucket.pause(retry_after)
+
+        self._apply_rate_headers(headers)
+        return retry_after
+
+    def _wake_async(self):
+        """
+        Wake as many waiting coroutines as there are free slots (lock held), they take the slots themselves
+        """
+        free = int(self.limit) - self.in_flight
+        while free > 0 and self._async_waiters:
+            loop, waiter = self._async_waiters.popleft()
+            loop.call_soon_threadsafe(self._resolve, waiter)
+            free -= 1
+
+    def _resolve(self, waiter):
+        """
+        Wake one waiting coroutine (on its event loop), or the next one if it was cancelled meanwhile
+        """
+        if waiter.cancelled():
+            with self._cond:
+                self._wake_async()
+        elif not waiter.done():
+            waiter.set_result(None)
+
+    def _apply_rate_headers(self, headers):
+        """
+        Follow the organization rate limit advertised by ThousandEyes
+        (X-Organization-Rate-Limit-Limit per minute, -Remaining, -Reset epoch seconds)
+        """
+        try:
+            limit = headers.get('X-Organization-Rate-Limit-Limit')
+            if limit:
+                rate = int(limit) / 60
+                if rate > 0 and abs(rate - self.bucket.rate) > 1e-9:
+                    self.bucket.set_rate(rate)
+
+            remaining = headers.get('X-Organization-Rate-Limit-Remaining')
+            reset = headers.get('X-Organization-Rate-Limit-Reset')
+            if remaining is not None and int(remaining) <= 0 and reset:
+                self.bucket.pause(max(0.0, int(reset) - time.time()))
+        except (TypeError, ValueError):
+            pass
+
+    def stats(self):
+        """
+        Snapshot of limiter state and counters
+        :return: dictionary of limiter statistics
+        """
+        with self._cond:
+            return {'waiting': self.waiting, 'in_flight': self.in_flight, 'concurrency_limit': int(self.limit),
+                    'rate': self.bucket.rate, 'calls': self.calls, 'throttled': self.throttled}
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+__author__ = "Trevor Maco <tmaco@cisco.com>, Josh Ingeniero <jingenie@cisco.com>"
+__copyright__ = "Copyright (c) 2023 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+import collections
+import threading
+import time
+
+
+def result_key(test_key, agent_id):
+    """
+    Result cache key of one agent's result for a test
+    :param test_key: (test type, test kind, target)
+    :param agent_id: Endpoint or Enterprise Agent ID
+    :return: (test type, agent id, test kind, target)
+    """
+    test_type, kind, target = test_key
+    return test_type, agent_id, kind, target
+
+
+class ResultCache:
+    """
+    Bounded LRU cache of recently completed test results (parsed result records), served while they are fresher
+    than the freshness window. With a shared cache, results collected by another worker process are served too
+    """
+
+    def __init__(self, max_size, freshness, shared=None):
+        """
+        :param max_size: maximum number of cached results
+        :param freshness: seconds a result can be served after it was collected (0 disables the cache)
+        :param shared: optional shared_store.SharedCache (multi-worker deployments)
+        """
+        self.max_size = max_size
+        self.freshness = freshness
+        self.shared = shared
+
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.shared_hits = 0
+
+    def get(self, key):
+        """
+        Look up a fresh result
+        :param key: (test type, agent id, test kind, target)
+        :return: (record, age in seconds) or None if there is no fresh result
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                age = time.time() - entry[1]
+                if age <= self.freshness:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[0], age
+                del self._entries[key]
+
+        # Collected by another worker process, (record, collected at) like the local entries
+        entry = self.shared.get(key) if self.shared is not None else None
+        with self._lock:
+            if entry is not None:
+                age = time.time() - entry[1]
+                if age <= self.freshness:
+                    self._entries[key] = entry
+                    self._entries.move_to_end(key)
+                    self._evict()
+                    self.hits += 1
+                    self.shared_hits += 1
+                    return entry[0], age
+            self.misses += 1
+            return None
+
+    def put(self, key, record):
+        """
+        Cache a completed result
+        :param key: (test type, agent id, test kind, target)
+        :param record: parsed result record
+        """
+        if self.freshness <= 0:
+            return
+
+        with self._lock:
+            self._entries[key] = (record, time.time())
+            self._entries.move_to_end(key)
+            self._evict()
+
+        if self.shared is not None:
+            self.shared.put(key, record, self.freshness)
+
+    def _evict(self):
+        """
+        Drop the least recently used results beyond the maximum size (lock held)
+        """
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        """
+        Snapshot of cache state and counters
+        :return: dictionary of cache statistics
+        """
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses,
+                    'shared_hits': self.shared_hits}
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+__author__ = "Trevor Maco <tmaco@cisco.com>, Josh Ingeniero <jingenie@cisco.com>"
+__copyright__ = "Copyright (c) 2023 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+import contextlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Expired entries are purged every PURGE_EVERY writes
+PURGE_EVERY = 100
+
+# SQLite limits the number of query parameters, bulk reads are split in chunks
+CHUNK_SIZE = 500
+
+
+class SharedCache:
+    """
+    Time-expiring key/value table in a SQLite file, shared by the worker processes of a multi-worker deployment (the
+    in-process caches fall back to it before calling ThousandEyes). Keys and values are stored as JSON; the cache
+    fails open, a database error is a cache miss
+    """
+
+    def __init__(self, path, table):
+        """
+        :param path: SQLite database file
+        :param table: table name (one table per cache)
+        """
+        self.path = path
+        self.table = table
+        self._lock = threading.Lock()
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.errors = 0
+
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(f'''CREATE TABLE IF NOT EXISTS {table} (
+                                 key TEXT PRIMARY KEY,
+                                 value TEXT,
+                                 stored_at REAL NOT NULL,
+                                 expires_at REAL NOT NULL)''')
+            conn.execute(f'CREATE INDEX IF NOT EXISTS {table}_expires_at ON {table} (expires_at)')
+
+    @contextlib.contextmanager
+    def _connect(self):
+        """
+        New connection per call (caches are used from several threads), committed and closed on exit
+        """
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _count(self, **counters):
+        with self._lock:
+            for name, value in counters.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def _error(self, e):
+        logger.error(f'Shared cache {self.table} unavailable: {str(e)}')
+        self._count(errors=1)
+
+    def get(self, key):
+        """
+        Look up an entry that hasn't expired
+        :param key: JSON serializable key
+        :return: (value, epoch time it was stored) or None
+        """
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys):
+        """
+        Look up several entries in one transaction
+        :param keys: JSON serializable keys (hashable)
+        :return: dictionary of key -> (value, epoch time it was stored), for the keys found
+        """
+        encoded = {json.dumps(key): key for key in keys}
+        names = list(encoded)
+        found = {}
+        now = time.time()
+        try:
+            with self._connect() as conn:
+                for i in range(0, len(names), CHUNK_SIZE):
+                    chunk = names[i:i + CHUNK_SIZE]
+                    rows = conn.execute(f'SELECT key, value, stored_at FROM {self.table} WHERE expires_at > ? AND '
+                                        f'key IN ({", ".join("?" * len(chunk))})', (now, *chunk)).fetchall()
+                    for name, value, stored_at in rows:
+                        found[encoded[name]] = (json.loads(value), stored_at)
+        except sqlite3.Error as e:
+            self._error(e)
+            found = {}
+
+        self._count(hits=len(found), misses=len(encoded) - len(found))
+        return found
+
+    def put(self, key, value, ttl):
+        """
+        Store an entry
+        :param key: JSON serializable key
+        :param value: JSON serializable value
+        :param ttl: seconds the entry is kept
+        """
+        self.put_many({key: value}, ttl)
+
+    def put_many(self, entries, ttl):
+        """
+        Store several entries in one transaction
+        :param entries: dictionary of key -> value (JSON serializable)
+        :param ttl: seconds the entries are kept
+        """
+        if not entries:
+            return
+
+        now = time.time()
+        rows = [(json.dumps(key), json.dumps(value), now, now + ttl) for key, value in entries.items()]
+        with self._lock:
+            purge = self.writes // PURGE_EVERY != (self.writes + len(rows)) // PURGE_EVERY
+            self.writes += len(rows)
+        try:
+            with self._connect() as conn:
+                conn.executemany(f'INSERT OR REPLACE INTO {self.table} (key, value, stored_at, expires_at) '
+                                 f'VALUES (?, ?, ?, ?)', rows)
+                if purge:
+                    conn.execute(f'DELETE FROM {self.table} WHERE expires_at <= ?', (now,))
+        except sqlite3.Error as e:
+            self._error(e)
+
+    def delete(self, key=None):
+        """
+        Drop an entry, or every entry if no key is given
+        :param key: JSON serializable key
+        """
+        try:
+            with self._connect() as conn:
+                if key is None:
+                    conn.execute(f'DELETE FROM {self.table}')
+                else:
+                    conn.execute(f'DELETE FROM {self.table} WHERE key = ?', (json.dumps(key),))
+        except sqlite3.Error as e:
+            self._error(e)
+
+    def stats(self):
+        """
+        Snapshot of cache counters
+        :return: dictionary of cache statistics
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'writes': self.writes, 'errors': self.errors}
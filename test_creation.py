@@ -18,16 +18,23 @@ __copyright__ = "Copyright (c) 2023 Cisco and/or its affiliates."
 __license__ = "Cisco Sample Code License, Version 1.1"
 
 import concurrent.futures
+import contextvars
 import json
-import os
+import urllib.parse
 
-import requests
-from dotenv import load_dotenv
+from rich.console import Console
 
-# Load env variables
-load_dotenv()
-THOUSAND_EYES_TOKEN = os.getenv("THOUSAND_EYES_TOKEN")
+import config
+from agent_directory import EndpointAgentCache, EnterpriseAgentDirectory
+from coalesce import SingleFlight
+from metrics import registry
+from result_cache import result_key
+from shared_store import SharedCache
+from tracing import tracer
+from transport import thousandeyes
 
+# Rich Console Instance
+console = Console()
 
 """"     Test URLs       """
 
@@ -40,34 +47,203 @@ WebExSecondaryVideoURL = "gmjp2mcs192.webex.com"
 SalesforceURL = "https://ciscosales.my.salesforce.com/"
 O365URL = "https://login.microsoftonline.com"
 
-# Define Global ThousandEyes Header
-headers = {
-    'Content-Type': 'application/json',
-    'Accept': 'application/json',
-    'Authorization': f"Bearer {THOUSAND_EYES_TOKEN}"
+# Define Global ThousandEyes Instant Test Endpoints
+endpoint_instant_test_url = f"{config.TE_API_URL}/v6/endpoint-instant/http-server.json"
+endpoint_instant_test_agent_to_server_url = f"{config.TE_API_URL}/v6/endpoint-instant/agent-to-server.json"
+
+enterprise_instant_test_url = f"{config.TE_API_URL}/v6/instant/http-server.json"
+enterprise_instant_test_agent_to_server_url = f"{config.TE_API_URL}/v6/instant/agent-to-server.json"
+
+# Agent lookup metrics
+LOOKUP_SECONDS = registry.histogram('chatbot_agent_lookup_duration_seconds', 'Agent id lookup time per card field',
+                                   labels=('type',))
+
+# Card agent fields take comma separated names, an Enterprise Agent entry "group:<label>" stands for every agent
+# in that ThousandEyes agent label
+AGENT_GROUP_PREFIX = "group:"
+
+""""     Test Catalog       """
+
+# Tests launched for each application (help card checkbox values)
+APPLICATIONS = {
+    "WebexAudio": ["webex_primary_audio", "webex_secondary_audio", "webex_primary_cb_server",
+                   "webex_secondary_cb_server"],
+    "WebexVideo": ["webex_primary_video", "webex_secondary_video", "webex_primary_cb_server",
+                   "webex_secondary_cb_server"],
+    "salesforce": ["salesforce"],
+    "Office365": ["o365_test"]
 }
 
-# Define Global ThousandEyes Instant Test Endpoints
-endpoint_instant_test_url = "https://api.thousandeyes.com/v6/endpoint-instant/http-server.json"
-endpoint_instant_test_agent_to_server_url = "https://api.thousandeyes.com/v6/endpoint-instant/agent-to-server.json"
+# Instant tests: kind (http-server, agent-to-server), target (None = custom url from the card), and the payload
+# fields specific to each test type
+TEST_CATALOG = {
+    "webex_primary_cb_server": {
+        "kind": "http-server",
+        "target": PrimaryCBServerURL,
+        "endpoint": {"testName": "WebEx Primary CB Server Endpoint Instant HTTP test", "targetResponseTime": 1000},
+        "enterprise": {"testName": "WebEx Primary CB Server Enterprise Instant HTTP test"}
+    },
+    "webex_secondary_cb_server": {
+        "kind": "http-server",
+        "target": SecondaryCBServerURL,
+        "endpoint": {"testName": "WebEx Secondary CB Server Endpoint Instant HTTP test", "targetResponseTime": 1000},
+        "enterprise": {"testName": "WebEx Secondary CB Server Enterprise Instant HTTP test"}
+    },
+    "webex_primary_audio": {
+        "kind": "agent-to-server",
+        "target": WebExPrimaryAudioURL,
+        "endpoint": {"testName": "Webex Primary Audio Endpoint Instant Test"},
+        "enterprise": {"testName": "Webex Primary Audio Enterprise Instant HTTP test"}
+    },
+    "webex_secondary_audio": {
+        "kind": "agent-to-server",
+        "target": WebExSecondaryAudioURL,
+        "endpoint": {"testName": "Webex Secondary Audio Endpoint Instant Test"},
+        "enterprise": {"testName": "Webex Secondary Audio Enterprise Instant HTTP test"}
+    },
+    "webex_primary_video": {
+        "kind": "agent-to-server",
+        "target": WebExPrimaryVideoURL,
+        "endpoint": {"testName": "Webex Primary Video Endpoint Instant Test"},
+        "enterprise": {"testName": "Webex Primary Video Enterprise Instant HTTP test"}
+    },
+    "webex_secondary_video": {
+        "kind": "agent-to-server",
+        "target": WebExSecondaryVideoURL,
+        "endpoint": {"testName": "Webex Secondary Video Endpoint Instant Test"},
+        "enterprise": {"testName": "Webex Secondary Video Enterprise Instant HTTP test"}
+    },
+    "salesforce": {
+        "kind": "http-server",
+        "target": SalesforceURL,
+        "endpoint": {"testName": "Salesforce Endpoint Instant HTTP test", "targetResponseTime": 5000},
+        "enterprise": {"testName": "Salesforce Enterprise Instant HTTP test"}
+    },
+    "o365_test": {
+        "kind": "http-server",
+        "target": O365URL,
+        "endpoint": {"testName": "O365 Endpoint Instant HTTP test", "targetResponseTime": 1000},
+        "enterprise": {"testName": "O365 Enterprise Instant HTTP test"}
+    },
+    "custom_endpoint_test": {
+        "kind": "http-server",
+        "target": None,
+        "endpoint": {"testName": "Custom URL Endpoint Instant HTTP test", "targetResponseTime": 5000},
+        "enterprise": {"testName": "Custom URL Enterprise Instant HTTP test"}
+    }
+}
 
-enterprise_instant_test_url = "https://api.thousandeyes.com/v6/instant/http-server.json"
-enterprise_instant_test_agent_to_server_url = "https://api.thousandeyes.com/v6/instant/agent-to-server.json"
+# Payload defaults for each (test type, kind): instant test api url, common payload fields, and the payload fields
+# holding the agent(s) and the target
+PAYLOAD_DEFAULTS = {
+    ("endpoint", "http-server"): (endpoint_instant_test_url, {
+        "agentSelectorType": "SPECIFIC_AGENTS",
+        "authType": "NONE",
+        "flagPing": True,
+        "flagTraceroute": True,
+        "httpTimeLimit": 5000,
+        "maxMachines": 5,
+        "sslVersion": 0,
+        "verifyCertHostname": True
+    }, "agentIds", "url"),
+    ("endpoint", "agent-to-server"): (endpoint_instant_test_agent_to_server_url, {
+        "agentSelectorType": "SPECIFIC_AGENTS",
+        "flagPing": True,
+        "flagTraceroute": True,
+        "maxMachines": 5,
+        "port": 5004
+    }, "agentIds", "serverName"),
+    ("enterprise", "http-server"): (enterprise_instant_test_url, {}, "agents", "url"),
+    ("enterprise", "agent-to-server"): (enterprise_instant_test_agent_to_server_url, {
+        "interval": 900
+    }, "agents", "server")
+}
 
 
-def api_call_wrapper(api_function, agent_id, test_type, resultArray, CustomURL=None):
+def compile_payload_templates():
     """
-    Wrapper function for test methods, allows parallelization and increased performance
-    :param CustomURL: Customer URL (if provided)
-    :param api_function: Test Function
-    :param agent_id: Endpoint or Enterprise Agent ID
-    :param test_type: test type (options: endpoint, enterprise)
-    :param resultArray: List of test results
+    Build the payload template of every catalog test for every test type (done once, at import)
+    :return: dictionary of (test name, test type) -> (api url, payload template, agent field, target field)
     """
-    if CustomURL:
-        resultArray.append(api_function(agent_id, CustomURL, test_type))
-    else:
-        resultArray.append(api_function(agent_id, test_type))
+    templates = {}
+    for test_name, test in TEST_CATALOG.items():
+        for test_type in ("endpoint", "enterprise"):
+            api_url, defaults, agent_field, target_field = PAYLOAD_DEFAULTS[(test_type, test["kind"])]
+            template = dict(defaults, **test[test_type])
+            if test["target"] is not None:
+                template[target_field] = test["target"]
+            templates[(test_name, test_type)] = (api_url, template, agent_field, target_field)
+    return templates
+
+
+PAYLOAD_TEMPLATES = compile_payload_templates()
+
+
+def resolve_endpoint_agent_id(hostname):
+    """
+    Query ThousandEyes for the Endpoint Agent unique ID based on computer hostname
+    :param hostname: Endpoint computer hostname
+    :return: Endpoint Agent ID or None if no agent has that hostname
+    """
+    # Define Endpoint URL
+    url = f"{config.TE_API_URL}/v6/endpoint-agents.json?computerName={urllib.parse.quote(hostname, safe='')}"
+    response = thousandeyes.get(url)
+
+    # Raise on failed lookups, so they aren't cached as "not found"
+    response.raise_for_status()
+    response_json = json.loads(response.text)
+
+    if len(response_json["endpointAgents"]) > 0:
+        return response_json["endpointAgents"][0]["agentId"]
+
+    # No endpoint agent found with that host name
+    return None
+
+
+def resolve_endpoint_agent_ids(hostnames):
+    """
+    Query ThousandEyes for the Endpoint Agent unique IDs of several computer hostnames, one query per hostname run in
+    parallel, at most TE_MAX_CONCURRENCY at a time (listing every Endpoint Agent costs far more pages than a few
+    hostnames on large accounts)
+    :param hostnames: Endpoint computer hostnames
+    :return: dictionary of hostname -> Endpoint Agent ID or None if not found (hostnames whose query failed are left
+    out)
+    """
+    agent_ids = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(hostnames), config.TE_MAX_CONCURRENCY)) as executor:
+        # Queries run in the context of the request (trace), each in its own copy
+        futures = {hostname: executor.submit(contextvars.copy_context().run, resolve_endpoint_agent_id, hostname)
+                   for hostname in hostnames}
+        for hostname, future in futures.items():
+            try:
+                agent_ids[hostname] = future.result()
+            except Exception as e:
+                print(f'There was an exception: {str(e)}')
+
+    return agent_ids
+
+
+# Endpoint Agent hostname cache (hostname -> agent id, not found results cached for a shorter time), shared by the
+# worker processes of a multi-worker deployment
+endpoint_agents = EndpointAgentCache(resolve_endpoint_agent_id, max_size=config.ENDPOINT_AGENT_CACHE_SIZE,
+                                     ttl=config.ENDPOINT_AGENT_TTL, negative_ttl=config.ENDPOINT_AGENT_NEGATIVE_TTL,
+                                     resolve_agents=resolve_endpoint_agent_ids,
+                                     shared=SharedCache(config.SHARED_STATE_PATH, 'endpoint_agents')
+                                     if config.SHARED_STATE_PATH else None)
+
+
+def agent_names(value):
+    """
+    Split a card agent field into agent names
+    :param value: comma separated agent names (or hostnames)
+    :return: list of names, in card order, without blanks and duplicates
+    """
+    names = []
+    for name in value.split(","):
+        name = name.strip()
+        if name and name not in names:
+            names.append(name)
+    return names
 
 
 def find_endpoint_agent_id(hostname):
@@ -76,452 +252,307 @@ def find_endpoint_agent_id(hostname):
     :param hostname: Endpoint computer hostname
     :return: Endpoint Agent ID
     """
-    # Define Endpoint URL
-    url = f"https://api.thousandeyes.com/v6/endpoint-agents.json?computerName={hostname}"
-    response = requests.get(url, headers=headers, data="")
+    try:
+        return endpoint_agents.lookup(hostname)
+    except Exception as e:
+        print(f'There was an exception: {str(e)}')
+        return None
+
+
+def find_endpoint_agents(hostnames):
+    """
+    Find Endpoint Agent unique IDs for a list of computer hostnames (hostnames that aren't cached are resolved in
+    parallel)
+    :param hostnames: Endpoint computer hostnames
+    :return: (list of (agent id, hostname) found, list of hostnames not found or whose lookup failed)
+    """
+    try:
+        with LOOKUP_SECONDS.time(type='endpoint'), tracer.span('agents.lookup', type='endpoint', agents=len(hostnames)):
+            agent_ids = endpoint_agents.lookup_many(hostnames)
+    except Exception as e:
+        print(f'There was an exception: {str(e)}')
+        return [], list(hostnames)
+
+    agents = [(agent_ids[hostname], hostname) for hostname in hostnames if agent_ids.get(hostname) is not None]
+    missing = [hostname for hostname in hostnames if agent_ids.get(hostname) is None]
+    return agents, missing
+
+
+def invalidate_endpoint_agent(hostname=None):
+    """
+    Forget the cached agent id for a hostname (call when an Endpoint Agent is re-registered)
+    :param hostname: Endpoint computer hostname, or None to clear the whole cache
+    """
+    endpoint_agents.invalidate(hostname)
+
+
+def fetch_enterprise_agents():
+    """
+    Download the list of Enterprise Agents from ThousandEyes
+    :return: list of Enterprise Agents or None if the request failed
+    """
+    # Define Endpoint URL (enterprise agents only)
+    url = f"{config.TE_API_URL}/v6/agents.json?agentTypes=ENTERPRISE"
+    response = thousandeyes.get(url)
 
     if response.ok:
         response_json = json.loads(response.text)
-
-        if len(response_json["endpointAgents"]) > 0:
-            return response_json["endpointAgents"][0]["agentId"]
-        else:
-            # No endpoint agent found with that host name
-            return None
+        return response_json['agents']
 
     return None
 
 
+# Enterprise Agent directory (name -> agent id index, refreshed in the background), shared by the worker processes
+# of a multi-worker deployment
+enterprise_agents = EnterpriseAgentDirectory(fetch_enterprise_agents, ttl=config.ENTERPRISE_AGENT_TTL,
+                                             shared=SharedCache(config.SHARED_STATE_PATH, 'enterprise_agents')
+                                             if config.SHARED_STATE_PATH else None)
+
+registry.counter_from('chatbot_agent_cache_lookups_total', 'Agent id lookups by cache and outcome',
+                      lambda: {('endpoint', 'hit'): endpoint_agents.stats()['hits'],
+                               ('endpoint', 'negative_hit'): endpoint_agents.stats()['negative_hits'],
+                               ('endpoint', 'miss'): endpoint_agents.stats()['misses'],
+                               ('enterprise', 'hit'): enterprise_agents.stats()['hits'],
+                               ('enterprise', 'miss'): enterprise_agents.stats()['misses']},
+                      labels=('cache', 'result'))
+
+
 def find_enterprise_agent_id(agent_name):
     """
     Find Enterprise Agent unique ID based on agent name
     :param agent_name: Enterprise agent name
     :return: Enterprise Agent ID
     """
-    # Define Endpoint URL (enterprise agents only)
-    url = f"https://api.thousandeyes.com/v6/agents.json?agentTypes=ENTERPRISE"
-    response = requests.get(url, headers=headers, data="")
+    return enterprise_agents.lookup(agent_name)
 
-    if response.ok:
-        response_json = json.loads(response.text)
 
-        # Iterate through Enterprise Agents identify the correct agent id
-        agents = response_json['agents']
-        for agent in agents:
-            if agent['agentName'] == agent_name:
-                return agent['agentId']
+def fetch_agent_group(label):
+    """
+    Download the Enterprise Agents of a ThousandEyes agent label (group)
+    :param label: agent label name
+    :return: list of (agent id, agent name), or None if there is no agent label with that name
+    """
+    response = thousandeyes.get(f"{config.TE_API_URL}/v6/groups/agents.json")
+    response.raise_for_status()
+
+    for group in json.loads(response.text)["groups"]:
+        if group["name"] == label:
+            response = thousandeyes.get(f"{config.TE_API_URL}/v6/groups/{group['groupId']}.json")
+            response.raise_for_status()
+            members = json.loads(response.text)["groups"][0].get("agents", [])
+            return [(agent["agentId"], agent["agentName"]) for agent in members]
 
     return None
 
 
-def test_selector(agent_id, webex_card_data, test_type):
+def find_enterprise_agents(names):
+    """
+    Find Enterprise Agent unique IDs for a list of agent names and agent labels ("group:<label>"), all names are
+    resolved from the one Enterprise Agent directory
+    :param names: Enterprise agent names and labels
+    :return: (list of (agent id, agent name) found, without duplicates, list of names and labels not found)
+    """
+    agents = []
+    seen = set()
+    missing = []
+    with LOOKUP_SECONDS.time(type='enterprise'), tracer.span('agents.lookup', type='enterprise', agents=len(names)):
+        for name in names:
+            if name.startswith(AGENT_GROUP_PREFIX):
+                try:
+                    members = fetch_agent_group(name[len(AGENT_GROUP_PREFIX):].strip())
+                except Exception as e:
+                    print(f'There was an exception: {str(e)}')
+                    members = None
+            else:
+                agent_id = enterprise_agents.lookup(name)
+                members = [(agent_id, name)] if agent_id is not None else None
+
+            if members:
+                for member in members:
+                    if member[0] not in seen:
+                        seen.add(member[0])
+                        agents.append(member)
+            else:
+                missing.append(name)
+
+    return agents, missing
+
+
+def test_launched(result):
+    """
+    Check whether an instant test response is a launched test (and not a ThousandEyes error)
+    :param result: ThousandEyes Instant Test result
+    :return: True if the response contains a test
+    """
+    try:
+        response_json = json.loads(result)
+    except ValueError:
+        return False
+    return 'test' in response_json or 'endpointTest' in response_json
+
+
+# In-flight instant tests, shared by concurrent requests for the same agent, test kind and target
+in_flight_tests = SingleFlight(config.COALESCE_WINDOW, keep=test_launched)
+
+
+def plan_tests(webex_card_data):
     """
-    Conduct ThousandEyes instant test from various pre-built options or a custom url
-    :param agent_id: Endpoint or Enterprise Agent ID
+    Build the unique set of instant tests for the selected applications (and custom url). Applications that share a
+    test (ex: Webex Audio and Webex Video both test the CB servers and the same media servers) get a single test
     :param webex_card_data: Card data containing selected test, custom url, etc.
-    :param test_type: test type (options: endpoint, enterprise)
-    :return: list of test results from ThousandEyes apis
+    :return: dictionary of (test kind, target) -> {'test', 'target', 'applications'}, in selection order
     """
+    plan = {}
+
     # Selected applications to run tests on (checkboxes)
     issueArray = webex_card_data["IssueSelectVal"].split(",")
+    for issue in issueArray:
+        for test_name in APPLICATIONS.get(issue, []):
+            test = TEST_CATALOG[test_name]
+            entry = plan.setdefault((test["kind"], test["target"]),
+                                    {'test': test_name, 'target': test["target"], 'applications': []})
+            if issue not in entry['applications']:
+                entry['applications'].append(issue)
 
-    # For each app, launch the dedicated instant test (using the global urls defined above), append results to list
-    resultArray = []
+    # Special custom url case: extract url, then pass url to custom test method
+    CustomURL = webex_card_data["CustomURLVal"]
 
-    # Execute instant tests in parallel using futures
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        futures = []
+    if CustomURL != '':
+        entry = plan.setdefault(("http-server", CustomURL),
+                                {'test': "custom_endpoint_test", 'target': CustomURL, 'applications': []})
+        entry['applications'].append('CustomURL')
 
-        for issue in issueArray:
-            if issue == "WebexAudio":
-                futures.append(executor.submit(api_call_wrapper, webex_primary_audio, agent_id, test_type, resultArray))
-                futures.append(
-                    executor.submit(api_call_wrapper, webex_secondary_audio, agent_id, test_type, resultArray))
-                futures.append(
-                    executor.submit(api_call_wrapper, webex_primary_cb_server, agent_id, test_type, resultArray))
-                futures.append(
-                    executor.submit(api_call_wrapper, webex_secondary_cb_server, agent_id, test_type, resultArray))
-            elif issue == "WebexVideo":
-                futures.append(executor.submit(api_call_wrapper, webex_primary_video, agent_id, test_type, resultArray))
-                futures.append(
-                    executor.submit(api_call_wrapper, webex_secondary_video, agent_id, test_type, resultArray))
-                futures.append(
-                    executor.submit(api_call_wrapper, webex_primary_cb_server, agent_id, test_type, resultArray))
-                futures.append(
-                    executor.submit(api_call_wrapper, webex_secondary_cb_server, agent_id, test_type, resultArray))
-            elif issue == "salesforce":
-                futures.append(executor.submit(api_call_wrapper, salesforce, agent_id, test_type, resultArray))
-            elif issue == "Office365":
-                futures.append(executor.submit(api_call_wrapper, o365_test, agent_id, test_type, resultArray))
-
-        # Special custom url case: extract url, then pass url to custom test method
-        CustomURL = webex_card_data["CustomURLVal"]
-
-        if CustomURL != '':
-            futures.append(
-                executor.submit(api_call_wrapper, custom_endpoint_test, agent_id, test_type, resultArray, CustomURL))
-
-        # Wait for all tasks to complete
-        for future in concurrent.futures.as_completed(futures):
-            future.result()  # This is just to wait for the task to complete, the result is already appended in the
-            # wrapper function
-
-    return resultArray
-
-
-def webex_primary_cb_server(agent_id, test_type):
-    """
-    ThousandEyes Instant Test for Webex Primary CB Service
-    :param agent_id: Endpoint or Enterprise Agent ID
-    :param test_type: test type (options: endpoint, enterprise)
-    :return: ThousandEyes Instant Test result
-    """
-    # Case 1: Endpoint Test
-    if test_type == 'endpoint':
-        url = endpoint_instant_test_url
-        payload = json.dumps({
-            "agentSelectorType": "SPECIFIC_AGENTS",
-            "agentIds": [agent_id],
-            "authType": "NONE",
-            "flagPing": True,
-            "flagTraceroute": True,
-            "httpTimeLimit": 5000,
-            "maxMachines": 5,
-            "sslVersion": 0,
-            "targetResponseTime": 1000,
-            "testName": "WebEx Primary CB Server Endpoint Instant HTTP test",
-            "url": PrimaryCBServerURL,
-            "verifyCertHostname": True
-        })
-    # Case 2: Enterprise Test
-    else:
-        url = enterprise_instant_test_url
-        payload = json.dumps({
-            "agents": [
-                {
-                    "agentId": agent_id
-                }
-            ],
-            "testName": "WebEx Primary CB Server Enterprise Instant HTTP test",
-            "url": PrimaryCBServerURL
-        })
-
-    response = requests.post(url, headers=headers, data=payload)
-    return response.text
+    return plan
 
 
-def webex_secondary_cb_server(agent_id, test_type):
+def plan_launches(agents, webex_card_data, test_type, result_cache=None):
     """
-    ThousandEyes Instant Test for Webex Secondary CB Service
-    :param agent_id: Endpoint or Enterprise Agent ID
+    Plan the instant test launches for a card: every unique test (see plan_tests) is launched once for all of its
+    agents (multiple agents per ThousandEyes call, up to INSTANT_TEST_MAX_AGENTS), agents with a fresh result in the
+    result cache are answered from the cache instead
+    :param agents: list of (agent id, agent name)
+    :param webex_card_data: Card data containing selected test, custom url, etc.
     :param test_type: test type (options: endpoint, enterprise)
-    :return: ThousandEyes Instant Test result
+    :param result_cache: optional ResultCache of recently completed tests
+    :return: list of launches: dictionaries with the 'test_key' (test type, test kind, target), the coalescing 'key'
+    (test type, agent ids, test kind, target), the catalog 'test' and 'target', the 'applications' that asked for
+    it, its 'agents', and the 'cached' (record, age) result of each agent for launches answered from the cache
     """
-    # Case 1: Endpoint Test
-    if test_type == 'endpoint':
-        url = endpoint_instant_test_url
-        payload = json.dumps({
-            "agentSelectorType": "SPECIFIC_AGENTS",
-            "agentIds": [agent_id],
-            "authType": "NONE",
-            "flagPing": True,
-            "flagTraceroute": True,
-            "httpTimeLimit": 5000,
-            "maxMachines": 5,
-            "sslVersion": 0,
-            "targetResponseTime": 1000,
-            "testName": "WebEx Secondary CB Server Endpoint Instant HTTP test",
-            "url": SecondaryCBServerURL,
-            "verifyCertHostname": True
-        })
-    # Case 2: Enterprise Test
-    else:
-        url = enterprise_instant_test_url
-        payload = json.dumps({
-            "agents": [
-                {
-                    "agentId": agent_id
-                }
-            ],
-            "testName": "WebEx Secondary CB Server Enterprise Instant HTTP test",
-            "url": SecondaryCBServerURL
-        })
-
-    response = requests.post(url, headers=headers, data=payload)
-    return response.text
+    launches = []
+    for (kind, target), entry in plan_tests(webex_card_data).items():
+        test_key = (test_type, kind, target)
+        base = {'test': entry['test'], 'target': target, 'test_key': test_key, 'applications': entry['applications']}
 
+        cached = []
+        pending = []
+        for agent in agents:
+            hit = result_cache.get(result_key(test_key, agent[0])) if result_cache is not None else None
+            if hit:
+                cached.append((agent, hit))
+            else:
+                pending.append(agent)
 
-def webex_primary_audio(agent_id, test_type):
-    """
-    ThousandEyes Instant Test for Webex Primary Audio Service
-    :param agent_id: Endpoint or Enterprise Agent ID
-    :param test_type: test type (options: endpoint, enterprise)
-    :return: ThousandEyes Instant Test result
-    """
-    # Case 1: Endpoint Test
-    if test_type == 'endpoint':
-        url = endpoint_instant_test_agent_to_server_url
-        payload = json.dumps({
-            "agentSelectorType": "SPECIFIC_AGENTS",
-            "agentIds": [agent_id],
-            "flagPing": True,
-            "flagTraceroute": True,
-            "maxMachines": 5,
-            "testName": "Webex Primary Audio Endpoint Instant Test",
-            "serverName": WebExPrimaryAudioURL,
-            "port": 5004
-        })
-    # Case 2: Enterprise Test
-    else:
-        url = enterprise_instant_test_agent_to_server_url
-        payload = json.dumps({
-            "agents": [
-                {
-                    "agentId": agent_id
-                }
-            ],
-            "testName": "Webex Primary Audio Enterprise Instant HTTP test",
-            "server": WebExPrimaryAudioURL,
-            "interval": 900
-        })
-
-    response = requests.post(url, headers=headers, data=payload)
-    return response.text
+        if cached:
+            launches.append(dict(base, key=None, agents=[agent for agent, _ in cached],
+                                 cached=[hit for _, hit in cached]))
 
+        for i in range(0, len(pending), config.INSTANT_TEST_MAX_AGENTS):
+            chunk = pending[i:i + config.INSTANT_TEST_MAX_AGENTS]
+            key = (test_type, tuple(agent_id for agent_id, _ in chunk), kind, target)
+            launches.append(dict(base, key=key, agents=chunk, cached=None))
 
-def webex_secondary_audio(agent_id, test_type):
-    """
-    ThousandEyes Instant Test for Webex Secondary Audio Service
-    :param agent_id: Endpoint or Enterprise Agent ID
-    :param test_type: test type (options: endpoint, enterprise)
-    :return: ThousandEyes Instant Test result
-    """
-    # Case 1: Endpoint Test
-    if test_type == 'endpoint':
-        url = endpoint_instant_test_agent_to_server_url
-        payload = json.dumps({
-            "agentSelectorType": "SPECIFIC_AGENTS",
-            "agentIds": [agent_id],
-            "flagPing": True,
-            "flagTraceroute": True,
-            "maxMachines": 5,
-            "testName": "Webex Secondary Audio Endpoint Instant Test",
-            "serverName": WebExSecondaryAudioURL,
-            "port": 5004
-        })
-    # Case 2: Enterprise Test
-    else:
-        url = enterprise_instant_test_agent_to_server_url
-        payload = json.dumps({
-            "agents": [
-                {
-                    "agentId": agent_id
-                }
-            ],
-            "testName": "Webex Secondary Audio Enterprise Instant HTTP test",
-            "server": WebExSecondaryAudioURL,
-            "interval": 900
-        })
-
-    response = requests.post(url, headers=headers, data=payload)
-    return response.text
+    return launches
 
 
-def webex_primary_video(agent_id, test_type):
+def test_selector(agents, webex_card_data, test_type, result_cache=None):
     """
-    ThousandEyes Instant Test for Webex Primary Video Service
-    :param agent_id: Endpoint or Enterprise Agent ID
+    Conduct ThousandEyes instant tests from various pre-built options or a custom url, on one or more agents. Each
+    unique (test kind, target) is launched once for all agents, no matter how many selected applications need it,
+    and requests arriving while the same test is in flight (ex: other users during an outage) attach to that test
+    instead of launching a new one. Agents with a fresh result in the result cache are not tested at all
+    :param agents: list of (agent id, agent name)
+    :param webex_card_data: Card data containing selected test, custom url, etc.
     :param test_type: test type (options: endpoint, enterprise)
-    :return: ThousandEyes Instant Test result
+    :param result_cache: optional ResultCache of recently completed tests
+    :return: list of launches (see plan_launches), in selection order, launched ones with the ThousandEyes 'result'
     """
-    # Case 1: Endpoint Test
-    if test_type == 'endpoint':
-        url = endpoint_instant_test_agent_to_server_url
-        payload = json.dumps({
-            "agentSelectorType": "SPECIFIC_AGENTS",
-            "agentIds": [agent_id],
-            "flagPing": True,
-            "flagTraceroute": True,
-            "maxMachines": 5,
-            "testName": "Webex Primary Video Endpoint Instant Test",
-            "serverName": WebExPrimaryVideoURL,
-            "port": 5004
-        })
-    # Case 2: Enterprise Test
-    else:
-        url = enterprise_instant_test_agent_to_server_url
-        payload = json.dumps({
-            "agents": [
-                {
-                    "agentId": agent_id
-                }
-            ],
-            "testName": "Webex Primary Video Enterprise Instant HTTP test",
-            "server": WebExPrimaryVideoURL,
-            "interval": 900
-        })
-
-    response = requests.post(url, headers=headers, data=payload)
-    return response.text
+    launches = plan_launches(agents, webex_card_data, test_type, result_cache=result_cache)
 
+    # Execute instant tests in parallel using futures
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        futures = []
 
-def webex_secondary_video(agent_id, test_type):
-    """
-    ThousandEyes Instant Test for Webex Secondary Video Service
-    :param agent_id: Endpoint or Enterprise Agent ID
-    :param test_type: test type (options: endpoint, enterprise)
-    :return: ThousandEyes Instant Test result
-    """
-    # Case 1: Endpoint Test
-    if test_type == 'endpoint':
-        url = endpoint_instant_test_agent_to_server_url
-        payload = json.dumps({
-            "agentSelectorType": "SPECIFIC_AGENTS",
-            "agentIds": [agent_id],
-            "flagPing": True,
-            "flagTraceroute": True,
-            "maxMachines": 5,
-            "testName": "Webex Secondary Video Endpoint Instant Test",
-            "serverName": WebExSecondaryVideoURL,
-            "port": 5004
-        })
-    # Case 2: Enterprise Test
-    else:
-        url = enterprise_instant_test_agent_to_server_url
-        payload = json.dumps({
-            "agents": [
-                {
-                    "agentId": agent_id
-                }
-            ],
-            "testName": "Webex Secondary Video Enterprise Instant HTTP test",
-            "server": WebExSecondaryVideoURL,
-            "interval": 900
-        })
-
-    response = requests.post(url, headers=headers, data=payload)
-    return response.text
+        for launch in launches:
+            _, kind, target = launch['test_key']
+            if launch['cached']:
+                console.print(f'Recent result for {kind} {target} on {len(launch["agents"])} agent(s)')
+                futures.append(None)
+            else:
+                console.print(f'Instant test {kind} {target} on {len(launch["agents"])} agent(s) for '
+                              f'{", ".join(launch["applications"])}')
+                # Launches run in the context of the request (trace), each in its own copy
+                futures.append(executor.submit(contextvars.copy_context().run, launch_coalesced, launch['key'],
+                                               launch['test'], launch['key'][1], test_type, target))
+
+        # Collect results in plan order (every application sharing a test shares its result)
+        for launch, future in zip(launches, futures):
+            launch['result'] = future.result() if future is not None else None
 
+    return launches
 
-def salesforce(agent_id, test_type):
+
+def launch_coalesced(key, test_name, agent_ids, test_type, target):
     """
-    ThousandEyes Instant Test for SalesForce Service
-    :param agent_id: Endpoint or Enterprise Agent ID
+    Launch an instant test, or attach to the matching in-flight test
+    :param key: (test type, agent ids, test kind, target)
+    :param test_name: catalog test name
+    :param agent_ids: Endpoint or Enterprise Agent IDs
     :param test_type: test type (options: endpoint, enterprise)
+    :param target: test target (url or server)
     :return: ThousandEyes Instant Test result
     """
-    # Case 1: Endpoint Test
-    if test_type == 'endpoint':
-        url = endpoint_instant_test_url
-        payload = json.dumps({
-            "agentSelectorType": "SPECIFIC_AGENTS",
-            "agentIds": [agent_id],
-            "authType": "NONE",
-            "flagPing": True,
-            "flagTraceroute": True,
-            "httpTimeLimit": 5000,
-            "maxMachines": 5,
-            "sslVersion": 0,
-            "targetResponseTime": 5000,
-            "testName": "Salesforce Endpoint Instant HTTP test",
-            "url": SalesforceURL,
-            "verifyCertHostname": True
-        })
-    # Case 2: Enterprise Test
-    else:
-        url = enterprise_instant_test_url
-        payload = json.dumps({
-            "agents": [
-                {
-                    "agentId": agent_id
-                }
-            ],
-            "testName": "Salesforce Enterprise Instant HTTP test",
-            "url": SalesforceURL
-        })
-
-    response = requests.post(url, headers=headers, data=payload)
-    return response.text
+    with tracer.span('thousandeyes.launch', test=test_name, kind=key[2], target=target,
+                     agents=len(agent_ids)) as span:
+        result, shared = in_flight_tests.do(key, launch_test, test_name, agent_ids, test_type, target)
+        span['attributes']['shared'] = shared
+    if shared:
+        console.print(f'[blue]Attached to in-flight test[/] {key}')
+    return result
 
 
-def custom_endpoint_test(agent_id, custom_url, test_type):
+def build_payload(test_name, agent_ids, test_type, target=None):
     """
-    ThousandEyes Instant Test for custom url
-    :param custom_url: customer url (format: youtube.com - https:// not strictly required)
-    :param agent_id: Endpoint or Enterprise Agent ID
+    Build the ThousandEyes instant test payload of a catalog test from its precompiled template
+    :param test_name: catalog test name
+    :param agent_ids: Endpoint or Enterprise Agent IDs (the test runs on all of them)
     :param test_type: test type (options: endpoint, enterprise)
-    :return: ThousandEyes Instant Test result
+    :param target: test target (required for custom url tests, catalog target otherwise)
+    :return: (api url, payload dictionary)
     """
-    # Case 1: Endpoint Test
-    if test_type == 'endpoint':
-        url = endpoint_instant_test_url
-        payload = json.dumps({
-            "agentSelectorType": "SPECIFIC_AGENTS",
-            "agentIds": [agent_id],
-            "authType": "NONE",
-            "flagPing": True,
-            "flagTraceroute": True,
-            "httpTimeLimit": 5000,
-            "maxMachines": 5,
-            "sslVersion": 0,
-            "targetResponseTime": 5000,
-            "testName": "Custom URL Endpoint Instant HTTP test",
-            "url": custom_url,
-            "verifyCertHostname": True
-        })
-    # Case 2: Enterprise Test
+    api_url, template, agent_field, target_field = PAYLOAD_TEMPLATES[(test_name, test_type)]
+
+    payload = template.copy()
+    if agent_field == "agentIds":
+        payload[agent_field] = list(agent_ids)
+        payload["maxMachines"] = max(payload["maxMachines"], len(agent_ids))
     else:
-        url = enterprise_instant_test_url
-        payload = json.dumps({
-            "agents": [
-                {
-                    "agentId": agent_id
-                }
-            ],
-            "testName": "Custom URL Enterprise Instant HTTP test",
-            "url": custom_url
-        })
-
-    response = requests.post(url, headers=headers, data=payload)
-    return response.text
+        payload[agent_field] = [{"agentId": agent_id} for agent_id in agent_ids]
+    if target is not None:
+        payload[target_field] = target
 
+    return api_url, payload
 
-def o365_test(agent_id, test_type):
+
+def launch_test(test_name, agent_ids, test_type, target=None):
     """
-    ThousandEyes Instant Test for O365 Service
-    :param agent_id: Endpoint or Enterprise Agent ID
+    ThousandEyes Instant Test for a catalog test
+    :param test_name: catalog test name
+    :param agent_ids: Endpoint or Enterprise Agent IDs (the test runs on all of them)
     :param test_type: test type (options: endpoint, enterprise)
+    :param target: test target (required for custom url tests, catalog target otherwise)
     :return: ThousandEyes Instant Test result
     """
-    # Case 1: Endpoint Test
-    if test_type == 'endpoint':
-        url = endpoint_instant_test_url
-        payload = json.dumps({
-            "agentSelectorType": "SPECIFIC_AGENTS",
-            "agentIds": [agent_id],
-            "authType": "NONE",
-            "flagPing": True,
-            "flagTraceroute": True,
-            "httpTimeLimit": 5000,
-            "maxMachines": 5,
-            "sslVersion": 0,
-            "targetResponseTime": 1000,
-            "testName": "O365 Endpoint Instant HTTP test",
-            "url": O365URL,
-            "verifyCertHostname": True
-        })
-    # Case 2: Enterprise Test
-    else:
-        url = enterprise_instant_test_url
-        payload = json.dumps({
-            "agents": [
-                {
-                    "agentId": agent_id
-                }
-            ],
-            "testName": "O365 Enterprise Instant HTTP test",
-            "url": O365URL
-        })
-
-    response = requests.post(url, headers=headers, data=payload)
+    url, payload = build_payload(test_name, agent_ids, test_type, target)
+
+    response = thousandeyes.post(url, json=payload)
     return response.text
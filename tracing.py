@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+__author__ = "Trevor Maco <tmaco@cisco.com>, Josh Ingeniero <jingenie@cisco.com>"
+__copyright__ = "Copyright (c) 2023 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+import collections
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# Current (trace id, span id), follows the code through calls and asyncio tasks. Threads don't inherit it: work handed
+# to another thread carries the trace id (or a copy of the context) explicitly
+_current = contextvars.ContextVar('trace', default=(None, None))
+
+EXPORT_JSONL = 'jsonl'
+EXPORT_OTLP = 'otlp'
+
+
+def current_trace():
+    """
+    :return: trace id of the request being handled, or None
+    """
+    return _current.get()[0]
+
+
+def current_span():
+    """
+    :return: (trace id, span id) of the current span, to continue the trace on another thread (see Tracer.record)
+    """
+    return _current.get()
+
+
+def otlp_value(value):
+    """
+    OTLP/JSON attribute value
+    """
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def from_otlp_value(value):
+    """
+    Attribute value of an OTLP/JSON attribute (see otlp_value)
+    """
+    if 'intValue' in value:
+        return int(value['intValue'])
+    return next(iter(value.values()), None)
+
+
+class Tracer:
+    """
+    Per-request traces: a trace id is created when a card is submitted, and every stage of the request (agent lookup,
+    instant test launch, result polling, Webex delivery) records a timed span under it. Recent traces are kept in
+    memory (see /trace/<id>), spans can also be appended to a JSON lines or OTLP/JSON file, which is read back for
+    traces recorded by other processes
+    """
+
+    def __init__(self, max_traces, export_path=None, export_format=EXPORT_JSONL, service_name='thousandeyes-chatbot',
+                 enabled=True):
+        """
+        :param max_traces: number of recent traces kept in memory
+        :param export_path: optional file spans are appended to
+        :param export_format: 'jsonl' (one span per line) or 'otlp' (one OTLP/JSON ExportTraceServiceRequest per line)
+        :param service_name: service.name resource attribute of exported spans
+        :param enabled: False turns every call into a no-op
+        """
+        self.max_traces = max_traces
+        self.export_path = export_path
+        self.export_format = export_format
+        self.service_name = service_name
+        self.enabled = enabled
+
+        self._traces = collections.OrderedDict()  # trace id -> list of spans
+        self._lock = threading.Lock()
+        self._export_lock = threading.Lock()
+
+    def new_trace(self):
+        """
+        Start a new trace
+        :return: trace id (32 hex characters), None if tracing is disabled
+        """
+        if not self.enabled:
+            return None
+        trace_id = uuid.uuid4().hex
+        with self._lock:
+            self._traces[trace_id] = []
+            while len(self._traces) > self.max_traces:
+                self._traces.popitem(last=False)
+        return trace_id
+
+    @contextlib.contextmanager
+    def activate(self, trace_id):
+        """
+        Make a trace current for a block (ex: in a worker thread or scheduler job handling the request)
+        :param trace_id: trace id (None leaves the block untraced)
+        """
+        if _current.get()[0] == trace_id:
+            # Already in this trace (ex: inline dispatch), keep the current span as parent
+            yield
+            return
+        token = _current.set((trace_id, None))
+        try:
+            yield
+        finally:
+            _current.reset(token)
+
+    @contextlib.contextmanager
+    def span(self, name, **attributes):
+        """
+        Time a block as a span of the current trace (nothing is recorded outside of a trace)
+        :param name: span name (ex: thousandeyes.request)
+        :param attributes: span attributes, more can be added to the yielded span's 'attributes' inside the block
+        """
+        trace_id, parent_id = _current.get()
+        span = {'attributes': dict(attributes)}
+        if trace_id is None or not self.enabled:
+            yield span
+            return
+
+        span_id = os.urandom(8).hex()
+        token = _current.set((trace_id, span_id))
+        start = time.time()
+        status = 'ok'
+        try:
+            yield span
+        except Exception as e:
+            status = 'error'
+            span['attributes']['error'] = str(e)
+            raise
+        finally:
+            _current.reset(token)
+            self.record(name, start, time.time(), trace_id=trace_id, parent_id=parent_id, span_id=span_id,
+                        status=span.get('status', status), **span['attributes'])
+
+    def record(self, name, start, end, trace_id=None, parent_id=None, span_id=None, status='ok', **attributes):
+        """
+        Record a span with known start and end times (ex: time spent waiting in a queue)
+        :param name: span name
+        :param start: epoch start time
+        :param end: epoch end time
+        :param trace_id: trace id (defaults to the current trace)
+        :param parent_id: parent span id (defaults to the current span)
+        :param status: 'ok' or 'error'
+        :param attributes: span attributes
+        """
+        if not self.enabled:
+            return
+        if trace_id is None:
+            trace_id, current_span = _current.get()
+            parent_id = parent_id or current_span
+        if trace_id is None:
+            return
+
+        span = {'trace_id': trace_id, 'span_id': span_id or os.urandom(8).hex(), 'parent_id': parent_id,
+                'name': name, 'start': start, 'end': end, 'duration_ms': round((end - start) * 1000, 3),
+                'status': status, 'attributes': attributes}
+
+        with self._lock:
+            spans = self._traces.get(trace_id)
+            if spans is None:
+                # Trace started by an earlier run (ex: resumed delivery), or evicted: keep its new spans
+                spans = self._traces[trace_id] = []
+                while len(self._traces) > self.max_traces:
+                    self._traces.popitem(last=False)
+            spans.append(span)
+
+        if self.export_path:
+            self._export(span)
+
+    def _export(self, span):
+        """
+        Append a span to the export file
+        """
+        if self.export_format == EXPORT_OTLP:
+            line = {'resourceSpans': [{
+                'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': self.service_name}}]},
+                'scopeSpans': [{'scope': {'name': 'chatbot'}, 'spans': [{
+                    'traceId': span['trace_id'], 'spanId': span['span_id'], 'parentSpanId': span['parent_id'] or '',
+                    'name': span['name'], 'kind': 1,
+                    'startTimeUnixNano': str(int(span['start'] * 1e9)),
+                    'endTimeUnixNano': str(int(span['end'] * 1e9)),
+                    'attributes': [{'key': key, 'value': otlp_value(value)}
+                                   for key, value in span['attributes'].items()],
+                    'status': {'code': 2 if span['status'] == 'error' else 1}}]}]}]}
+        else:
+            line = span
+
+        try:
+            with self._export_lock, open(self.export_path, 'a') as export_file:
+                export_file.write(json.dumps(line, default=str) + '\n')
+        except OSError as e:
+            logger.error(f'Span export failed: {str(e)}')
+
+    def get(self, trace_id):
+        """
+        Spans of a recent trace, in start order. With an export file, spans recorded by other processes (worker
+        processes of a multi-worker deployment, or an earlier run) are read from it
+        :param trace_id: trace id
+        :return: list of spans, or None if the trace is unknown (or was evicted)
+        """
+        with self._lock:
+            spans = self._traces.get(trace_id)
+            spans = list(spans) if spans is not None else None
+
+        if self.export_path:
+            exported = self._read_export(trace_id)
+            if exported:
+                known = {span['span_id'] for span in spans or []}
+                spans = (spans or []) + [span for span in exported if span['span_id'] not in known]
+
+        return sorted(spans, key=lambda span: span['start']) if spans is not None else None
+
+    def _read_export(self, trace_id):
+        """
+        Spans of a trace in the export file (the whole file is scanned, /trace/<id> is a debug view)
+        :return: list of spans
+        """
+        spans = []
+        try:
+            with self._export_lock, open(self.export_path) as export_file:
+                for line in export_file:
+                    if trace_id not in line:
+                        continue
+                    try:
+                        span = json.loads(line)
+                        if self.export_format == EXPORT_OTLP:
+                            spans += [self._from_otlp(otlp_span)
+                                      for resource in span['resourceSpans'] for scope in resource['scopeSpans']
+                                      for otlp_span in scope['spans'] if otlp_span['traceId'] == trace_id]
+                        elif span.get('trace_id') == trace_id:
+                            spans.append(span)
+                    except (ValueError, KeyError, TypeError):
+                        continue
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error(f'Span export unreadable: {str(e)}')
+        return spans
+
+    @staticmethod
+    def _from_otlp(otlp_span):
+        """
+        Span of an exported OTLP/JSON span (see _export)
+        """
+        start, end = int(otlp_span['startTimeUnixNano']) / 1e9, int(otlp_span['endTimeUnixNano']) / 1e9
+        return {'trace_id': otlp_span['traceId'], 'span_id': otlp_span['spanId'],
+                'parent_id': otlp_span['parentSpanId'] or None, 'name': otlp_span['name'], 'start': start, 'end': end,
+                'duration_ms': round((end - start) * 1000, 3),
+                'status': 'error' if otlp_span['status']['code'] == 2 else 'ok',
+                'attributes': {attribute['key']: from_otlp_value(attribute['value'])
+                               for attribute in otlp_span['attributes']}}
+
+    def timeline(self, trace_id, spans=None):
+        """
+        Text timeline of a trace: offset from the first span, duration and name of every span, nested under its parent
+        :param trace_id: trace id
+        :param spans: spans of the trace, if already looked up (see get)
+        :return: timeline text, or None if the trace is unknown
+        """
+        spans = self.get(trace_id) if spans is None else spans
+        if spans is None:
+            return None
+        if not spans:
+            return f'Trace {trace_id}: no spans yet\n'
+
+        origin = spans[0]['start']
+        parents = {span['span_id']: span['parent_id'] for span in spans}
+        lines = [f'Trace {trace_id}: {len(spans)} spans, {max(span["end"] for span in spans) - origin:.3f}s']
+        for span in spans:
+            depth, parent_id = 0, span['parent_id']
+            while parent_id in parents:
+                depth, parent_id = depth + 1, parents[parent_id]
+            attributes = ' '.join(f'{key}={value}' for key, value in span['attributes'].items())
+            flag = ' [error]' if span['status'] == 'error' else ''
+            lines.append(f'{span["start"] - origin:9.3f}s {span["duration_ms"] / 1000:9.3f}s  '
+                         f'{"  " * depth}{span["name"]}{flag} {attributes}'.rstrip())
+        return '\n'.join(lines) + '\n'
+
+
+# Process-wide tracer
+tracer = Tracer(config.TRACE_MAX_TRACES, export_path=config.TRACE_EXPORT_PATH or None,
+                export_format=config.TRACE_EXPORT_FORMAT, enabled=config.TRACING_ENABLED)
@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+__author__ = "Trevor Maco <tmaco@cisco.com>, Josh Ingeniero <jingenie@cisco.com>"
+__copyright__ = "Copyright (c) 2023 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+import json
+import os
+import re
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import config
+from metrics import registry
+from rate_limit import RateLimiter
+from tracing import tracer
+
+# Load env variables
+load_dotenv()
+THOUSAND_EYES_TOKEN = os.getenv("THOUSAND_EYES_TOKEN")
+
+# ThousandEyes call metrics (threaded and asyncio engines)
+CALL_SECONDS = registry.histogram('thousandeyes_request_duration_seconds', 'ThousandEyes API call latency',
+                                  labels=('endpoint',))
+CALLS = registry.counter('thousandeyes_requests_total', 'ThousandEyes API calls by response status',
+                         labels=('endpoint', 'status'))
+
+# Server errors a GET is retried on (see Transport.request)
+RETRY_STATUSES = (500, 502, 503, 504)
+
+# Numeric path segments (test ids, agent ids) are collapsed so latency is grouped per endpoint
+ID_SEGMENT = re.compile(r'/\d+(?=/|$|\.json)')
+
+
+def endpoint_name(method, url):
+    """
+    Normalize a request into an endpoint label for latency statistics
+    :param method: HTTP method
+    :param url: full request url
+    :return: endpoint label (ex: GET /v6/web/http-server/{id})
+    """
+    path = ID_SEGMENT.sub('/{id}', urlsplit(url).path)
+    return f'{method} {path}'
+
+
+class Transport:
+    """
+    Shared HTTP transport for ThousandEyes API calls: one pooled keep-alive session, per-call timeouts, retries with
+    backoff on 5xx and connection errors, rate limiting, and per-endpoint latency statistics
+    """
+
+    def __init__(self, token, pool_size, connect_timeout, read_timeout, retries, backoff, limiter=None,
+                 throttle_retries=0):
+        """
+        :param token: ThousandEyes OAuth bearer token
+        :param pool_size: maximum number of kept-alive connections per host
+        :param connect_timeout: default connect timeout (seconds)
+        :param read_timeout: default read timeout (seconds)
+        :param retries: maximum number of retries
+        :param backoff: backoff factor between retries (seconds)
+        :param limiter: optional RateLimiter every call goes through
+        :param throttle_retries: maximum number of retries of a throttled (429) call, after its Retry-After
+        """
+        self.timeout = (connect_timeout, read_timeout)
+        self.limiter = limiter
+        self.retries = retries
+        self.backoff = backoff
+        self.throttle_retries = throttle_retries
+
+        # The pool only retries connections that couldn't be opened (nothing reached ThousandEyes). Every retry of a
+        # request that was sent (5xx, read errors, 429) goes through request(), so it costs a rate limiter token and
+        # the limiter sees its outcome
+        retry = Retry(total=retries, connect=retries, read=0, status=0, other=0, backoff_factor=backoff,
+                      respect_retry_after_header=False, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            'Content-Type': 'application/json',
+            'Accept': 'application/json',
+            'Authorization': f"Bearer {token}"
+        })
+
+        self._latency = {}
+        self._lock = threading.Lock()
+
+    def request(self, method, url, timeout=None, **kwargs):
+        """
+        Send a request to ThousandEyes through the pooled session
+        :param method: HTTP method
+        :param url: ThousandEyes API url
+        :param timeout: optional (connect, read) timeout override
+        :return: requests Response
+        """
+        throttled = failures = 0
+        while True:
+            if self.limiter is not None:
+                self.limiter.acquire()
+
+            start = time.perf_counter()
+            response = error = None
+            retry_after = None
+            try:
+                response = self.session.request(method, url, timeout=timeout or self.timeout, **kwargs)
+            except requests.RequestException as e:
+                error = e
+            finally:
+                elapsed = time.perf_counter() - start
+                status = response.status_code if response is not None else None
+                if self.limiter is not None:
+                    retry_after = self.limiter.release(elapsed, status, response.headers if response is not None
+                                                       else None)
+                self.record_call(endpoint_name(method, url), elapsed, status if status is not None else 'error')
+
+            # Throttled: the request was rejected, so it is safe to send again (even a POST) after Retry-After
+            if status == 429 and throttled < self.throttle_retries:
+                throttled += 1
+                time.sleep(retry_after or 0)
+                continue
+
+            # Server errors and failed reads are retried with backoff for GET only, re-sending an instant test POST
+            # could launch the same test twice
+            if method == 'GET' and (error is not None or status in RETRY_STATUSES) and failures < self.retries:
+                time.sleep(self.backoff * 2 ** failures)
+                failures += 1
+                continue
+
+            if error is not None:
+                raise error
+            return response
+
+    def get(self, url, **kwargs):
+        """
+        GET a ThousandEyes url
+        :param url: ThousandEyes API url
+        :return: requests Response
+        """
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        """
+        POST to a ThousandEyes url
+        :param url: ThousandEyes API url
+        :return: requests Response
+        """
+        return self.request('POST', url, **kwargs)
+
+    def record_call(self, endpoint, elapsed, status):
+        """
+        Record latency and status of a call, as metrics and as a span of the current trace (also used for calls made
+        outside the session, ex: by the asyncio engine)
+        :param endpoint: endpoint label (see endpoint_name)
+        :param elapsed: call duration (seconds)
+        :param status: HTTP status code, or 'error' if the call failed
+        """
+        CALL_SECONDS.observe(elapsed, endpoint=endpoint)
+        CALLS.inc(endpoint=endpoint, status=status)
+        now = time.time()
+        tracer.record('thousandeyes.request', now - elapsed, now, status='error' if status == 'error' else 'ok',
+                      endpoint=endpoint, http_status=status)
+        with self._lock:
+            stats = self._latency.get(endpoint)
+            if stats is None:
+                stats = self._latency[endpoint] = {'count': 0, 'total': 0.0, 'max': 0.0, 'status': {}}
+            stats['count'] += 1
+            stats['total'] += elapsed
+            stats['max'] = max(stats['max'], elapsed)
+            stats['status'][status] = stats['status'].get(status, 0) + 1
+
+    def latency_stats(self):
+        """
+        Per-endpoint call statistics
+        :return: dictionary of endpoint -> count, average and max latency (seconds), status code counts
+        """
+        with self._lock:
+            return {endpoint: {'count': stats['count'], 'avg': stats['total'] / stats['count'], 'max': stats['max'],
+                               'status': dict(stats['status'])}
+                    for endpoint, stats in self._latency.items()}
+
+
+class FixtureResponse:
+    """
+    Recorded response, with the parts of requests.Response the bot uses (status_code, ok, text, json,
+    raise_for_status)
+    """
+
+    def __init__(self, url, status_code, text):
+        self.url = url
+        self.status_code = status_code
+        self.text = text
+        self.headers = {}
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    def json(self):
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise requests.HTTPError(f'{self.status_code} for url: {self.url}', response=self)
+
+
+class FixtureTransport:
+    """
+    Transport answering ThousandEyes calls from recorded responses (ex: benchmarks, offline runs), see
+    RecordingTransport. Urls without a recorded response get a 404
+    """
+
+    def __init__(self, responses):
+        """
+        :param responses: dictionary of url -> {'status': HTTP status, 'body': decoded JSON body}
+        """
+        # Bodies are kept serialized, every call decodes its response like a real one
+        self._responses = {url: (response['status'], json.dumps(response['body']))
+                           for url, response in responses.items()}
+
+    @classmethod
+    def from_file(cls, path):
+        """
+        Load a fixture file (JSON with a 'responses' dictionary, see RecordingTransport.save)
+        """
+        with open(path) as fixture_file:
+            return cls(json.load(fixture_file)['responses'])
+
+    def request(self, method, url, **kwargs):
+        status, text = self._responses.get(url, (404, json.dumps({'message': f'No recorded response for {url}'})))
+        return FixtureResponse(url, status, text)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+
+class RecordingTransport:
+    """
+    Wrapper keeping every JSON response of a transport, to be saved as a fixture file (see FixtureTransport)
+    """
+
+    def __init__(self, transport):
+        """
+        :param transport: transport making the calls (ex: thousandeyes)
+        """
+        self.transport = transport
+        self.responses = {}
+
+    def request(self, method, url, **kwargs):
+        response = self.transport.request(method, url, **kwargs)
+        try:
+            self.responses[url] = {'status': response.status_code, 'body': response.json()}
+        except ValueError:
+            pass
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def save(self, path, **fields):
+        """
+        Write the recorded responses to a fixture file
+        :param path: fixture file path
+        :param fields: other fixture fields (ex: the test creation 'result')
+        """
+        with open(path, 'w') as fixture_file:
+            json.dump(dict(fields, responses=self.responses), fixture_file, indent=1)
+
+
+# Process-wide ThousandEyes rate limiter (organization rate limit is per minute), its token bucket is shared by the
+# worker processes of a multi-worker deployment
+thousandeyes_limiter = RateLimiter(rate=config.TE_RATE_LIMIT_PER_MINUTE / 60, burst=config.TE_RATE_LIMIT_BURST,
+                                   min_concurrency=config.TE_MIN_CONCURRENCY,
+                                   max_concurrency=config.TE_MAX_CONCURRENCY, latency_target=config.TE_LATENCY_TARGET,
+                                   path=config.SHARED_STATE_PATH or None)
+
+# Shared ThousandEyes transport (used by test_creation and generate_result)
+thousandeyes = Transport(THOUSAND_EYES_TOKEN, pool_size=config.TE_POOL_SIZE,
+                         connect_timeout=config.TE_CONNECT_TIMEOUT, read_timeout=config.TE_READ_TIMEOUT,
+                         retries=config.TE_RETRIES, backoff=config.TE_RETRY_BACKOFF, limiter=thousandeyes_limiter,
+                         throttle_retries=config.TE_THROTTLE_RETRIES)
+
+# Limiter state, read at scrape time
+registry.gauge_from('thousandeyes_limiter_waiting', 'ThousandEyes calls waiting for the rate limiter',
+                    lambda: thousandeyes_limiter.stats()['waiting'])
+registry.gauge_from('thousandeyes_limiter_in_flight', 'ThousandEyes calls in flight',
+                    lambda: thousandeyes_limiter.stats()['in_flight'])
+registry.gauge_from('thousandeyes_limiter_concurrency_limit', 'Current adaptive ThousandEyes concurrency limit',
+                    lambda: thousandeyes_limiter.stats()['concurrency_limit'])
+registry.gauge_from('thousandeyes_limiter_rate', 'Current ThousandEyes request rate limit (requests per second)',
+                    lambda: thousandeyes_limiter.stats()['rate'])
+registry.counter_from('thousandeyes_throttled_total', 'ThousandEyes calls throttled (429)',
+                      lambda: thousandeyes_limiter.stats()['throttled'])
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+__author__ = "Trevor Maco <tmaco@cisco.com>, Josh Ingeniero <jingenie@cisco.com>"
+__copyright__ = "Copyright (c) 2023 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+import collections
+import logging
+import queue
+import threading
+import time
+
+from metrics import registry
+from rate_limit import TokenBucket, retry_after_seconds
+from tracing import current_span, tracer
+
+logger = logging.getLogger(__name__)
+
+# Outbound message metrics
+DISPATCH_SECONDS = registry.histogram('webex_message_dispatch_seconds', 'Webex message latency, queued to sent',
+                                      labels=('action',))
+MESSAGES = registry.counter('webex_messages_total', 'Webex messages by action and outcome',
+                            labels=('action', 'outcome'))
+
+
+def error_status(error):
+    """
+    HTTP status of a failed Webex API call (webexteamssdk ApiError), if any
+    """
+    status = getattr(error, 'status_code', None)
+    if status is None and getattr(error, 'response', None) is not None:
+        status = getattr(error.response, 'status_code', None)
+    return status
+
+
+def error_retry_after(error, default):
+    """
+    Seconds to wait before retrying a throttled Webex API call
+    """
+    retry_after = getattr(error, 'retry_after', None)
+    if retry_after is not None:
+        return retry_after
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    return retry_after_seconds(headers.get('Retry-After'), default)
+
+
+class Messages:
+    """
+    Drop-in for webexteamssdk's api.messages (create/delete), queued through the dispatcher
+    """
+
+    def __init__(self, dispatcher):
+        self._dispatcher = dispatcher
+
+    def create(self, roomId, **kwargs):
+        """
+        Queue a new message for a room
+        """
+        self._dispatcher.enqueue(roomId, 'create', dict(kwargs, roomId=roomId))
+
+    def delete(self, messageId, roomId=None):
+        """
+        Queue a message deletion (ordered with the room's other messages if roomId is given)
+        """
+        self._dispatcher.enqueue(roomId, 'delete', {'messageId': messageId})
+
+
+class WebexDispatcher:
+    """
+    Single outbound queue for Webex messages: messages to the same room are sent in order (one at a time), all rooms
+    share a global rate cap, throttled (429) and failed (5xx) sends are retried after Retry-After / backoff a bounded
+    number of times
+    """
+
+    def __init__(self, api, rate, burst, workers, max_retries, backoff=1.0):
+        """
+        :param api: webexteamssdk api instance
+        :param rate: messages per second (all rooms)
+        :param burst: messages that can be sent back to back
+        :param workers: number of sender threads
+        :param max_retries: retries per message before it is dropped
+        :param backoff: seconds before the first retry of a failed send (doubled on every retry)
+        """
+        self.api = api
+        self.bucket = TokenBucket(rate, burst)
+        self.workers = workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.messages = Messages(self)
+
+        self._rooms = {}  # roomId -> deque of pending messages
+        self._ready = queue.Queue()  # rooms with pending messages and no send in progress
+        self._lock = threading.Lock()
+        self._threads = []
+
+        # Counters
+        self.backlog = 0
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def start(self):
+        """
+        Start sender threads (no-op if already started)
+        """
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._worker, name=f'webex-dispatch-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def enqueue(self, room_id, action, fields):
+        """
+        Queue a Webex API call
+        :param room_id: roomId (ordering key), None for calls that don't need ordering
+        :param action: 'create' or 'delete'
+        :param fields: call arguments
+        """
+        # The span enqueuing the message (if traced) is the parent of its dispatch span
+        message = (action, fields, time.monotonic(), current_span())
+        with self._lock:
+            self.backlog += 1
+            pending = self._rooms.get(room_id)
+            if pending is None:
+                self._rooms[room_id] = collections.deque([message])
+                self._ready.put(room_id)
+            else:
+                pending.append(message)
+
+    def _worker(self):
+        """
+        Sender loop: take a ready room, send its oldest message, hand the room back if it has more
+        """
+        while True:
+            room_id = self._ready.get()
+            with self._lock:
+                action, fields, queued_at, (trace_id, parent_id) = self._rooms[room_id].popleft()
+
+            outcome, attempts = self._send(action, fields, queued_at)
+            if trace_id is not None:
+                now = time.time()
+                tracer.record('webex.dispatch', now - (time.monotonic() - queued_at), now, trace_id=trace_id,
+                              parent_id=parent_id, status='ok' if outcome == 'sent' else 'error', action=action,
+                              attempts=attempts)
+
+            with self._lock:
+                self.backlog -= 1
+                if self._rooms[room_id]:
+                    self._ready.put(room_id)
+                else:
+                    del self._rooms[room_id]
+
+    def _send(self, action, fields, queued_at):
+        """
+        Send one message, retrying throttled and failed sends
+        :return: (outcome 'sent' or 'failed', number of attempts)
+        """
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            try:
+                if action == 'create':
+                    self.api.messages.create(**fields)
+                else:
+                    self.api.messages.delete(fields['messageId'])
+            except Exception as e:
+                status = error_status(e)
+                if attempt < self.max_retries and (status == 429 or status is None or status >= 500):
+                    with self._lock:
+                        self.retried += 1
+                    MESSAGES.inc(action=action, outcome='retried')
+                    if status == 429:
+                        # Webex rate limits are per bot: hold every room, not just this one
+                        wait = error_retry_after(e, default=self.backoff)
+                        self.bucket.pause(wait)
+                    else:
+                        wait = self.backoff * 2 ** attempt
+                    logger.warning(f'Webex {action} failed ({status}), retrying in {wait}s')
+                    time.sleep(wait)
+                    continue
+
+                logger.error(f'Webex {action} failed ({status}), giving up: {str(e)}')
+                with self._lock:
+                    self.failed += 1
+                MESSAGES.inc(action=action, outcome='failed')
+                return 'failed', attempt + 1
+
+            latency = time.monotonic() - queued_at
+            DISPATCH_SECONDS.observe(latency, action=action)
+            MESSAGES.inc(action=action, outcome='sent')
+            with self._lock:
+                self.sent += 1
+                self.latency_total += latency
+                self.latency_max = max(self.latency_max, latency)
+            return 'sent', attempt + 1
+
+    def stats(self):
+        """
+        Snapshot of dispatcher state and counters
+        :return: dictionary of dispatcher statistics (latency is from enqueue to sent, in seconds)
+        """
+        with self._lock:
+            return {'backlog': self.backlog, 'rooms': len(self._rooms), 'sent': self.sent, 'failed': self.failed,
+                    'retried': self.retried,
+                    'latency_avg': self.latency_total / self.sent if self.sent else 0.0,
+                    'latency_max': self.latency_max}
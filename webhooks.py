@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+__author__ = "Trevor Maco <tmaco@cisco.com>, Josh Ingeniero <jingenie@cisco.com>"
+__copyright__ = "Copyright (c) 2023 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+import collections
+import concurrent.futures
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Webhooks listed per page (Webex maximum), the listing is one request for most bots
+LIST_PAGE_SIZE = 100
+
+
+def plan(desired, existing):
+    """
+    Diff the desired webhooks of the bot against its existing webhooks. Each desired webhook is matched to the closest
+    existing one (same target url, then same resource and event, then same name); other existing webhooks with a
+    desired name or target url are duplicates (ex: left by an earlier tunnel url) and deleted, unrelated webhooks are
+    left alone
+    :param desired: list of webhook dictionaries (name, targetUrl, resource, event)
+    :param existing: existing webhooks (objects with id, name, targetUrl, resource, event and status attributes)
+    :return: list of (action, desired webhook, existing webhook), action is one of create, update (name, target url or
+    inactive status), replace (resource or event differ, Webex can't update them), delete, unchanged
+    """
+    remaining = list(existing)
+    actions = []
+    for webhook in desired:
+        candidates = [hook for hook in remaining
+                      if hook.targetUrl == webhook['targetUrl'] or hook.name == webhook['name']]
+        if not candidates:
+            actions.append(('create', webhook, None))
+            continue
+
+        hook = max(candidates, key=lambda hook: (hook.targetUrl == webhook['targetUrl'],
+                                                 (hook.resource, hook.event) == (webhook['resource'], webhook['event']),
+                                                 hook.name == webhook['name']))
+        remaining.remove(hook)
+        if (hook.resource, hook.event) != (webhook['resource'], webhook['event']):
+            actions.append(('replace', webhook, hook))
+        elif (hook.name, hook.targetUrl) != (webhook['name'], webhook['targetUrl']) or \
+                getattr(hook, 'status', 'active') != 'active':
+            actions.append(('update', webhook, hook))
+        else:
+            actions.append(('unchanged', webhook, hook))
+
+    names = {webhook['name'] for webhook in desired}
+    urls = {webhook['targetUrl'] for webhook in desired}
+    actions += [('delete', None, hook) for hook in remaining if hook.name in names or hook.targetUrl in urls]
+    return actions
+
+
+def apply(api, action, webhook, hook):
+    """
+    Carry out one planned action (see plan)
+    :param api: webexteamssdk api instance
+    """
+    if action in ('replace', 'delete'):
+        api.webhooks.delete(hook.id)
+    if action in ('create', 'replace'):
+        api.webhooks.create(webhook['name'], webhook['targetUrl'], resource=webhook['resource'],
+                            event=webhook['event'])
+    elif action == 'update':
+        api.webhooks.update(hook.id, name=webhook['name'], targetUrl=webhook['targetUrl'], status='active')
+
+
+def reconcile(api, desired, workers=4):
+    """
+    Bring the bot's webhooks in line with the desired ones: list the existing webhooks once, then create, update,
+    replace or delete only what differs, concurrently
+    :param api: webexteamssdk api instance
+    :param desired: list of webhook dictionaries (name, targetUrl, resource, event)
+    :param workers: maximum number of concurrent Webex calls
+    :return: Counter of action -> number of webhooks ('failed' counts the actions that raised)
+    """
+    actions = plan(desired, api.webhooks.list(max=LIST_PAGE_SIZE))
+    outcomes = collections.Counter(action for action, _, _ in actions if action == 'unchanged')
+    changes = [entry for entry in actions if entry[0] != 'unchanged']
+    if not changes:
+        return outcomes
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(workers, len(changes))) as executor:
+        futures = {executor.submit(apply, api, *entry): entry for entry in changes}
+        for future in concurrent.futures.as_completed(futures):
+            action, webhook, hook = futures[future]
+            try:
+                future.result()
+                outcomes[action] += 1
+            except Exception as e:
+                target = webhook['targetUrl'] if webhook is not None else hook.targetUrl
+                logger.error(f'Unable to {action} webhook {target}: {str(e)}')
+                outcomes['failed'] += 1
+    return outcomes
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+__author__ = "Trevor Maco <tmaco@cisco.com>, Josh Ingeniero <jingenie@cisco.com>"
+__copyright__ = "Copyright (c) 2023 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+import collections
+import logging
+import threading
+
+# Supported overflow policies (what happens when a job is submitted to a full queue)
+OVERFLOW_REJECT = 'reject'
+OVERFLOW_DROP_OLDEST = 'drop_oldest'
+
+logger = logging.getLogger(__name__)
+
+
+class WorkQueue:
+    """
+    Bounded background work queue, runs submitted jobs on a fixed pool of daemon worker threads
+    """
+
+    def __init__(self, depth, workers, overflow=OVERFLOW_REJECT, name='work-queue'):
+        """
+        :param depth: maximum number of jobs waiting to run
+        :param workers: number of worker threads
+        :param overflow: overflow policy when the queue is full (options: reject, drop_oldest)
+        :param name: thread name prefix
+        """
+        if overflow not in (OVERFLOW_REJECT, OVERFLOW_DROP_OLDEST):
+            raise ValueError(f"Unknown overflow policy: {overflow}")
+
+        self.depth = depth
+        self.workers = workers
+        self.overflow = overflow
+        self.name = name
+
+        self._jobs = collections.deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._threads = []
+        self._busy = 0
+
+        # Counters
+        self.submitted = 0
+        self.rejected = 0
+        self.dropped = 0
+        self.completed = 0
+        self.failed = 0
+
+    def start(self):
+        """
+        Start worker threads (no-op if already started)
+        """
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._worker, name=f'{self.name}-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, func, *args, on_drop=None, **kwargs):
+        """
+        Queue a job for a background worker
+        :param func: callable to run
+        :param on_drop: optional callable, invoked (with no arguments) if the job is evicted by the drop_oldest policy
+        :return: True if the job was queued, False if it was rejected because the queue is full
+        """
+        evicted = None
+        with self._lock:
+            if len(self._jobs) >= self.depth:
+                if self.overflow == OVERFLOW_REJECT:
+                    self.rejected += 1
+                    return False
+                evicted = self._jobs.popleft()
+                self.dropped += 1
+
+            self._jobs.append((func, args, kwargs, on_drop))
+            self.submitted += 1
+            self._not_empty.notify()
+
+        if evicted:
+            logger.warning(f'{self.name} full, dropped oldest queued job {evicted[0].__name__}')
+            if evicted[3]:
+                try:
+                    evicted[3]()
+                except Exception as e:
+                    logger.error(f'{self.name} drop callback failed: {str(e)}')
+
+        return True
+
+    def stats(self):
+        """
+        Snapshot of queue state and counters
+        :return: dictionary of queue statistics
+        """
+        with self._lock:
+            return {'queued': len(self._jobs), 'busy': self._busy, 'depth': self.depth, 'workers': self.workers,
+                    'submitted': self.submitted, 'rejected': self.rejected, 'dropped': self.dropped,
+                    'completed': self.completed, 'failed': self.failed}
+
+    def _worker(self):
+        """
+        Worker loop, pull jobs off the queue and run them forever
+        """
+        while True:
+            with self._lock:
+                while not self._jobs:
+                    self._not_empty.wait()
+                func, args, kwargs, _ = self._jobs.popleft()
+                self._busy += 1
+
+            try:
+                func(*args, **kwargs)
+                succeeded = True
+            except Exception as e:
+                logger.exception(f'{self.name} job {func.__name__} failed: {str(e)}')
+                succeeded = False
+
+            with self._lock:
+                self._busy -= 1
+                if succeeded:
+                    self.completed += 1
+                else:
+                    self.failed += 1
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+
+Worker process of the 'durable' card dispatch mode: claims the card submissions queued by the bot (app.py / wsgi.py)
+in the durable job queue, runs the tests and delivers the results. Run as many worker processes as needed, on the
+host of the bot (the queue and delivery store are local SQLite files); one of them also polls result deliveries.
+
+Usage: python3 worker.py [threads]
+"""
+
+__author__ = "Trevor Maco <tmaco@cisco.com>, Josh Ingeniero <jingenie@cisco.com>"
+__copyright__ = "Copyright (c) 2023 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+import os
+import signal
+import sys
+import threading
+import time
+
+import config
+
+# Worker processes spend one ThousandEyes rate budget and share their lookups (SHARED_STATE_PATH defaults to the
+# delivery store file name with a .shared suffix, the same as under wsgi.py)
+if not config.SHARED_STATE_PATH:
+    config.SHARED_STATE_PATH = f'{config.DELIVERY_STORE_PATH}.shared'
+
+# Imported once the shared path is set, the bot opens its shared stores on import
+import bot
+
+# Seconds an exiting worker waits for its queued Webex messages to be sent
+DRAIN_TIMEOUT = 30
+
+
+def run_job(job):
+    """
+    Run one card submission of the job queue (see bot.process_card), acknowledge it once its tests are launched and
+    its delivery is stored, give it back to the queue if it raised
+    :param job: job claimed from the queue
+    """
+    payload = job['payload']
+    room_id = payload['data']['roomId']
+
+    # Its last attempt never finished (the worker running it exited)
+    if job['attempts'] > bot.job_queue.max_attempts:
+        bot.job_queue.fail(job['id'], 'Worker exited while running the job')
+        bot.notify_dropped(room_id, payload['card_key'])
+        return
+
+    try:
+        # The card is acknowledged once, a retry doesn't delete it or tell the user again
+        if not payload.get('acknowledged'):
+            bot.acknowledge_card(payload['data'], payload['trace_id'])
+            payload['acknowledged'] = True
+            bot.job_queue.update(job['id'], payload)
+
+        bot.process_card(payload['data'], payload['info'], trace_id=payload['trace_id'],
+                         submitted_at=payload['submitted_at'] if job['attempts'] == 1 else None, acknowledge=False)
+    except Exception as e:
+        bot.console.print(f'[red]Card submission {job["id"]} failed (attempt {job["attempts"]}): {str(e)}[/]')
+        if not bot.job_queue.retry(job['id'], str(e)):
+            bot.notify_dropped(room_id, payload['card_key'])
+        return
+
+    bot.job_queue.ack(job['id'])
+
+
+def consume(name, stopped):
+    """
+    Worker thread loop: claim and run jobs until the worker is stopped
+    :param name: worker thread name, recorded on the jobs it claims
+    :param stopped: threading.Event set when the worker exits
+    """
+    while not stopped.is_set():
+        try:
+            job = bot.job_queue.claim(name)
+        except Exception as e:
+            bot.console.print(f'[red]Job queue unavailable: {str(e)}[/]')
+            job = None
+
+        if job is None:
+            stopped.wait(config.JOB_POLL_INTERVAL)
+            continue
+        run_job(job)
+
+
+def main():
+    if config.DISPATCH_MODE != 'durable':
+        sys.exit('worker.py needs DISPATCH_MODE = "durable" in config.py')
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else config.JOB_WORKER_THREADS
+
+    # Result deliveries of every worker process are polled by the scheduler leader among them
+    bot.start_delivery_scheduler()
+
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopped.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stopped.set())
+
+    consumers = [threading.Thread(target=consume, args=(f'{os.uname().nodename}-{os.getpid()}-{i}', stopped),
+                                  name=f'job-worker-{i}') for i in range(threads)]
+    for consumer in consumers:
+        consumer.start()
+    bot.console.print(f'Worker {os.getpid()} running {threads} threads, job queue: {bot.job_queue.depth()}')
+
+    # Jobs in progress are finished (and acknowledged) before exiting, then their messages are sent
+    for consumer in consumers:
+        while consumer.is_alive():
+            consumer.join(1)
+    deadline = time.time() + DRAIN_TIMEOUT
+    while bot.outbox.stats()['backlog'] and time.time() < deadline:
+        time.sleep(0.1)
+
+
+if __name__ == '__main__':
+    main()
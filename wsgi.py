@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+
+WSGI entry point of the bot for multi-worker servers, ex: gunicorn -w 4 -b 0.0.0.0:4000 wsgi:app
+Every worker process imports the bot and starts its own background threads, so the app must not be loaded before
+the workers are forked (no --preload). See the multi-worker deployment section of the README.
+"""
+
+__author__ = "Trevor Maco <tmaco@cisco.com>, Josh Ingeniero <jingenie@cisco.com>"
+__copyright__ = "Copyright (c) 2023 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+import config
+from leader import LeaderLock
+
+# Several worker processes share the delivery store: they always elect a scheduler leader, so each delivery is polled
+# and sent by one process (SCHEDULER_LOCK_PATH defaults to the delivery store file name with a .lock suffix)
+if not config.SCHEDULER_LOCK_PATH:
+    config.SCHEDULER_LOCK_PATH = f'{config.DELIVERY_STORE_PATH}.lock'
+
+# Webhook redeliveries can land on another worker process, and lookups made by one are reused by the others: the
+# workers always share state (SHARED_STATE_PATH defaults to the delivery store file name with a .shared suffix)
+if not config.SHARED_STATE_PATH:
+    config.SHARED_STATE_PATH = f'{config.DELIVERY_STORE_PATH}.shared'
+
+# Imported once the shared paths are set, the bot starts its scheduler and opens its shared stores on import
+from app import app, register_webhooks
+
+# The WSGI application served by the worker processes
+__all__ = ['app']
+
+# Webhooks are reconciled once at startup (in the background), by the worker process that takes the webhook lock first
+# (the scheduler leader isn't elected among these processes in durable mode, the workers of worker.py elect it)
+webhook_lock = LeaderLock(f'{config.SCHEDULER_LOCK_PATH}.webhooks')
+if webhook_lock.acquire():
+    register_webhooks()